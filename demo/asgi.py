@@ -3,6 +3,11 @@ ASGI config for demo project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Live dashboard updates (``dashboard/events/``) are long-lived Server-Sent
+Events streams, so they need this ASGI entry point, e.g.:
+
+    gunicorn -c gunicorn.conf.py -k uvicorn.workers.UvicornWorker demo.asgi
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.0/howto/deployment/asgi/
 """
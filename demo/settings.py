@@ -24,7 +24,7 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 SECRET_KEY = 'django-insecure-1j@^$q2l4jc-+vdk7$*fk)j+si0k2f)urofo#f6*544+1@e=di'
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+DEBUG = os.environ.get('DJANGO_DEBUG', 'True') == 'True'
 
 ALLOWED_HOSTS = ['visionsaver.azurewebsites.net',"*"]
 
@@ -79,7 +79,7 @@ os.environ['TZ'] = 'Asia/Kolkata'
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'NAME': os.environ.get('VISIONCARE_DB_PATH', BASE_DIR / 'db.sqlite3'),
     }
 }
 
@@ -119,7 +119,8 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/5.0/howto/static-files/
 
 STATIC_URL = '/static/'
-STATIC_ROOT='firstApp/static/firstApp'
+# Filled by `manage.py build_assets` with hashed, pre-compressed copies
+STATIC_ROOT = BASE_DIR / "staticfiles"
 STATICFILES_DIRS=[
     BASE_DIR / "static",
 ]
@@ -128,7 +129,44 @@ CSRF_TRUSTED_ORIGINS = ['https://visionsaver.azurewebsites.net']
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 import os 
 MEDIA_URL = '/media/'
-MEDIA_ROOT = os.path.join(BASE_DIR,'media')
+MEDIA_ROOT = os.environ.get('VISIONCARE_MEDIA_ROOT', os.path.join(BASE_DIR,'media'))
+
+# Media backend (VISIONCARE_MEDIA_BACKEND):
+#   fs           - MEDIA_ROOT on local disk.  Cold reports are moved into monthly
+#                  pack files by `manage.py archive_media` and read back transparently.
+#   s3           - S3-compatible bucket shared by every node (firstApp/objectstore.py)
+#   local-object - the object-store code path over a local directory
+MEDIA_CACHE_OPTIONS = {
+    "cache_dir": os.environ.get('VISIONCARE_MEDIA_CACHE_DIR'),
+    "cache_mb": int(os.environ.get('VISIONCARE_MEDIA_CACHE_MB', 512)),
+}
+MEDIA_STORAGES = {
+    "fs": {
+        "BACKEND": "firstApp.packstore.PackedFileSystemStorage",
+    },
+    "s3": {
+        "BACKEND": "firstApp.objectstore.S3Storage",
+        "OPTIONS": {
+            "bucket": os.environ.get('VISIONCARE_S3_BUCKET'),
+            "endpoint_url": os.environ.get('VISIONCARE_S3_ENDPOINT_URL'),
+            "region": os.environ.get('VISIONCARE_S3_REGION'),
+            # CDN or public bucket URL; presigned URLs are used when unset
+            "public_url": os.environ.get('VISIONCARE_S3_PUBLIC_URL'),
+            "max_connections": int(os.environ.get('VISIONCARE_S3_MAX_CONNECTIONS', 16)),
+            **MEDIA_CACHE_OPTIONS,
+        },
+    },
+    "local-object": {
+        "BACKEND": "firstApp.objectstore.LocalObjectStorage",
+        "OPTIONS": MEDIA_CACHE_OPTIONS,
+    },
+}
+STORAGES = {
+    "default": MEDIA_STORAGES[os.environ.get('VISIONCARE_MEDIA_BACKEND', 'fs')],
+    "staticfiles": {
+        "BACKEND": "firstApp.assets.CompressedManifestStaticFilesStorage",
+    },
+}
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class FirstappConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'firstApp'
+
+    def ready(self):
+        # Register the dashboard event and rollup signal handlers
+        from . import events, rollups  # noqa: F401
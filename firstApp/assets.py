@@ -0,0 +1,132 @@
+"""
+Static asset pipeline.
+
+``collectstatic`` (or ``manage.py build_assets``) copies every asset into
+STATIC_ROOT under a content-hashed name, writes staticfiles.json mapping the
+original names to the hashed ones, and stores pre-compressed .gz (and .br,
+when the brotli package is installed) siblings of every text asset.
+``serve_asset`` hands out the smallest variant the client accepts, with
+far-future cache headers for hashed names.
+"""
+import gzip
+import mimetypes
+import os
+from functools import lru_cache
+from urllib.parse import unquote, urlsplit
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage, staticfiles_storage
+from django.utils._os import safe_join
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE = ('.css', '.js', '.json', '.map', '.svg', '.txt', '.html', '.xml', '.eot', '.ttf', '.otf')
+MIN_SIZE = 512
+IMMUTABLE = 'public, max-age=31536000, immutable'
+SHORT_LIVED = 'public, max-age=3600'
+
+# Preferred first
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+
+def _compress_file(path):
+    """Write .gz/.br next to ``path``; returns the suffixes actually kept."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) < MIN_SIZE:
+        return []
+    variants = [('.gz', gzip.compress(data, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        variants.append(('.br', brotli.compress(data, quality=11)))
+
+    kept = []
+    for suffix, payload in variants:
+        # Not worth a second file (and a Content-Encoding round trip) otherwise
+        if len(payload) < len(data) * 0.95:
+            with open(path + suffix, 'wb') as out:
+                out.write(payload)
+            kept.append(suffix)
+    return kept
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """ManifestStaticFilesStorage that also pre-compresses text assets."""
+
+    def hashed_name(self, name, content=None, filename=None):
+        try:
+            return super().hashed_name(name, content, filename)
+        except ValueError:
+            # Vendored CSS (owl.carousel) references images that were never
+            # shipped; leave those URLs alone instead of failing the build.
+            # Any other failure is a real error.
+            path = urlsplit(unquote(filename or name)).path.strip()
+            if content is None and not self.exists(path):
+                return name
+            raise
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        for name in set(self.hashed_files.values()):
+            if name.endswith(COMPRESSIBLE):
+                _compress_file(self.path(name))
+
+
+@lru_cache(maxsize=1)
+def hashed_names():
+    return frozenset(getattr(staticfiles_storage, 'hashed_files', {}).values())
+
+
+def accepted_encodings(accept_encoding):
+    """Content-coding -> q-value from an Accept-Encoding header."""
+    accepted = {}
+    for part in accept_encoding.split(','):
+        coding, _, params = part.partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(';'):
+            key, _, value = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding] = q
+    return accepted
+
+
+def pick_variant(path, accept_encoding):
+    """Return (file path, content-encoding or None) for the best variant.
+
+    The client's highest q-value wins, then the order of ENCODINGS; q=0
+    means "not acceptable".
+    """
+    accepted = accepted_encodings(accept_encoding)
+    best, best_q = (path, None), 0.0
+    for encoding, suffix in ENCODINGS:
+        q = accepted.get(encoding, accepted.get('*', 0.0))
+        if q > best_q and os.path.isfile(path + suffix):
+            best, best_q = (path + suffix, encoding), q
+    return best
+
+
+def collected_path(name):
+    if not settings.STATIC_ROOT:
+        return None
+    try:
+        path = safe_join(settings.STATIC_ROOT, name)
+    except Exception:
+        return None
+    return path if os.path.isfile(path) else None
+
+
+def asset_headers(name):
+    content_type, _ = mimetypes.guess_type(name)
+    cache_control = IMMUTABLE if name in hashed_names() else SHORT_LIVED
+    return content_type or 'application/octet-stream', cache_control
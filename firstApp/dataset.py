@@ -0,0 +1,230 @@
+"""
+Sharded training-set export.
+
+Labelled EyeReport images are preprocessed exactly as ``makepredictions()``
+does it (224x224 RGB) and stored as uint8 tensors in fixed-size ``.npy``
+shards, so training and re-scoring jobs can ``np.load(..., mmap_mode='r')``
+them and skip JPEG decoding entirely:
+
+    dataset/
+        manifest.json       classes, image size, shard size, export cursor
+        index.csv           shard, row, report id, patient id, label, sha256
+        shard-00000.npy     (SHARD_SIZE, 224, 224, 3) uint8
+        shard-00001.npy     ...
+
+Every shard is allocated at full size, and index.csv says which rows are
+filled.  Later exports append: they carry on from the last report id read,
+retry the reports listed as failed in the manifest, fill the last shard and
+open new ones.  Images whose bytes are already
+in the index are skipped.  index.csv is written after the shard rows and is
+the source of truth, so an interrupted export can simply be run again.
+"""
+import csv
+import hashlib
+import io
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .preprocess import CLASSES, preprocess_image
+
+IMAGE_SIZE = 224
+SHARD_SIZE = 1024
+MANIFEST_NAME = 'manifest.json'
+INDEX_NAME = 'index.csv'
+INDEX_HEADER = ['shard', 'row', 'report_id', 'patient_id', 'label', 'label_index', 'eye', 'sha256']
+
+
+def shard_path(root, shard):
+    return os.path.join(root, f'shard-{shard:05d}.npy')
+
+
+def tensor(data):
+    """Image bytes -> (224, 224, 3) uint8, the model's input before float conversion."""
+    return preprocess_image(io.BytesIO(data)).astype(np.uint8)
+
+
+def _tensor_or_error(data):
+    # Runs in the worker processes; errors come back as values so one bad
+    # image does not abort the batch
+    try:
+        return tensor(data), None
+    except Exception as e:
+        return None, str(e)
+
+
+def read_index(root):
+    """Rows of index.csv as dicts; a line cut off by an interrupted export is dropped."""
+    path = os.path.join(root, INDEX_NAME)
+    if not os.path.exists(path):
+        return []
+    with open(path, 'rb+') as f:
+        data = f.read()
+        if data and not data.endswith(b'\n'):
+            f.truncate(data.rfind(b'\n') + 1)
+    with open(path, newline='') as f:
+        return list(csv.DictReader(f))
+
+
+def load(root):
+    """(images, index) for an export: one read-only memmap per shard, trimmed to its filled rows."""
+    index = read_index(root)
+    filled = {}
+    for row in index:
+        shard = int(row['shard'])
+        filled[shard] = max(filled.get(shard, 0), int(row['row']) + 1)
+    images = [np.load(shard_path(root, shard), mmap_mode='r')[:rows] for shard, rows in sorted(filled.items())]
+    return images, index
+
+
+class DatasetWriter:
+    """Appends preprocessed images to the shards of an export directory."""
+
+    def __init__(self, root, shard_size=SHARD_SIZE):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        manifest = self.read_manifest()
+        if manifest and manifest['shard_size'] != shard_size:
+            raise ValueError(f"{root} uses {manifest['shard_size']} images per shard; export with --full to change it.")
+        if manifest and manifest['classes'] != CLASSES:
+            raise ValueError(f"{root} was exported with different classes; export with --full.")
+        self.shard_size = shard_size
+        self.last_report_id = manifest['last_report_id'] if manifest else 0
+        # Reports at or below the cursor whose image could not be read or decoded
+        self.failed_report_ids = manifest.get('failed_report_ids', []) if manifest else []
+
+        index = read_index(root)
+        self.hashes = {row['sha256'] for row in index}
+        self.count = len(index)
+        last = index[-1] if index else None
+        self.shard = int(last['shard']) if last else 0
+        self.row = int(last['row']) + 1 if last else 0
+        self._shard = None
+
+        new_index = not os.path.exists(os.path.join(root, INDEX_NAME))
+        self._index_file = open(os.path.join(root, INDEX_NAME), 'a', newline='')
+        self._index = csv.writer(self._index_file)
+        if new_index:
+            self._index.writerow(INDEX_HEADER)
+
+    def read_manifest(self):
+        try:
+            with open(os.path.join(self.root, MANIFEST_NAME)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _open_shard(self):
+        if self.row == self.shard_size:
+            self._close_shard()
+            self.shard += 1
+            self.row = 0
+        if self._shard is None:
+            path = shard_path(self.root, self.shard)
+            shape = (self.shard_size, IMAGE_SIZE, IMAGE_SIZE, 3)
+            if os.path.exists(path):
+                self._shard = np.load(path, mmap_mode='r+')
+            else:
+                # Untouched rows are never written, so the file stays sparse
+                self._shard = np.lib.format.open_memmap(path, mode='w+', dtype=np.uint8, shape=shape)
+        return self._shard
+
+    def _close_shard(self):
+        if self._shard is not None:
+            self._shard.flush()
+            self._shard = None
+
+    def append(self, items):
+        """Write [(report, sha256, tensor)] and index them."""
+        rows = []
+        for report, digest, image in items:
+            shard = self._open_shard()
+            shard[self.row] = image
+            rows.append([self.shard, self.row, report.id, report.patient_id, report.disease,
+                         CLASSES.index(report.disease), report.eye, digest])
+            self.hashes.add(digest)
+            self.row += 1
+        # Shard rows reach the disk before the index points at them
+        if self._shard is not None:
+            self._shard.flush()
+        self._index.writerows(rows)
+        self._index_file.flush()
+        os.fsync(self._index_file.fileno())
+        self.count += len(rows)
+
+    def close(self, last_report_id, failed_report_ids=()):
+        """Write the manifest; ``failed_report_ids`` replaces the earlier list, whose reports were retried."""
+        self._close_shard()
+        self._index_file.close()
+        self.last_report_id = max(self.last_report_id, last_report_id)
+        self.failed_report_ids = sorted(failed_report_ids)
+        manifest = {
+            'classes': CLASSES,
+            'image_size': IMAGE_SIZE,
+            'shard_size': self.shard_size,
+            'dtype': 'uint8',
+            'images': self.count,
+            'shards': self.shard + 1 if self.count else 0,
+            'last_report_id': self.last_report_id,
+            'failed_report_ids': self.failed_report_ids,
+        }
+        tmp = os.path.join(self.root, MANIFEST_NAME + '.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp, os.path.join(self.root, MANIFEST_NAME))
+        return manifest
+
+
+def export(reports, writer, workers=None, block=256, on_error=None):
+    """Preprocess ``reports`` in a process pool and append them to ``writer``.
+
+    Images are read from storage here and decoded in the workers, ``block``
+    at a time, so memory stays bounded however many reports there are.
+    Returns (exported, skipped duplicates, failed report ids, last report id
+    seen); pass the failed ids to ``writer.close`` so the next export retries them.
+    """
+    exported = skipped = 0
+    failed = []
+    last_id = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = []
+
+        def flush():
+            nonlocal exported
+            results = pool.map(_tensor_or_error, [data for _, _, data in pending], chunksize=8)
+            items = []
+            for (report, digest, _), (image, error) in zip(pending, results):
+                if image is None:
+                    failed.append(report.id)
+                    if on_error:
+                        on_error(report, error)
+                    continue
+                items.append((report, digest, image))
+            writer.append(items)
+            exported += len(items)
+            pending.clear()
+
+        seen = set()
+        for report in reports:
+            last_id = max(last_id, report.id)
+            try:
+                with report.report_image.open('rb') as f:
+                    data = f.read()
+            except (OSError, ValueError) as e:
+                failed.append(report.id)
+                if on_error:
+                    on_error(report, str(e))
+                continue
+            digest = hashlib.sha256(data).hexdigest()
+            if digest in writer.hashes or digest in seen:
+                skipped += 1
+                continue
+            seen.add(digest)
+            pending.append((report, digest, data))
+            if len(pending) == block:
+                flush()
+        if pending:
+            flush()
+    return exported, skipped, failed, last_id
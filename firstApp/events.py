@@ -0,0 +1,156 @@
+"""
+Live dashboard events.
+
+Writes to EyeReport and UserProfile append a DashboardEvent row describing
+the change (new/deleted report, counter and chart deltas).  Open
+dashboards keep a Server-Sent Events connection to ``dashboard_events`` and
+patch their tables and chart from these events instead of reloading.
+
+Events go through the database so every worker process sees them; each SSE
+connection polls for ids greater than the last one it sent.  Counters are
+sent as deltas worked out from the rows the handler already has, so a save
+never pays for recounting every patient.
+
+The stream holds its connection open for as long as the dashboard is open,
+which only an ASGI server can afford; ``live_updates()`` tells the views
+whether the request came in through one.
+"""
+import asyncio
+import json
+from datetime import timedelta
+
+from django.core.handlers.asgi import ASGIRequest
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import DashboardEvent, EyeReport, UserProfile
+
+POLL_INTERVAL = 1.0
+HEARTBEAT = 15.0
+RETENTION = timedelta(days=1)
+PRUNE_EVERY = 500
+
+
+def publish(kind, payload):
+    event = DashboardEvent.objects.create(kind=kind, payload=payload)
+    if event.id % PRUNE_EVERY == 0:
+        DashboardEvent.objects.filter(created__lt=timezone.now() - RETENTION).delete()
+    return event
+
+
+def live_updates(request):
+    """True when ``request`` is served by ASGI, where an open SSE stream costs no worker."""
+    return isinstance(request, ASGIRequest)
+
+
+def _scanned_delta(patient_id, n):
+    # Dashboards only count patient accounts
+    if not UserProfile.objects.filter(user_id=patient_id, role='patient').exists():
+        return {}
+    return {'scans_completed': n, 'patients_remaining': -n}
+
+
+def _latest_report(patient_id, exclude=None):
+    reports = EyeReport.objects.filter(patient_id=patient_id).select_related('visit')
+    if exclude:
+        reports = reports.exclude(id=exclude)
+    return reports.order_by('-date_time').first()
+
+
+def report_state(report):
+    if report is None:
+        return None
+    return {
+        'id': report.id,
+        # Dashboards show a visit at its worst stage
+        'disease': report.visit_stage,
+        'date_time': timezone.localtime(report.date_time).strftime('%d %b %Y %H:%M'),
+    }
+
+
+def _chart_delta(old, new):
+    delta = {}
+    if old:
+        delta[old] = delta.get(old, 0) - 1
+    if new:
+        delta[new] = delta.get(new, 0) + 1
+    return {disease: n for disease, n in delta.items() if n}
+
+
+# ---------------- Signal handlers ----------------
+@receiver(post_save, sender=EyeReport)
+def report_created(sender, instance, created, **kwargs):
+    if not created:
+        return
+    previous = _latest_report(instance.patient_id, exclude=instance.id)
+    publish('report_created', {
+        'patient_id': instance.patient_id,
+        'latest': report_state(instance),
+        'counts': _scanned_delta(instance.patient_id, 1) if previous is None else {},
+        'chart': _chart_delta(previous.visit_stage if previous else None, instance.visit_stage),
+    })
+
+
+@receiver(post_delete, sender=EyeReport)
+def report_deleted(sender, instance, **kwargs):
+    latest = _latest_report(instance.patient_id)
+    # Dashboards show the latest visit, whichever of its images this was
+    was_latest = (latest is None or latest.date_time <= instance.date_time
+                  or (instance.visit_id is not None and latest.visit_id == instance.visit_id))
+    publish('report_deleted', {
+        'report_id': instance.id,
+        'patient_id': instance.patient_id,
+        'latest': report_state(latest),
+        'counts': _scanned_delta(instance.patient_id, -1) if latest is None else {},
+        'chart': _chart_delta(instance.visit_stage, latest.visit_stage if latest else None) if was_latest else {},
+    })
+
+
+@receiver(post_save, sender=UserProfile)
+def profile_created(sender, instance, created, **kwargs):
+    if not created or instance.role != 'patient':
+        return
+    publish('patient_added', {
+        'patient_id': instance.user_id,
+        'username': instance.user.username,
+        'email': instance.user.email,
+        'counts': {'total_patients': 1, 'patients_remaining': 1},
+    })
+
+
+# ---------------- SSE stream ----------------
+def current_event_id():
+    """Id of the newest event; a page rendered now streams from here."""
+    return DashboardEvent.objects.order_by('-id').values_list('id', flat=True).first() or 0
+
+
+async def latest_event_id():
+    event = await DashboardEvent.objects.order_by('-id').afirst()
+    return event.id if event else 0
+
+
+def format_event(event):
+    return f"id: {event.id}\nevent: {event.kind}\ndata: {json.dumps(event.payload)}\n\n"
+
+
+async def event_stream(last_id=None):
+    """Yield SSE frames for every event after ``last_id`` until disconnected."""
+    if last_id is None:
+        last_id = await latest_event_id()
+    yield f"retry: 3000\nid: {last_id}\n\n"
+
+    idle = 0.0
+    while True:
+        events = [e async for e in DashboardEvent.objects.filter(id__gt=last_id).order_by('id')[:100]]
+        for event in events:
+            last_id = event.id
+            yield format_event(event)
+        if events:
+            idle = 0.0
+            continue
+        idle += POLL_INTERVAL
+        if idle >= HEARTBEAT:
+            idle = 0.0
+            yield ": keep-alive\n\n"
+        await asyncio.sleep(POLL_INTERVAL)
@@ -0,0 +1,125 @@
+"""
+Streaming ZIP export of EyeReport files.
+
+The archive is produced as a generator of byte chunks: zipfile writes into a
+small in-memory sink that is drained after every file chunk, so memory stays
+constant no matter how many reports are exported and nothing touches disk.
+"""
+import csv
+import hashlib
+import io
+import os
+import zipfile
+
+CHUNK_SIZE = 64 * 1024
+MANIFEST_NAME = "manifest.csv"
+MANIFEST_HEADER = [
+    "report_id", "patient_id", "patient", "disease", "date_time",
+    "image_path", "image_sha256", "pdf_path", "pdf_sha256",
+]
+
+
+class _StreamSink(io.RawIOBase):
+    """Write-only, non-seekable buffer that zipfile streams into."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._chunks.append(bytes(b))
+        return len(b)
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _copy_member(zf, sink, field_file, arcname):
+    """Stream ``field_file`` into the archive, yielding output as we go.
+
+    Returns the sha256 hex digest through StopIteration.value.
+    """
+    digest = hashlib.sha256()
+    info = zipfile.ZipInfo(arcname)
+    info.compress_type = zipfile.ZIP_STORED  # JPEG/PNG/PDF are already compressed
+    with field_file.storage.open(field_file.name, "rb") as src, \
+            zf.open(info, "w", force_zip64=True) as dest:
+        while True:
+            block = src.read(CHUNK_SIZE)
+            if not block:
+                break
+            digest.update(block)
+            dest.write(block)
+            data = sink.drain()
+            if data:
+                yield data
+    data = sink.drain()
+    if data:
+        yield data
+    return digest.hexdigest()
+
+
+def _report_folder(report):
+    return f"{report.patient.username}_{report.patient_id}"
+
+
+def iter_reports_zip(reports):
+    """Yield a ZIP archive of ``reports`` (images, PDFs and a CSV manifest)."""
+    sink = _StreamSink()
+    rows = []
+    # A visit PDF is shared by every report of the visit; store it once
+    written = {}
+    with zipfile.ZipFile(sink, "w", allowZip64=True) as zf:
+        for report in reports:
+            folder = _report_folder(report)
+            stamp = report.date_time.strftime("%Y%m%d_%H%M%S")
+            row = {
+                "report_id": report.id,
+                "patient_id": report.patient_id,
+                "patient": report.patient.username,
+                "disease": report.disease,
+                "date_time": report.date_time.isoformat(),
+            }
+            for field_file, kind in ((report.report_image, "image"), (report.pdf_report, "pdf")):
+                if not field_file:
+                    continue
+                if field_file.name in written:
+                    row[f"{kind}_path"], row[f"{kind}_sha256"] = written[field_file.name]
+                    continue
+                arcname = f"{folder}/{report.id}_{stamp}_{os.path.basename(field_file.name)}"
+                try:
+                    row[f"{kind}_sha256"] = yield from _copy_member(zf, sink, field_file, arcname)
+                    row[f"{kind}_path"] = arcname
+                    written[field_file.name] = (arcname, row[f"{kind}_sha256"])
+                except (FileNotFoundError, OSError) as e:
+                    print(f"Export: skipping {field_file.name}: {e}")
+                    row[f"{kind}_path"] = "missing"
+            rows.append(row)
+
+        manifest = io.StringIO()
+        writer = csv.DictWriter(manifest, fieldnames=MANIFEST_HEADER, restval="")
+        writer.writeheader()
+        writer.writerows(rows)
+        zf.writestr(MANIFEST_NAME, manifest.getvalue(), compress_type=zipfile.ZIP_DEFLATED)
+
+    data = sink.drain()
+    if data:
+        yield data
+
+
+def export_queryset(patient_id=None, start=None, end=None):
+    """Reports selected by patient and/or an inclusive date range."""
+    from .models import EyeReport
+
+    reports = EyeReport.objects.select_related("patient").order_by("patient_id", "date_time")
+    if patient_id:
+        reports = reports.filter(patient_id=patient_id)
+    if start:
+        reports = reports.filter(date_time__date__gte=start)
+    if end:
+        reports = reports.filter(date_time__date__lte=end)
+    return reports.iterator(chunk_size=500)
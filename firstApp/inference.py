@@ -0,0 +1,107 @@
+"""
+Model loading for the ROP classifier.
+
+The Keras model is loaded lazily on first use, once per process.  Under
+gunicorn with VISIONCARE_PRELOAD_MODEL=1 (see gunicorn.conf.py) a fork-safe
+backend is loaded in the master before workers are forked, so every worker
+shares the same pages copy-on-write instead of holding its own copy.
+
+TensorFlow is not fork-safe once it has loaded a model: its thread pools
+are running by then, a forked worker inherits none of those threads but
+keeps any lock they held, and can hang on its first prediction.  The keras
+backend is therefore never loaded before fork; each worker loads its own
+copy (at boot with VISIONCARE_EAGER_MODEL=1).
+
+VISIONCARE_INFERENCE_BACKEND=stub swaps in StubModel, which needs neither
+TensorFlow nor the weights file (used by scripts/loadtest.py).
+"""
+import hashlib
+import os
+import threading
+from functools import lru_cache
+
+MODEL_PATH = os.environ.get('VISIONCARE_MODEL_PATH', 'EfficientNetB0_model.h5')
+BACKEND = os.environ.get('VISIONCARE_INFERENCE_BACKEND', 'keras')
+NUM_CLASSES = 7
+
+_model = None
+_lock = threading.Lock()
+
+
+def preload_enabled():
+    return os.environ.get('VISIONCARE_PRELOAD_MODEL', '0').lower() in ('1', 'true', 'yes')
+
+
+def fork_safe():
+    """Whether the configured backend may be loaded before forking."""
+    return BACKEND == 'stub'
+
+
+class StubModel:
+    """Deterministic stand-in for the classifier.
+
+    The class is derived from the pixel data, so the same image always gets
+    the same result; VISIONCARE_STUB_DELAY_MS adds a fixed per-batch cost to
+    mimic real inference time.
+    """
+
+    def __init__(self, delay_ms=None):
+        if delay_ms is None:
+            delay_ms = float(os.environ.get('VISIONCARE_STUB_DELAY_MS', 0))
+        self.delay = delay_ms / 1000.0
+
+    def predict(self, batch, **kwargs):
+        import time
+
+        import numpy as np
+
+        if self.delay:
+            time.sleep(self.delay)
+        batch = np.asarray(batch)
+        out = np.full((len(batch), NUM_CLASSES), 0.02)
+        for i, img in enumerate(batch):
+            out[i, int(img.sum()) % NUM_CLASSES] = 0.88
+        return out
+
+
+@lru_cache(maxsize=1)
+def model_version():
+    """Short fingerprint of the weights in use, for keying derived artefacts."""
+    if BACKEND == 'stub':
+        return 'stub'
+    digest = hashlib.sha1()
+    with open(MODEL_PATH, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:12]
+
+
+def get_model():
+    global _model
+    if _model is None:
+        with _lock:
+            if _model is None:
+                if BACKEND == 'stub':
+                    _model = StubModel()
+                else:
+                    import tensorflow as tf
+                    _model = tf.keras.models.load_model(MODEL_PATH)
+    return _model
+
+
+def preload_model():
+    """Load the model in the current process and freeze it for forking.
+
+    gc.freeze() moves everything allocated so far into the permanent
+    generation, so the collector in the workers never writes to (and thereby
+    un-shares) the pages holding the model's Python objects.
+    """
+    import gc
+
+    if not fork_safe():
+        raise RuntimeError(f"The {BACKEND} backend cannot be loaded before fork; workers would hang.")
+
+    model = get_model()
+    gc.collect()
+    gc.freeze()
+    return model
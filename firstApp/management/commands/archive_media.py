@@ -0,0 +1,37 @@
+from datetime import timedelta
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from firstApp.models import EyeReport
+
+
+class Command(BaseCommand):
+    help = "Move images and PDFs of reports older than N days into monthly pack files."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=180, help="Archive reports older than this many days.")
+        parser.add_argument("--dry-run", action="store_true", help="Only list what would be archived.")
+
+    def handle(self, *args, **options):
+        if not hasattr(default_storage, "archive") or not hasattr(default_storage, "is_loose"):
+            raise CommandError("The default storage does not support packing (see STORAGES in settings).")
+
+        cutoff = timezone.now() - timedelta(days=options["days"])
+        reports = EyeReport.objects.filter(date_time__lt=cutoff).order_by("date_time")
+
+        files = moved = 0
+        for report in reports.only("id", "date_time", "report_image", "pdf_report").iterator(chunk_size=500):
+            pack = timezone.localtime(report.date_time).strftime("%Y-%m")
+            for field_file in (report.report_image, report.pdf_report):
+                if not field_file or not default_storage.is_loose(field_file.name):
+                    continue
+                if options["dry_run"]:
+                    self.stdout.write(f"{pack}: {field_file.name}")
+                else:
+                    moved += default_storage.archive(field_file.name, pack)
+                files += 1
+
+        verb = "Would archive" if options["dry_run"] else "Archived"
+        self.stdout.write(self.style.SUCCESS(f"{verb} {files} files ({moved / 1024 / 1024:.1f} MB)."))
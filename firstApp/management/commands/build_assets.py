@@ -0,0 +1,34 @@
+import json
+import os
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = "Collect static files under hashed names and pre-compress them (gzip, and brotli if installed)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--clear", action="store_true", help="Remove the existing STATIC_ROOT contents first.")
+
+    def handle(self, *args, **options):
+        call_command("collectstatic", interactive=False, clear=options["clear"], verbosity=0)
+
+        with staticfiles_storage.open(staticfiles_storage.manifest_name) as f:
+            manifest = json.load(f)["paths"]
+
+        raw = gz = br = 0
+        for hashed in set(manifest.values()):
+            path = os.path.join(settings.STATIC_ROOT, hashed)
+            size = os.path.getsize(path)
+            raw += size
+            gz += os.path.getsize(path + ".gz") if os.path.exists(path + ".gz") else size
+            br += os.path.getsize(path + ".br") if os.path.exists(path + ".br") else size
+
+        kb = 1024
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(manifest)} assets in {settings.STATIC_ROOT}: {raw / kb:.0f} KB raw, "
+            f"{gz / kb:.0f} KB gzip, {br / kb:.0f} KB brotli"
+        ))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from firstApp.models import EyeReport
+from firstApp.phash import dhash
+
+
+class Command(BaseCommand):
+    help = "Compute perceptual hashes for EyeReport images that do not have one yet."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--all", action="store_true", help="Recompute hashes for every report.")
+
+    def handle(self, *args, **options):
+        reports = EyeReport.objects.exclude(report_image="")
+        if not options["all"]:
+            reports = reports.filter(image_phash="")
+
+        done = failed = 0
+        for report in reports.only("id", "report_image").iterator(chunk_size=500):
+            try:
+                with report.report_image.open("rb") as f:
+                    report.image_phash = dhash(f)
+            except (OSError, ValueError) as e:
+                self.stderr.write(f"Report #{report.id}: {e}")
+                failed += 1
+                continue
+            report.save(update_fields=["image_phash"])
+            done += 1
+
+        self.stdout.write(self.style.SUCCESS(f"Hashed {done} reports ({failed} failed)."))
@@ -0,0 +1,77 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from firstApp.models import EyeReport
+from firstApp.triage import THRESHOLD, features, get_triage_model, split
+from firstApp.preprocess import preprocess_image
+from firstApp.views import predict_batch
+
+
+class Command(BaseCommand):
+    help = ("Compare the triage cascade with the full model on stored images: escalation rate, "
+            "agreement and CPU time saved per image.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--limit", type=int, default=500, help="Number of reports to evaluate (newest first).")
+        parser.add_argument("--after-id", type=int,
+                            help="Evaluate every report with a larger id (e.g. added since the model was trained) "
+                                 "instead of the held-out patients.")
+        parser.add_argument("--thresholds", default=str(THRESHOLD),
+                            help="Comma-separated triage thresholds to report, e.g. 0.1,0.2,0.3.")
+
+    def handle(self, *args, **options):
+        try:
+            thresholds = [float(t) for t in options["thresholds"].split(",")]
+        except ValueError:
+            raise CommandError("--thresholds must be comma-separated numbers")
+        model = get_triage_model()
+
+        reports = EyeReport.objects.exclude(report_image="")
+        if options["after_id"] is not None:
+            reports = reports.filter(id__gt=options["after_id"])
+        else:
+            # train_triage never sees these patients
+            reports = split(reports, held_out=True)
+        reports = reports.order_by("-date_time").only("id", "report_image")[:options["limit"]]
+
+        # Loading and warming up the full model must not count as inference time
+        predict_batch([np.zeros((224, 224, 3))])
+        scores, labels, triage_cpu, full_cpu = [], [], [], []
+        for report in reports.iterator(chunk_size=200):
+            try:
+                with report.report_image.open("rb") as f:
+                    start = time.process_time()
+                    score = float(model.score(features(f))[0])
+                    triage_cpu.append(time.process_time() - start)
+
+                    f.seek(0)
+                    start = time.process_time()
+                    label = predict_batch([preprocess_image(f)])[0]
+                    full_cpu.append(time.process_time() - start)
+            except (OSError, ValueError) as e:
+                self.stderr.write(f"Report #{report.id}: {e}")
+                continue
+            scores.append(score)
+            labels.append(label)
+
+        if not labels:
+            raise CommandError("No readable report images to evaluate (held-out patients, or --after-id).")
+
+        scores = np.array(scores)
+        abnormal = np.array([label != "Normal" for label in labels])
+        triage_ms = 1000 * np.mean(triage_cpu)
+        full_ms = 1000 * np.mean(full_cpu)
+
+        self.stdout.write(f"{len(labels)} images, {abnormal.sum()} abnormal per the full model")
+        self.stdout.write(f"CPU per image: triage {triage_ms:.1f} ms, full model {full_ms:.1f} ms\n")
+        self.stdout.write(f"{'threshold':>9} {'escalated':>10} {'agreement':>10} {'missed abn.':>12} {'CPU saved/img':>14}")
+        for threshold in thresholds:
+            escalate = scores >= threshold
+            # Cascade answer: full model label when escalated, otherwise Normal
+            agree = np.where(escalate, True, ~abnormal)
+            missed = int((~escalate & abnormal).sum())
+            saved_ms = full_ms - (triage_ms + escalate.mean() * full_ms)
+            self.stdout.write(f"{threshold:>9.2f} {100 * escalate.mean():>9.1f}% {100 * agree.mean():>9.1f}% "
+                              f"{missed:>12} {saved_ms:>11.1f} ms")
@@ -0,0 +1,50 @@
+import os
+import shutil
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+
+from firstApp.dataset import SHARD_SIZE, DatasetWriter, export
+from firstApp.models import EyeReport
+from firstApp.triage import ROUTE_FULL
+from firstApp.preprocess import CLASSES
+
+
+class Command(BaseCommand):
+    help = ("Export labelled EyeReport images as memory-mappable shards of preprocessed 224x224 uint8 tensors, "
+            "appending to an earlier export by default.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--output", default=os.environ.get("VISIONCARE_DATASET_DIR", "dataset"),
+                            help="Export directory.")
+        parser.add_argument("--shard-size", type=int, default=SHARD_SIZE, help="Images per shard.")
+        parser.add_argument("--workers", type=int, help="Preprocessing processes (default: one per CPU).")
+        parser.add_argument("--include-triage", action="store_true",
+                            help="Also export images labelled by the triage model alone.")
+        parser.add_argument("--full", action="store_true", help="Discard the existing export and start over.")
+
+    def handle(self, *args, **options):
+        output = options["output"]
+        if options["full"] and os.path.isdir(output):
+            shutil.rmtree(output)
+        try:
+            writer = DatasetWriter(output, shard_size=options["shard_size"])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        new_or_failed = Q(id__gt=writer.last_report_id) | Q(id__in=writer.failed_report_ids)
+        reports = (EyeReport.objects.exclude(report_image="").filter(new_or_failed, disease__in=CLASSES)
+                   .order_by("id").only("id", "patient_id", "disease", "eye", "report_image"))
+        if not options["include_triage"]:
+            # Labels the full model produced, as for train_triage
+            reports = reports.filter(Q(inference_route=ROUTE_FULL) | Q(inference_route=""))
+
+        def on_error(report, error):
+            self.stderr.write(f"Report #{report.id}: {error}")
+
+        exported, skipped, failed, last_id = export(reports.iterator(chunk_size=500), writer,
+                                                    workers=options["workers"], on_error=on_error)
+        manifest = writer.close(last_id, failed)
+        self.stdout.write(self.style.SUCCESS(
+            f"Exported {exported} images ({skipped} duplicates skipped, {len(failed)} failed, retried next time); "
+            f"{manifest['images']} images in {manifest['shards']} shards under {output}."))
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from firstApp.export import iter_reports_zip, export_queryset
+
+
+class Command(BaseCommand):
+    help = "Write a ZIP of EyeReport images and PDFs with a CSV manifest."
+
+    def add_arguments(self, parser):
+        parser.add_argument("output", help="Path of the ZIP file to write ('-' for stdout).")
+        parser.add_argument("--patient", type=int, help="Only export reports of this patient user id.")
+        parser.add_argument("--start", help="First report date to include (YYYY-MM-DD).")
+        parser.add_argument("--end", help="Last report date to include (YYYY-MM-DD).")
+
+    def handle(self, *args, **options):
+        dates = {}
+        for key in ("start", "end"):
+            value = options[key]
+            dates[key] = parse_date(value) if value else None
+            if value and dates[key] is None:
+                raise CommandError(f"Invalid --{key} date: {value}")
+
+        chunks = iter_reports_zip(export_queryset(options["patient"], dates["start"], dates["end"]))
+
+        if options["output"] == "-":
+            out = self.stdout._out.buffer
+            for chunk in chunks:
+                out.write(chunk)
+            out.flush()
+            return
+
+        written = 0
+        with open(options["output"], "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+                written += len(chunk)
+        self.stdout.write(self.style.SUCCESS(f"Wrote {written} bytes to {options['output']}"))
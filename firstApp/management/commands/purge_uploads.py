@@ -0,0 +1,25 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from firstApp import uploads
+from firstApp.models import ChunkedUpload
+
+
+class Command(BaseCommand):
+    help = "Delete chunked uploads that were started but never finished."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--hours", type=int, default=48, help="Purge uploads started more than this many hours ago.")
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(hours=options["hours"])
+        stale = ChunkedUpload.objects.filter(created__lt=cutoff)
+
+        count = freed = 0
+        for upload in stale.iterator(chunk_size=500):
+            freed += upload.size
+            uploads.discard(upload)
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f"Purged {count} uploads ({freed / 1024 / 1024:.1f} MB)."))
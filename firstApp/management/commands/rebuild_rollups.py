@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from firstApp import rollups
+
+
+class Command(BaseCommand):
+    help = "Recompute the DailyRollup table from all EyeReports."
+
+    def handle(self, *args, **options):
+        count = rollups.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {count} rollup rows."))
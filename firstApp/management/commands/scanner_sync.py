@@ -0,0 +1,83 @@
+import os
+
+import requests
+from django.core.management.base import BaseCommand, CommandError
+
+from firstApp.outbox import OUTBOX_PATH, Outbox, OutboxError, SyncClient, pull, push
+
+
+class Command(BaseCommand):
+    help = ("Offline scanning for a scanner station: queue scans in a local outbox, push them to the server "
+            "in batches and pull new patients and results.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("action", choices=["queue", "push", "pull", "sync", "status", "requeue"],
+                            help="sync is push followed by pull.")
+        parser.add_argument("--outbox", default=OUTBOX_PATH, help="Local SQLite outbox file.")
+        parser.add_argument("--patient", type=int, help="Patient (user) id, for queue.")
+        parser.add_argument("--left", nargs="+", default=[], help="Left-eye images, for queue.")
+        parser.add_argument("--right", nargs="+", default=[], help="Right-eye images, for queue.")
+        parser.add_argument("--image", nargs="+", default=[], help="Images of an unspecified eye, for queue.")
+        parser.add_argument("--server", default=os.environ.get("VISIONCARE_SYNC_SERVER"),
+                            help="Server base URL, e.g. https://visioncare.example.org.")
+        parser.add_argument("--username", default=os.environ.get("VISIONCARE_SYNC_USERNAME"))
+        parser.add_argument("--password", default=os.environ.get("VISIONCARE_SYNC_PASSWORD"))
+
+    def handle(self, *args, **options):
+        outbox = Outbox(options["outbox"])
+        try:
+            if options["action"] == "queue":
+                self.queue(outbox, options)
+            elif options["action"] == "status":
+                self.status(outbox)
+            elif options["action"] == "requeue":
+                self.stdout.write(self.style.SUCCESS(f"Queued {outbox.requeue()} rejected scans again."))
+            else:
+                self.sync(outbox, options)
+        finally:
+            outbox.close()
+
+    def queue(self, outbox, options):
+        if options["patient"] is None:
+            raise CommandError("queue needs --patient")
+        images = ([("left", path) for path in options["left"]] + [("right", path) for path in options["right"]]
+                  + [("", path) for path in options["image"]])
+        if outbox.cursor and not outbox.patient_exists(options["patient"]):
+            self.stdout.write(self.style.WARNING(
+                f"Patient {options['patient']} is not in the last pulled patient list; queueing anyway."))
+        try:
+            key = outbox.queue(options["patient"], images)
+        except (OutboxError, OSError) as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(f"Queued {len(images)} images for patient {options['patient']} ({key})."))
+
+    def status(self, outbox):
+        counts = outbox.counts()
+        self.stdout.write(f"Queued: {counts.get('queued', 0)}  Sent: {counts.get('sent', 0)}  "
+                          f"Rejected: {counts.get('rejected', 0)}  Cursor: {outbox.cursor or '-'}")
+        for row in outbox.rejected():
+            self.stdout.write(f"  {row['key']} patient {row['patient_id']} ({row['captured_at']}): {row['error']}")
+
+    def sync(self, outbox, options):
+        if not (options["server"] and options["username"] and options["password"]):
+            raise CommandError("Set --server, --username and --password "
+                               "(or VISIONCARE_SYNC_SERVER/USERNAME/PASSWORD).")
+        client = SyncClient(options["server"], options["username"], options["password"])
+        try:
+            client.login()
+            if options["action"] in ("push", "sync"):
+                results = push(outbox, client)
+                for result in results:
+                    if result["status"] not in ("created", "duplicate"):
+                        self.stdout.write(self.style.WARNING(
+                            f"{result['key']}: {result['status']}: {'; '.join(result.get('errors', []))}"))
+                sent = sum(1 for result in results if result["status"] in ("created", "duplicate"))
+                self.stdout.write(self.style.SUCCESS(f"Pushed {sent} of {len(results)} queued scans."))
+            if options["action"] in ("pull", "sync"):
+                patients, reports = pull(outbox, client)
+                self.stdout.write(self.style.SUCCESS(f"Pulled {patients} patients and {reports} results."))
+        except OutboxError as e:
+            raise CommandError(str(e))
+        except requests.RequestException as e:
+            # Still offline (or the server is down); everything stays queued
+            raise CommandError(f"Sync failed, {outbox.counts().get('queued', 0)} scans still queued: {e}")
@@ -0,0 +1,42 @@
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+
+from firstApp.models import EyeReport
+from firstApp.triage import MODEL_PATH, ROUTE_FULL, TriageModel, features, split
+
+
+class Command(BaseCommand):
+    help = "Fit the triage model on images already labelled by the full classifier."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--limit", type=int, help="Use at most this many reports (newest first).")
+        parser.add_argument("--output", default=MODEL_PATH, help="Where to write the weights (JSON).")
+
+    def handle(self, *args, **options):
+        # Only results the full model produced itself are trustworthy labels
+        reports = (EyeReport.objects.exclude(report_image="")
+                   .filter(Q(inference_route=ROUTE_FULL) | Q(inference_route=""))
+                   .order_by("-date_time").only("id", "disease", "report_image"))
+        # Held-out patients are left for evaluate_cascade
+        reports = split(reports, held_out=False)
+        if options["limit"]:
+            reports = reports[:options["limit"]]
+
+        x, y = [], []
+        for report in reports.iterator(chunk_size=500):
+            try:
+                with report.report_image.open("rb") as f:
+                    x.append(features(f))
+            except (OSError, ValueError) as e:
+                self.stderr.write(f"Report #{report.id}: {e}")
+                continue
+            y.append(0 if report.disease == "Normal" else 1)
+
+        if len(set(y)) < 2:
+            raise CommandError("Need both Normal and abnormal reports to train the triage model.")
+
+        model = TriageModel.fit(np.array(x), np.array(y))
+        model.save(options["output"])
+        self.stdout.write(self.style.SUCCESS(
+            f"Trained on {len(y)} images ({sum(y)} abnormal); weights written to {options['output']}."))
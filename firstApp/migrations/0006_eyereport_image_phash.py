@@ -0,0 +1,24 @@
+# Generated by Django 5.0.2 on 2026-10-18 23:53
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('firstApp', '0005_userprofile_address_userprofile_age_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='eyereport',
+            name='duplicate_of',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='duplicates', to='firstApp.eyereport'),
+        ),
+        migrations.AddField(
+            model_name='eyereport',
+            name='image_phash',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=16),
+        ),
+    ]
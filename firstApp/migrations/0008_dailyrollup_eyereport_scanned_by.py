@@ -0,0 +1,36 @@
+# Generated by Django 5.0.2 on 2026-10-18 23:57
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('firstApp', '0007_dashboardevent'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='eyereport',
+            name='scanned_by',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='scans', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.CreateModel(
+            name='DailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('disease', models.CharField(max_length=255)),
+                ('scans', models.PositiveIntegerField(default=0)),
+                ('progressions', models.PositiveIntegerField(default=0)),
+                ('scanner', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['day', 'disease'], name='firstApp_da_day_7e1917_idx')],
+                'unique_together': {('day', 'scanner', 'disease')},
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.0.2 on 2026-10-19 00:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('firstApp', '0009_visit'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='eyereport',
+            name='inference_route',
+            field=models.CharField(blank=True, max_length=10),
+        ),
+        migrations.AddField(
+            model_name='eyereport',
+            name='triage_score',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
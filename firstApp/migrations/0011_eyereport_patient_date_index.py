@@ -0,0 +1,19 @@
+# Generated by Django 5.0.2 on 2026-10-19 00:09
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('firstApp', '0010_eyereport_inference_route'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='eyereport',
+            index=models.Index(fields=['patient', '-date_time'], name='firstApp_ey_patient_14f593_idx'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.0.2 on 2026-10-19 00:53
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill(apps, schema_editor):
+    # 0008 created the table empty; fill it from the reports that predate it.
+    # This also drops duplicate unassigned rows before the constraints go on.
+    from firstApp import rollups
+    rollups.rebuild(apps.get_model('firstApp', 'EyeReport'), apps.get_model('firstApp', 'DailyRollup'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('firstApp', '0013_syncedscan'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='dailyrollup',
+            unique_together=set(),
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='dailyrollup',
+            constraint=models.UniqueConstraint(condition=models.Q(('scanner__isnull', False)), fields=('day', 'scanner', 'disease'), name='dailyrollup_unique_scanner'),
+        ),
+        migrations.AddConstraint(
+            model_name='dailyrollup',
+            constraint=models.UniqueConstraint(condition=models.Q(('scanner__isnull', True)), fields=('day', 'disease'), name='dailyrollup_unique_unassigned'),
+        ),
+    ]
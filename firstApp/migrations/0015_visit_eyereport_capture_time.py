@@ -0,0 +1,24 @@
+# Generated by Django 5.0.2 on 2026-10-19 01:26
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('firstApp', '0014_dailyrollup_backfill'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='eyereport',
+            name='date_time',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AlterField(
+            model_name='visit',
+            name='date_time',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
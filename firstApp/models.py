@@ -1,3 +1,5 @@
+import uuid
+
 from django.contrib.auth.models import User
 from django.db import models
 from django.utils import timezone
@@ -29,17 +31,116 @@ class UserProfile(models.Model):
     def __str__(self):
         return f"{self.user.username} - {self.role}"
 
+class Visit(models.Model):
+    # One screening submission: every image captured for a patient in one sitting
+    patient = models.ForeignKey(User, on_delete=models.CASCADE, related_name='visits')
+    scanned_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='visits_scanned')
+    worst_stage = models.CharField(max_length=255, blank=True)
+    pdf_report = models.FileField(upload_to='eye_reports/', null=True, blank=True)
+    # When the images were captured; earlier than creation for scans synced
+    # from an offline station
+    date_time = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.patient.username} - {self.worst_stage}"
+
 class EyeReport(models.Model):
+    EYE_CHOICES = [
+        ('left', 'Left'),
+        ('right', 'Right'),
+    ]
+
+
     patient = models.ForeignKey(User, on_delete=models.CASCADE)
     disease = models.CharField(max_length=255)
     solution = models.TextField()
     report_image = models.ImageField(upload_to='eye_images/')
     pdf_report = models.FileField(upload_to='eye_reports/', null=True, blank=True)
-    date_time = models.DateTimeField(auto_now_add=True)
+    date_time = models.DateTimeField(default=timezone.now)  # capture time, as on the visit
+
+    # Perceptual hash of report_image (see phash.py) and, when the upload was
+    # a near-duplicate, the report whose prediction was reused.
+    image_phash = models.CharField(max_length=16, blank=True, default='', db_index=True)
+    duplicate_of = models.ForeignKey('self', on_delete=models.SET_NULL, null=True, blank=True, related_name='duplicates')
+    scanned_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='scans')
+    visit = models.ForeignKey(Visit, on_delete=models.CASCADE, null=True, blank=True, related_name='reports')
+    eye = models.CharField(max_length=5, choices=EYE_CHOICES, blank=True)
+    # How the result was produced: full model, triage model alone, or reused duplicate
+    inference_route = models.CharField(max_length=10, blank=True)
+    triage_score = models.FloatField(null=True, blank=True)
+
+    class Meta:
+        # Latest report per patient (dashboards) and per-patient history
+        indexes = [models.Index(fields=['patient', '-date_time'])]
+
+    @property
+    def visit_stage(self):
+        """What dashboards show: the worst stage of the visit, or this report's own result for older reports."""
+        try:
+            visit = self.visit
+        except Visit.DoesNotExist:
+            # Deleted along with the patient, ahead of this report's signals
+            visit = None
+        return visit.worst_stage if visit and visit.worst_stage else self.disease
 
     def __str__(self):
         return f"{self.patient.username} - {self.disease}"
 
+class DashboardEvent(models.Model):
+    # Append-only log of dashboard changes, streamed to open dashboards over SSE
+    kind = models.CharField(max_length=30)
+    payload = models.JSONField(default=dict)
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.id} - {self.kind}"
+
+class DailyRollup(models.Model):
+    # Per-day aggregate of EyeReports, maintained incrementally (see rollups.py)
+    day = models.DateField()
+    scanner = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    disease = models.CharField(max_length=255)
+    scans = models.PositiveIntegerField(default=0)
+    # Scans whose result is exactly one stage above the patient's previous report
+    progressions = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        # NULLs never collide in a plain unique index, so unassigned scans get their own
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'scanner', 'disease'], condition=models.Q(scanner__isnull=False),
+                                    name='dailyrollup_unique_scanner'),
+            models.UniqueConstraint(fields=['day', 'disease'], condition=models.Q(scanner__isnull=True),
+                                    name='dailyrollup_unique_unassigned'),
+        ]
+        indexes = [models.Index(fields=['day', 'disease'])]
+
+    def __str__(self):
+        return f"{self.day} - {self.disease}: {self.scans}"
+
+class ChunkedUpload(models.Model):
+    # Resumable image upload in progress; the bytes live on disk (see uploads.py)
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    patient = models.ForeignKey(User, on_delete=models.CASCADE, related_name='pending_uploads')
+    scanned_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='chunked_uploads')
+    filename = models.CharField(max_length=255)
+    eye = models.CharField(max_length=5, choices=EyeReport.EYE_CHOICES, blank=True)
+    size = models.BigIntegerField()
+    chunk_size = models.IntegerField()
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.filename} ({self.size} bytes)"
+
+class SyncedScan(models.Model):
+    # Idempotency key of a scan pushed by an offline scanner station (see outbox.py)
+    key = models.CharField(max_length=64, unique=True)
+    visit = models.ForeignKey(Visit, on_delete=models.CASCADE, related_name='synced_scans')
+    scanned_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='synced_scans')
+    received = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.key} - visit {self.visit_id}"
+
 class Patient(models.Model):
     name = models.CharField(max_length=100)
     email = models.EmailField()
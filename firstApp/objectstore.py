@@ -0,0 +1,348 @@
+"""
+Object storage for media, so several web and inference nodes can share one
+media store.
+
+ObjectStorage is a Django Storage over a small bucket client:
+
+- S3Client talks to S3 or any S3-compatible store (MinIO, Ceph, R2) through
+  boto3, with a pooled connection and parallel multipart transfers for large
+  files.
+- LocalObjectClient keeps objects as plain files under a directory.  It is
+  the stand-in used by the tests and for single-machine setups, and its
+  layout matches MEDIA_ROOT.
+
+Reads go through ReadThroughCache, a size-capped LRU directory on local disk,
+so an image that is read several times in a row (validation, PDF rendering,
+saliency) is fetched from the bucket once per node.  Saved files are
+written to the cache first and uploaded from there.  Every saved name gets a
+random suffix (get_available_name), so two nodes saving the same upload
+name never write the same key.  Objects are never rewritten in place, but
+a delete only drops the deleting node's cached copy; other nodes keep
+theirs until it is evicted.
+
+Selected with VISIONCARE_MEDIA_BACKEND=s3|local-object (see settings.py).
+"""
+import hashlib
+import mimetypes
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+from datetime import datetime, timezone
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured, SuspiciousFileOperation
+from django.core.files import File
+from django.core.files.storage import Storage
+from django.core.files.utils import validate_file_name
+from django.utils.deconstruct import deconstructible
+
+try:
+    import boto3
+    from boto3.s3.transfer import TransferConfig
+    from botocore.config import Config
+    from botocore.exceptions import ClientError
+except ImportError:
+    boto3 = None
+
+MB = 1024 * 1024
+
+
+# ---------------- Clients ----------------
+class S3Client:
+    """The handful of bucket operations ObjectStorage needs, over boto3."""
+
+    def __init__(self, bucket, endpoint_url=None, region=None, public_url=None, url_expiry=3600,
+                 max_connections=16, multipart_threshold=8 * MB, multipart_chunksize=8 * MB, max_concurrency=8):
+        if boto3 is None:
+            raise ImproperlyConfigured("The s3 media backend needs boto3 (pip install boto3).")
+        if not bucket:
+            raise ImproperlyConfigured("Set VISIONCARE_S3_BUCKET for the s3 media backend.")
+        self.bucket = bucket
+        self.public_url = public_url
+        self.url_expiry = url_expiry
+        # One client per process; boto3 clients are thread-safe and keep up
+        # to max_connections keep-alive connections in their pool.
+        self.client = boto3.client('s3', endpoint_url=endpoint_url, region_name=region, config=Config(
+            max_pool_connections=max_connections,
+            retries={'max_attempts': 5, 'mode': 'standard'},
+        ))
+        # Files above the threshold go up/down as parallel multipart transfers
+        self.transfer = TransferConfig(multipart_threshold=multipart_threshold,
+                                       multipart_chunksize=multipart_chunksize,
+                                       max_concurrency=min(max_concurrency, max_connections),
+                                       use_threads=True)
+
+    def put(self, key, fileobj, content_type):
+        self.client.upload_fileobj(fileobj, self.bucket, key, ExtraArgs={'ContentType': content_type},
+                                   Config=self.transfer)
+
+    def get(self, key, fileobj):
+        try:
+            self.client.download_fileobj(self.bucket, key, fileobj, Config=self.transfer)
+        except ClientError as e:
+            if _not_found(e):
+                raise FileNotFoundError(key) from e
+            raise
+
+    def head(self, key):
+        """(size, modified) of ``key``, or None when it does not exist."""
+        try:
+            meta = self.client.head_object(Bucket=self.bucket, Key=key)
+        except ClientError as e:
+            if _not_found(e):
+                return None
+            raise
+        return meta['ContentLength'], meta['LastModified']
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=key)
+
+    def keys(self, prefix):
+        for page in self.client.get_paginator('list_objects_v2').paginate(Bucket=self.bucket, Prefix=prefix):
+            for item in page.get('Contents', []):
+                yield item['Key']
+
+    def url(self, key):
+        if self.public_url:
+            return f"{self.public_url.rstrip('/')}/{quote(key)}"
+        return self.client.generate_presigned_url('get_object', Params={'Bucket': self.bucket, 'Key': key},
+                                                  ExpiresIn=self.url_expiry)
+
+
+def _not_found(error):
+    return error.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound')
+
+
+class LocalObjectClient:
+    """Bucket-shaped client over a local directory."""
+
+    def __init__(self, root, base_url):
+        self.root = root
+        self.base_url = base_url
+
+    def _path(self, key):
+        path = os.path.abspath(os.path.join(self.root, key))
+        if not path.startswith(os.path.abspath(self.root) + os.sep):
+            raise ValueError(f"Key outside the bucket: {key}")
+        return path
+
+    def put(self, key, fileobj, content_type):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write aside and rename, so readers never see a partial object
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.upload-')
+        with os.fdopen(fd, 'wb') as out:
+            shutil.copyfileobj(fileobj, out, MB)
+        os.replace(tmp, path)
+
+    def get(self, key, fileobj):
+        with open(self._path(key), 'rb') as src:
+            shutil.copyfileobj(src, fileobj, MB)
+
+    def head(self, key):
+        try:
+            st = os.stat(self._path(key))
+        except FileNotFoundError:
+            return None
+        return st.st_size, datetime.fromtimestamp(st.st_mtime, tz=timezone.utc)
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def keys(self, prefix):
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            for filename in filenames:
+                key = os.path.relpath(os.path.join(dirpath, filename), self.root).replace(os.sep, '/')
+                if key.startswith(prefix) and not filename.startswith('.upload-'):
+                    yield key
+
+    def url(self, key):
+        return self.base_url + quote(key)
+
+
+# ---------------- Local cache ----------------
+class ReadThroughCache:
+    """Size-capped local copies of objects, evicting the least recently used."""
+
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._added = 0
+        self._lock = threading.Lock()
+
+    def path(self, name):
+        digest = hashlib.sha1(name.encode()).hexdigest()
+        return os.path.join(self.root, digest[:2], digest)
+
+    def get(self, name, fetch):
+        """Local path holding ``name``, calling ``fetch(fileobj)`` on a miss."""
+        path = self.path(name)
+        try:
+            os.utime(path)  # mtime doubles as the LRU clock
+            return path
+        except FileNotFoundError:
+            pass
+        return self.put(name, fetch)
+
+    def put(self, name, write):
+        path = self.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.fill-')
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                write(out)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        self._note(os.path.getsize(path))
+        return path
+
+    def discard(self, name):
+        try:
+            os.remove(self.path(name))
+        except FileNotFoundError:
+            pass
+
+    def _note(self, size):
+        # Only walk the cache once roughly a tenth of its budget has been added
+        with self._lock:
+            self._added += size
+            if self._added < self.max_bytes // 10:
+                return
+            self._added = 0
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+# ---------------- Storage ----------------
+@deconstructible
+class ObjectStorage(Storage):
+    """Django storage over a bucket client with a local read-through cache."""
+
+    # Names under these prefixes are derived from the content (saliency
+    # overlays), so saving one twice writes the same bytes; they keep their
+    # name so every node can find them
+    content_addressed = ('saliency/',)
+
+    def __init__(self, client, cache_dir=None, cache_mb=512):
+        self.client = client
+        cache_dir = cache_dir or os.path.join(tempfile.gettempdir(), 'visioncare-media-cache')
+        self.cache = ReadThroughCache(cache_dir, cache_mb * MB)
+
+    def _open(self, name, mode='rb'):
+        if set(mode) - set('rb'):
+            raise ValueError("Object storage files are read-only; save a new file instead.")
+        fetch = lambda out: self.client.get(name, out)
+        try:
+            return File(open(self.cache.get(name, fetch), 'rb'), name=name)
+        except FileNotFoundError:
+            # Evicted by another process between the lookup and the open
+            return File(open(self.cache.put(name, fetch), 'rb'), name=name)
+
+    def _save(self, name, content):
+        if hasattr(content, 'seek'):
+            content.seek(0)
+        # Fill the cache first (the image is usually read again right away),
+        # then upload from the local copy
+        path = self.cache.put(name, lambda out: shutil.copyfileobj(content, out, MB))
+        content_type = getattr(content, 'content_type', None) or mimetypes.guess_type(name)[0]
+        with open(path, 'rb') as f:
+            self.client.put(name, f, content_type or 'application/octet-stream')
+        return name
+
+    def get_available_name(self, name, max_length=None):
+        """``name`` with a random suffix.
+
+        The default exists() check followed by an upload is not atomic, and
+        object stores cannot create a key only if it is absent, so two nodes
+        could pick the same free name and one upload would replace the other.
+        """
+        name = str(name).replace('\\', '/')
+        validate_file_name(name, allow_relative_path=True)
+        if name.startswith(self.content_addressed):
+            return name
+        dir_name, file_name = os.path.split(name)
+        file_root, file_ext = os.path.splitext(file_name)
+        suffix = '_' + uuid.uuid4().hex[:12]
+        if max_length is not None:
+            overflow = len(name) + len(suffix) - max_length
+            if overflow > 0:
+                file_root = file_root[:-overflow]
+                if not file_root:
+                    raise SuspiciousFileOperation(f'Storage can not find an available filename for "{name}".')
+        return os.path.join(dir_name, file_root + suffix + file_ext)
+
+    def exists(self, name):
+        return self.client.head(name) is not None
+
+    def size(self, name):
+        meta = self.client.head(name)
+        if meta is None:
+            raise FileNotFoundError(name)
+        return meta[0]
+
+    def get_modified_time(self, name):
+        meta = self.client.head(name)
+        if meta is None:
+            raise FileNotFoundError(name)
+        return meta[1]
+
+    def delete(self, name):
+        self.client.delete(name)
+        self.cache.discard(name)
+
+    def listdir(self, path):
+        prefix = path.rstrip('/') + '/' if path else ''
+        dirs, files = set(), []
+        for key in self.client.keys(prefix):
+            rest = key[len(prefix):]
+            if '/' in rest:
+                dirs.add(rest.split('/', 1)[0])
+            else:
+                files.append(rest)
+        return sorted(dirs), sorted(files)
+
+    def url(self, name):
+        return self.client.url(name)
+
+
+class S3Storage(ObjectStorage):
+    def __init__(self, bucket=None, endpoint_url=None, region=None, public_url=None, url_expiry=3600,
+                 max_connections=16, multipart_threshold_mb=8, max_concurrency=8, cache_dir=None, cache_mb=512):
+        client = S3Client(bucket, endpoint_url=endpoint_url, region=region, public_url=public_url,
+                          url_expiry=url_expiry, max_connections=max_connections,
+                          multipart_threshold=multipart_threshold_mb * MB,
+                          multipart_chunksize=multipart_threshold_mb * MB, max_concurrency=max_concurrency)
+        super().__init__(client, cache_dir=cache_dir, cache_mb=cache_mb)
+
+
+class LocalObjectStorage(ObjectStorage):
+    def __init__(self, location=None, base_url=None, cache_dir=None, cache_mb=512):
+        client = LocalObjectClient(location or settings.MEDIA_ROOT, base_url or settings.MEDIA_URL)
+        super().__init__(client, cache_dir=cache_dir, cache_mb=cache_mb)
@@ -0,0 +1,278 @@
+"""
+Offline outbox for scanner stations.
+
+A station that loses its link keeps scanning.  ``manage.py scanner_sync
+queue`` runs the same fundus validator as the server and stores the images,
+the patient id and a fresh idempotency key in a local SQLite file
+(VISIONCARE_OUTBOX).  Once the link is back, ``push`` sends the queued scans
+to ``sync_scans`` in batches.  The server records every key it has
+accepted, so a batch that is resent after a lost response creates nothing
+twice.  Each scan carries the time it was queued, which the server uses as
+the visit's date.  ``pull`` fetches the patients and results added since the last
+cursor from ``sync_changes``, so the station can look patients up and show
+results while offline.
+
+Scans are sent oldest first.  Accepted scans keep their result row and drop
+their image bytes.  Rejected scans keep both, so they can be inspected and
+queued again with ``requeue``.
+"""
+import io
+import json
+import mimetypes
+import os
+import sqlite3
+import uuid
+
+import requests
+from django.conf import settings
+from django.urls import reverse
+from django.utils import timezone
+
+from .utils import is_valid_fundus
+
+OUTBOX_PATH = os.environ.get('VISIONCARE_OUTBOX', 'outbox.sqlite3')
+BATCH_SCANS = int(os.environ.get('VISIONCARE_SYNC_BATCH', 10))
+BATCH_BYTES = 32 * 1024 * 1024
+TIMEOUT = 120
+
+QUEUED = 'queued'
+SENT = 'sent'
+REJECTED = 'rejected'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS scans (
+    key TEXT PRIMARY KEY,
+    patient_id INTEGER NOT NULL,
+    captured_at TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'queued',
+    visit_id INTEGER,
+    worst_stage TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS scans_state ON scans (state, captured_at);
+CREATE TABLE IF NOT EXISTS images (
+    scan_key TEXT NOT NULL REFERENCES scans (key) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    filename TEXT NOT NULL,
+    eye TEXT NOT NULL DEFAULT '',
+    data BLOB NOT NULL,
+    PRIMARY KEY (scan_key, position)
+);
+CREATE TABLE IF NOT EXISTS patients (
+    id INTEGER PRIMARY KEY,
+    username TEXT NOT NULL,
+    email TEXT,
+    age INTEGER,
+    gender TEXT
+);
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY,
+    patient_id INTEGER NOT NULL,
+    visit_id INTEGER,
+    eye TEXT,
+    disease TEXT NOT NULL,
+    worst_stage TEXT,
+    date_time TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS state (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+class OutboxError(ValueError):
+    pass
+
+
+class Outbox:
+    """The station's local SQLite queue and patient/result cache."""
+
+    def __init__(self, path=OUTBOX_PATH):
+        self.db = sqlite3.connect(path)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA foreign_keys=ON")
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    # ---------------- Queue ----------------
+    def queue(self, patient_id, images):
+        """Validate and store one visit from [(eye, path), ...]; returns its key."""
+        if not images:
+            raise OutboxError("Select at least one eye image.")
+        loaded, errors = [], []
+        for eye, path in images:
+            with open(path, 'rb') as f:
+                data = f.read()
+            is_valid, error_msg = is_valid_fundus(io.BytesIO(data))
+            if not is_valid:
+                errors.append(f"{os.path.basename(path)}: {error_msg}")
+            loaded.append((eye, os.path.basename(path), data))
+        if errors:
+            raise OutboxError("; ".join(errors))
+
+        key = uuid.uuid4().hex
+        with self.db:
+            self.db.execute("INSERT INTO scans (key, patient_id, captured_at) VALUES (?, ?, ?)",
+                            (key, patient_id, timezone.now().isoformat()))
+            self.db.executemany("INSERT INTO images (scan_key, position, filename, eye, data) VALUES (?, ?, ?, ?, ?)",
+                                [(key, i, name, eye, data) for i, (eye, name, data) in enumerate(loaded)])
+        return key
+
+    def batches(self, max_scans=BATCH_SCANS, max_bytes=BATCH_BYTES, max_files=None):
+        """Yield lists of queued scans, each a dict with its images, oldest first.
+
+        A batch stops at ``max_scans`` scans, ``max_bytes`` of images or
+        ``max_files`` images, but always holds at least one scan.
+        """
+        max_files = max_files or settings.DATA_UPLOAD_MAX_NUMBER_FILES or 100
+        rows = self.db.execute("""
+            SELECT s.key, s.patient_id, s.captured_at, COUNT(*) AS files, SUM(LENGTH(i.data)) AS bytes
+            FROM scans s JOIN images i ON i.scan_key = s.key
+            WHERE s.state = ? GROUP BY s.key ORDER BY s.captured_at
+        """, (QUEUED,)).fetchall()
+
+        batch, size, files = [], 0, 0
+        for row in rows:
+            if batch and (len(batch) == max_scans or size + row['bytes'] > max_bytes
+                          or files + row['files'] > max_files):
+                yield [self._load(scan) for scan in batch]
+                batch, size, files = [], 0, 0
+            batch.append(row)
+            size += row['bytes']
+            files += row['files']
+        if batch:
+            yield [self._load(scan) for scan in batch]
+
+    def _load(self, row):
+        images = self.db.execute("SELECT filename, eye, data FROM images WHERE scan_key = ? ORDER BY position",
+                                 (row['key'],)).fetchall()
+        return {'key': row['key'], 'patient': row['patient_id'], 'captured_at': row['captured_at'],
+                'images': [dict(image) for image in images]}
+
+    def record(self, results):
+        """Apply ``sync_scans`` results; scans that hit a server error stay queued."""
+        with self.db:
+            for result in results:
+                if result['status'] in ('created', 'duplicate'):
+                    self.db.execute("UPDATE scans SET state = ?, visit_id = ?, worst_stage = ?, error = NULL "
+                                    "WHERE key = ?", (SENT, result['visit'], result['worst_stage'], result['key']))
+                    self.db.execute("DELETE FROM images WHERE scan_key = ?", (result['key'],))
+                elif result['status'] == 'rejected':
+                    self.db.execute("UPDATE scans SET state = ?, error = ? WHERE key = ?",
+                                    (REJECTED, "; ".join(result['errors']), result['key']))
+                else:
+                    self.db.execute("UPDATE scans SET error = ? WHERE key = ?",
+                                    ("; ".join(result.get('errors', [])), result['key']))
+
+    def requeue(self):
+        """Queue rejected scans again (e.g. once their patient exists); returns how many."""
+        with self.db:
+            return self.db.execute("UPDATE scans SET state = ?, error = NULL WHERE state = ?",
+                                   (QUEUED, REJECTED)).rowcount
+
+    def counts(self):
+        return dict(self.db.execute("SELECT state, COUNT(*) FROM scans GROUP BY state").fetchall())
+
+    def rejected(self):
+        return self.db.execute("SELECT key, patient_id, captured_at, error FROM scans WHERE state = ? "
+                               "ORDER BY captured_at", (REJECTED,)).fetchall()
+
+    # ---------------- Delta pull ----------------
+    @property
+    def cursor(self):
+        row = self.db.execute("SELECT value FROM state WHERE name = 'cursor'").fetchone()
+        return row['value'] if row else ''
+
+    def apply_changes(self, changes):
+        with self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO patients (id, username, email, age, gender) "
+                "VALUES (:id, :username, :email, :age, :gender)", changes['patients'])
+            self.db.executemany(
+                "INSERT OR REPLACE INTO results (id, patient_id, visit_id, eye, disease, worst_stage, date_time) "
+                "VALUES (:id, :patient, :visit, :eye, :disease, :worst_stage, :date_time)", changes['results'])
+            self.db.execute("INSERT OR REPLACE INTO state (name, value) VALUES ('cursor', ?)", (changes['cursor'],))
+
+    def patient_exists(self, patient_id):
+        return self.db.execute("SELECT 1 FROM patients WHERE id = ?", (patient_id,)).fetchone() is not None
+
+
+# ---------------- Server ----------------
+class SyncClient:
+    """Scanner login plus the two sync endpoints, over one keep-alive session."""
+
+    def __init__(self, server, username, password, timeout=TIMEOUT):
+        self.server = server.rstrip('/')
+        self.username = username
+        self.password = password
+        self.timeout = timeout
+        self.http = requests.Session()
+
+    def _csrf_headers(self):
+        return {'X-CSRFToken': self.http.cookies.get(settings.CSRF_COOKIE_NAME, ''),
+                'Referer': self.server + reverse('login')}
+
+    def login(self):
+        url = self.server + reverse('login')
+        self.http.get(url, timeout=self.timeout).raise_for_status()
+        self.http.post(url, data={'username': self.username, 'password': self.password, 'role': 'scanner'},
+                       headers=self._csrf_headers(), allow_redirects=False, timeout=self.timeout)
+        # The session is only created for a successful login
+        if settings.SESSION_COOKIE_NAME not in self.http.cookies:
+            raise OutboxError(f"Could not log in to {self.server} as scanner {self.username}.")
+
+    def push(self, batch):
+        manifest, files = [], []
+        for scan in batch:
+            images = []
+            for image in scan['images']:
+                field = f"image-{len(files)}"
+                content_type = mimetypes.guess_type(image['filename'])[0] or 'application/octet-stream'
+                files.append((field, (image['filename'], image['data'], content_type)))
+                images.append({'file': field, 'eye': image['eye']})
+            manifest.append({'key': scan['key'], 'patient': scan['patient'],
+                             'captured_at': scan.get('captured_at'), 'images': images})
+
+        response = self.http.post(self.server + reverse('sync_scans'), data={'manifest': json.dumps({'scans': manifest})},
+                                  files=files, headers=self._csrf_headers(), timeout=self.timeout)
+        if response.status_code == 400:
+            # VISIONCARE_SYNC_BATCH is above the server's limit; split the batch
+            try:
+                limit = response.json().get('max_scans')
+            except ValueError:
+                limit = None
+            if limit and len(batch) > limit:
+                return [result for i in range(0, len(batch), limit) for result in self.push(batch[i:i + limit])]
+        response.raise_for_status()
+        return response.json()['results']
+
+    def changes(self, since):
+        response = self.http.get(self.server + reverse('sync_changes'), params={'since': since}, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+
+def push(outbox, client):
+    """Send every queued scan; returns the results in order."""
+    results = []
+    for batch in outbox.batches():
+        batch_results = client.push(batch)
+        outbox.record(batch_results)
+        results.extend(batch_results)
+    return results
+
+
+def pull(outbox, client):
+    """Fetch patients and results since the stored cursor; returns (patients, results)."""
+    patients = results = 0
+    while True:
+        changes = client.changes(outbox.cursor)
+        outbox.apply_changes(changes)
+        patients += len(changes['patients'])
+        results += len(changes['results'])
+        if not changes['more']:
+            return patients, results
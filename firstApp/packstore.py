@@ -0,0 +1,237 @@
+"""
+Packed archive tier for cold media files.
+
+Old report images and PDFs are moved out of MEDIA_ROOT into one append-only
+pack file per month (``media/packs/2025-10.pack``) with a small binary offset
+index next to it (``2025-10.idx``).  PackedFileSystemStorage serves a file
+from disk as usual when it is still loose, and otherwise reads it straight
+out of the memory-mapped pack, so FileField/ImageField access is unchanged.
+
+Index records are appended, never rewritten:
+
+    <offset: u64> <length: u32> <name length: u16> <name: utf-8>
+
+A length of TOMBSTONE marks the name as deleted.
+"""
+import io
+import mmap
+import os
+import struct
+import threading
+
+from django.core.files.base import File
+from django.core.files.storage import FileSystemStorage
+from django.urls import reverse
+from django.utils.functional import cached_property
+
+try:
+    import fcntl
+except ImportError:  # Windows development machines
+    fcntl = None
+
+PACK_DIR = 'packs'
+RECORD = struct.Struct('<QIH')
+TOMBSTONE = 0xFFFFFFFF
+COPY_CHUNK = 1024 * 1024
+
+
+class PackedFile(io.RawIOBase):
+    """Read-only, seekable view of one member inside a mapped pack."""
+
+    def __init__(self, mapping, offset, length):
+        self._view = memoryview(mapping)[offset:offset + length]
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        n = min(len(b), len(self._view) - self._pos)
+        if n <= 0:
+            return 0
+        b[:n] = self._view[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += len(self._view)
+        self._pos = max(0, offset)
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+    def close(self):
+        if not self.closed:
+            self._view.release()
+        super().close()
+
+
+class PackIndex:
+    """In-memory view of every pack index under ``root``.
+
+    Each .idx file is read incrementally: only records appended since the
+    last look are parsed, so picking up a fresh archive run is cheap.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.entries = {}   # name -> (pack, offset, length)
+        self._read_upto = {}
+        self._maps = {}
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        if not os.path.isdir(self.root):
+            return
+        with self._lock:
+            for filename in os.listdir(self.root):
+                if not filename.endswith('.idx'):
+                    continue
+                pack = filename[:-4]
+                path = os.path.join(self.root, filename)
+                start = self._read_upto.get(pack, 0)
+                if os.path.getsize(path) <= start:
+                    continue
+                with open(path, 'rb') as f:
+                    f.seek(start)
+                    data = f.read()
+                pos = 0
+                while pos + RECORD.size <= len(data):
+                    offset, length, name_len = RECORD.unpack_from(data, pos)
+                    end = pos + RECORD.size + name_len
+                    if end > len(data):
+                        break  # record still being written
+                    name = data[pos + RECORD.size:end].decode('utf-8')
+                    if length == TOMBSTONE:
+                        self.entries.pop(name, None)
+                    else:
+                        self.entries[name] = (pack, offset, length)
+                    pos = end
+                self._read_upto[pack] = start + pos
+
+    def lookup(self, name):
+        entry = self.entries.get(name)
+        if entry is None:
+            self.refresh()
+            entry = self.entries.get(name)
+        return entry
+
+    def mapping(self, pack, needed):
+        """mmap of ``pack`` covering at least ``needed`` bytes."""
+        with self._lock:
+            mapping = self._maps.get(pack)
+            if mapping is None or len(mapping) < needed:
+                with open(os.path.join(self.root, pack + '.pack'), 'rb') as f:
+                    mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self._maps[pack] = mapping
+            return mapping
+
+
+class PackedFileSystemStorage(FileSystemStorage):
+    """FileSystemStorage that falls back to the monthly packs for cold files."""
+
+    @cached_property
+    def pack_root(self):
+        return os.path.join(self.location, PACK_DIR)
+
+    @cached_property
+    def pack_index(self):
+        return PackIndex(self.pack_root)
+
+    def is_loose(self, name):
+        """True while ``name`` is a plain file under MEDIA_ROOT, i.e. not archived yet."""
+        return os.path.exists(self.path(name))
+
+    def _open(self, name, mode='rb'):
+        if self.is_loose(name) or 'r' not in mode or '+' in mode:
+            return super()._open(name, mode)
+        entry = self.pack_index.lookup(name)
+        if entry is None:
+            return super()._open(name, mode)
+        pack, offset, length = entry
+        mapping = self.pack_index.mapping(pack, offset + length)
+        return File(io.BufferedReader(PackedFile(mapping, offset, length)), name=name)
+
+    def exists(self, name):
+        return super().exists(name) or self.pack_index.lookup(name) is not None
+
+    def size(self, name):
+        if self.is_loose(name):
+            return super().size(name)
+        entry = self.pack_index.lookup(name)
+        if entry is None:
+            return super().size(name)
+        return entry[2]
+
+    def url(self, name):
+        if name and not self.is_loose(name) and self.pack_index.lookup(name) is not None:
+            return reverse('archived_media', args=[name])
+        return super().url(name)
+
+    def delete(self, name):
+        if not self.is_loose(name) and self.pack_index.lookup(name) is not None:
+            pack = self.pack_index.entries[name][0]
+            with _locked(os.path.join(self.pack_root, pack + '.lock')):
+                _append_index(os.path.join(self.pack_root, pack + '.idx'), name, 0, TOMBSTONE)
+            self.pack_index.entries.pop(name, None)
+            return
+        super().delete(name)
+
+    # ---------------- Archiving ----------------
+    def archive(self, name, pack):
+        """Move loose file ``name`` into ``pack``.  Returns bytes moved.
+
+        The data and its index record are fsync'd before the loose file is
+        removed, so a crash at any point leaves the file readable.
+        """
+        src_path = self.path(name)
+        os.makedirs(self.pack_root, exist_ok=True)
+        pack_path = os.path.join(self.pack_root, pack + '.pack')
+        with _locked(os.path.join(self.pack_root, pack + '.lock')):
+            with open(pack_path, 'ab') as dest, open(src_path, 'rb') as src:
+                offset = dest.tell()
+                while True:
+                    block = src.read(COPY_CHUNK)
+                    if not block:
+                        break
+                    dest.write(block)
+                length = dest.tell() - offset
+                dest.flush()
+                os.fsync(dest.fileno())
+            _append_index(os.path.join(self.pack_root, pack + '.idx'), name, offset, length)
+        os.remove(src_path)
+        self.pack_index.entries[name] = (pack, offset, length)
+        return length
+
+
+class _locked:
+    """Exclusive advisory lock on ``path`` (no-op where fcntl is missing)."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def __enter__(self):
+        self.f = open(self.path, 'a')
+        if fcntl:
+            fcntl.flock(self.f, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if fcntl:
+            fcntl.flock(self.f, fcntl.LOCK_UN)
+        self.f.close()
+
+
+def _append_index(idx_path, name, offset, length):
+    encoded = name.encode('utf-8')
+    with open(idx_path, 'ab') as f:
+        f.write(RECORD.pack(offset, length, len(encoded)) + encoded)
+        f.flush()
+        os.fsync(f.fileno())
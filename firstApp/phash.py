@@ -0,0 +1,61 @@
+"""
+Perceptual-hash index for near-duplicate fundus images.
+
+Every stored EyeReport image gets a 64-bit difference hash (dHash).  Re-saved
+or re-compressed copies of a photo hash to (almost) the same value, so an
+upload that matches one of the patient's earlier images is flagged as a
+likely re-upload, linked to that report and given its result without
+running inference again.
+
+The lookup reads the patient's hashes from the database on each scan rather
+than from an in-process index: a patient has a handful of reports, so this
+is one indexed query, and every worker sees reports the others just stored.
+"""
+from PIL import Image
+
+HASH_SIZE = 8
+# Max differing bits (of 64).  Re-saved copies land at 0-1 bits, while
+# different retinas in media/ come as close as 5.
+DUPLICATE_THRESHOLD = 2
+
+
+def dhash(image_file):
+    """64-bit dHash of ``image_file`` as a 16-char hex string."""
+    img = Image.open(image_file)
+    img.draft("L", (HASH_SIZE * 4, HASH_SIZE * 4))
+    img = img.convert("L").resize((HASH_SIZE + 1, HASH_SIZE), Image.LANCZOS)
+    px = img.load()
+    value = 0
+    for y in range(HASH_SIZE):
+        for x in range(HASH_SIZE):
+            value = (value << 1) | (px[x, y] > px[x + 1, y])
+    if hasattr(image_file, "seek"):
+        image_file.seek(0)
+    return f"{value:016x}"
+
+
+def hamming(a, b):
+    return (a ^ b).bit_count()
+
+
+def find_duplicates(patient, hashes, threshold=DUPLICATE_THRESHOLD):
+    """For each of ``hashes``, the patient's closest earlier EyeReport within
+    ``threshold`` bits, or None.
+
+    Only the patient's own reports are compared: different retinas can land
+    within a few bits of each other, a re-upload of the same photo cannot
+    belong to someone else.  The hashes are read from the database, so
+    every worker process sees the same reports.
+    """
+    from .models import EyeReport
+
+    previous = [(report_id, int(value, 16)) for report_id, value in
+                EyeReport.objects.filter(patient=patient).exclude(image_phash="").values_list("id", "image_phash")]
+    matches = []
+    for value in hashes:
+        value = int(value, 16)
+        scored = sorted((hamming(value, other), report_id) for report_id, other in previous)
+        matches.append(scored[0][1] if scored and scored[0][0] <= threshold else None)
+
+    reports = EyeReport.objects.in_bulk([m for m in matches if m is not None])
+    return [reports.get(m) for m in matches]
@@ -0,0 +1,31 @@
+"""
+Model input preparation.  No Django imports, so the dataset export's worker
+processes can use it without loading the app.
+"""
+import numpy as np
+from PIL import Image
+
+# IMPORTANT: This list must match the EXACT order your model was trained on.
+CLASSES = [
+    "Normal",       # Index 0
+    "ROP Stage 1",  # Index 1
+    "ROP Stage 2",  # Index 2
+    "ROP Stage 3",  # Index 3
+    "ROP Stage 4",  # Index 4
+    "ROP Stage 5",  # Index 5
+    "Plus Disease"  # Index 6 (if applicable)
+]
+
+
+def preprocess_image(image):
+    """Path or file object -> 224x224x3 float array as the model expects."""
+    img = Image.open(image)
+    img_d = img.resize((224, 224))
+
+    # Handle PNGs or Grayscale images
+    if img_d.mode != "RGB":
+        img_d = img_d.convert("RGB")
+
+    if hasattr(image, 'seek'):
+        image.seek(0)
+    return np.array(img_d, dtype=np.float64)
@@ -0,0 +1,278 @@
+"""
+PDF rendering for EyeReport and Visit.
+
+The page chrome (border, header band and footer) is identical on every page
+of every report, so it is drawn once per PDF into a ReportLab form XObject
+and stamped onto each page by reference.  The patient and diagnosis blocks
+are laid out from REPORT_SECTIONS, and fundus images are downsampled to the
+resolution they are actually printed at before being embedded.
+"""
+import io
+import logging
+from functools import lru_cache
+from types import SimpleNamespace
+
+from PIL import Image
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.utils import ImageReader, simpleSplit
+from reportlab.pdfgen import canvas
+
+logger = logging.getLogger(__name__)
+
+PAGE_WIDTH, PAGE_HEIGHT = A4
+MARGIN = 50
+BRAND_COLOR = colors.HexColor("#024b30")
+CLINIC_NAME = "Vision Care Clinic"
+FOOTER_TEXT = "Thank you for choosing Vision Care Clinic"
+
+CHROME_FORM = "page_chrome"
+HEADER_HEIGHT = 80
+FOOTER_HEIGHT = 50
+CONTENT_TOP = PAGE_HEIGHT - 120
+CONTENT_BOTTOM = MARGIN + 50
+
+# Fundus images are printed in a 200x200 pt box; anything above ~150 DPI is
+# invisible on paper but still ends up in the file.
+IMAGE_BOX = 200
+IMAGE_DPI = 150
+IMAGE_QUALITY = 80
+IMAGE_PIXELS = int(IMAGE_BOX / 72 * IMAGE_DPI)
+
+BODY_FONT = ("Times-Roman", 14)
+HEADING_FONT = ("Times-Bold", 16)
+WRAP_FONT = ("Times-Roman", 13)
+
+
+# ---------------- Declarative layout ----------------
+# Each field is (label, source, options).  ``source`` is a dotted path
+# resolved against {"patient": ..., "profile": ..., "report" or "visit": ...}.
+#   optional -> skip the row when the value is empty
+#   wrap     -> value is long text, wrapped to the page width
+REPORT_SECTIONS = [
+    {
+        "title": "Patient Information:",
+        "color": colors.black,
+        "style": "inline",
+        "fields": [
+            ("Name", "patient.username", {}),
+            ("Email", "patient.email", {}),
+            ("Age", "profile.age", {}),
+            ("Contact", "profile.contact_number", {}),
+            ("Address", "profile.address", {}),
+            ("Blood Group", "profile.blood_group", {}),
+            ("Gender", "profile.gender", {}),
+            ("Other Info", "profile.other_info", {"optional": True}),
+        ],
+    },
+    {
+        "title": "Diagnosis & Recommendations:",
+        "color": BRAND_COLOR,
+        "style": "block",
+        "fields": [
+            ("Disease Detected", "report.disease", {}),
+            ("Solution & Care", "report.solution", {"wrap": True}),
+        ],
+    },
+]
+
+
+VISIT_SECTIONS = [
+    REPORT_SECTIONS[0],
+    {
+        "title": "Visit Summary:",
+        "color": BRAND_COLOR,
+        "style": "block",
+        "fields": [
+            ("Worst Stage", "visit.worst_stage", {}),
+            ("Images Screened", "visit.image_count", {}),
+            ("Solution & Care", "visit.solution", {"wrap": True}),
+        ],
+    },
+]
+
+
+def _resolve(source, context):
+    obj = context
+    for i, part in enumerate(source.split(".")):
+        obj = obj.get(part) if i == 0 else getattr(obj, part, None)
+        if obj is None:
+            return None
+    return obj
+
+
+# ---------------- Page chrome ----------------
+def _draw_chrome(c):
+    # Border
+    c.setStrokeColor(BRAND_COLOR)
+    c.setLineWidth(3)
+    c.rect(MARGIN / 2, MARGIN / 2, PAGE_WIDTH - MARGIN, PAGE_HEIGHT - MARGIN, stroke=1, fill=0)
+
+    # Header
+    c.setFillColor(BRAND_COLOR)
+    c.rect(0, PAGE_HEIGHT - HEADER_HEIGHT, PAGE_WIDTH, HEADER_HEIGHT, stroke=0, fill=1)
+    c.setFillColor(colors.white)
+    c.setFont("Times-Bold", 26)
+    c.drawCentredString(PAGE_WIDTH / 2, PAGE_HEIGHT - 50, CLINIC_NAME)
+
+    # Footer
+    c.setFillColor(BRAND_COLOR)
+    c.rect(0, 0, PAGE_WIDTH, FOOTER_HEIGHT, stroke=0, fill=1)
+    c.setFillColor(colors.white)
+    c.setFont("Times-Italic", 12)
+    c.drawCentredString(PAGE_WIDTH / 2, 20, FOOTER_TEXT)
+
+
+class ReportCanvas:
+    """Thin wrapper around a canvas that stamps the chrome on every page."""
+
+    def __init__(self, target):
+        self.c = canvas.Canvas(target, pagesize=A4, pageCompression=1)
+        self.c.beginForm(CHROME_FORM)
+        _draw_chrome(self.c)
+        self.c.endForm()
+        self._start_page()
+
+    def _start_page(self):
+        self.c.doForm(CHROME_FORM)
+        # showPage() resets the graphics state; start every page in body text
+        self.c.setFillColor(colors.black)
+        self.c.setFont(*BODY_FONT)
+        self.y = CONTENT_TOP
+
+    def new_page(self):
+        self.c.showPage()
+        self._start_page()
+
+    def ensure_space(self, needed):
+        if self.y - needed < CONTENT_BOTTOM:
+            self.new_page()
+
+    def save(self):
+        self.c.showPage()
+        self.c.save()
+
+
+# ---------------- Image downsampling ----------------
+@lru_cache(maxsize=64)
+def _downsampled_jpeg(storage, name, max_pixels=IMAGE_PIXELS):
+    with storage.open(name, "rb") as f:
+        img = Image.open(f)
+        img.draft("RGB", (max_pixels, max_pixels))
+        img = img.convert("RGB")
+        img.thumbnail((max_pixels, max_pixels), Image.LANCZOS)
+        buf = io.BytesIO()
+        img.save(buf, format="JPEG", quality=IMAGE_QUALITY, optimize=True)
+    return buf.getvalue()
+
+
+def print_image(field_file, max_pixels=IMAGE_PIXELS):
+    """Return an ImageReader for ``field_file`` re-encoded at print size."""
+    data = _downsampled_jpeg(field_file.storage, field_file.name, max_pixels)
+    return ImageReader(io.BytesIO(data))
+
+
+# ---------------- Section rendering ----------------
+def _draw_section(rc, section, context):
+    c = rc.c
+    rc.ensure_space(60)
+    c.setFillColor(section["color"])
+    c.setFont(*HEADING_FONT)
+    c.drawString(MARGIN, rc.y, section["title"])
+    rc.y -= 25
+
+    c.setFillColor(colors.black)
+    c.setFont(*BODY_FONT)
+    for label, source, options in section["fields"]:
+        value = _resolve(source, context)
+        if options.get("optional") and not value:
+            continue
+        if value is None or value == "":
+            value = "N/A"
+
+        if section["style"] == "inline":
+            rc.ensure_space(20)
+            c.drawString(MARGIN + 10, rc.y, f"{label}: {value}")
+            rc.y -= 20
+            continue
+
+        rc.ensure_space(38)
+        c.drawString(MARGIN + 10, rc.y, f"{label}:")
+        rc.y -= 18
+        if options.get("wrap"):
+            lines = simpleSplit(str(value), WRAP_FONT[0], WRAP_FONT[1], PAGE_WIDTH - 2 * MARGIN - 20)
+            for line in lines:
+                if rc.y < CONTENT_BOTTOM:
+                    rc.new_page()
+                c.drawString(MARGIN + 20, rc.y, line)
+                rc.y -= 18
+        else:
+            c.drawString(MARGIN + 20, rc.y, str(value))
+            rc.y -= 20
+    rc.y -= 10
+
+
+def draw_fundus_image(rc, field_file, x=None):
+    """Draw ``field_file`` in the IMAGE_BOX below the current position."""
+    try:
+        image = print_image(field_file)
+    except Exception as e:
+        logger.warning("Could not add %s to the PDF: %s", field_file.name, e)
+        return
+    rc.ensure_space(IMAGE_BOX)
+    if x is None:
+        x = PAGE_WIDTH - MARGIN - IMAGE_BOX
+    rc.c.drawImage(image, x, rc.y - IMAGE_BOX + 20, IMAGE_BOX, IMAGE_BOX)
+    rc.y -= IMAGE_BOX + 20
+
+
+def render_report_pdf(report, profile, target):
+    """Render ``report`` to ``target`` (a path or a binary file object)."""
+    rc = ReportCanvas(target)
+    context = {"patient": report.patient, "profile": profile, "report": report}
+    for section in REPORT_SECTIONS:
+        _draw_section(rc, section, context)
+    if report.report_image:
+        draw_fundus_image(rc, report.report_image)
+    rc.save()
+
+
+def _draw_image_grid(rc, reports, columns=2):
+    c = rc.c
+    rc.ensure_space(40)
+    c.setFillColor(BRAND_COLOR)
+    c.setFont(*HEADING_FONT)
+    c.drawString(MARGIN, rc.y, "Images:")
+    rc.y -= 25
+
+    gap = (PAGE_WIDTH - 2 * MARGIN - columns * IMAGE_BOX) / max(columns - 1, 1)
+    row_top = rc.y
+    for i, report in enumerate(reports):
+        col = i % columns
+        if col == 0:
+            rc.ensure_space(IMAGE_BOX + 30)
+            row_top = rc.y
+        x = MARGIN + col * (IMAGE_BOX + gap)
+
+        caption = f"{report.get_eye_display() or 'Eye'} #{i + 1}: {report.disease}"
+        c.setFillColor(colors.black)
+        c.setFont(*WRAP_FONT)
+        c.drawString(x, row_top, caption)
+        try:
+            c.drawImage(print_image(report.report_image), x, row_top - 8 - IMAGE_BOX, IMAGE_BOX, IMAGE_BOX)
+        except Exception as e:
+            logger.warning("Could not add %s to the PDF: %s", report.report_image.name, e)
+
+        if col == columns - 1 or i == len(reports) - 1:
+            rc.y = row_top - IMAGE_BOX - 30
+
+
+def render_visit_pdf(visit, reports, profile, solution, target):
+    """Render one PDF covering every image of ``visit``."""
+    summary = SimpleNamespace(worst_stage=visit.worst_stage, image_count=len(reports), solution=solution)
+    rc = ReportCanvas(target)
+    context = {"patient": visit.patient, "profile": profile, "visit": summary}
+    for section in VISIT_SECTIONS:
+        _draw_section(rc, section, context)
+    _draw_image_grid(rc, reports)
+    rc.save()
@@ -0,0 +1,142 @@
+"""
+Daily screening rollups.
+
+DailyRollup holds one row per (day, scanner, disease) with the number of
+scans and how many visits were a one-stage progression from the patient's
+previous visit, comparing the worst stage of each.  Rows are updated
+incrementally whenever an EyeReport is created or deleted, and
+``manage.py rebuild_rollups`` recomputes them from scratch.  Trend endpoints read only this table.
+"""
+from collections import defaultdict, namedtuple
+
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import DailyRollup, EyeReport
+from .stages import worst_stage
+
+STAGE_ORDER = ["Normal", "ROP Stage 1", "ROP Stage 2", "ROP Stage 3", "ROP Stage 4", "ROP Stage 5"]
+
+
+def is_progression(previous, current):
+    """True when ``current`` is exactly one stage above ``previous``."""
+    if previous not in STAGE_ORDER or current not in STAGE_ORDER:
+        return False
+    return STAGE_ORDER.index(current) == STAGE_ORDER.index(previous) + 1
+
+
+# One report as the rollups see it; a report without a visit is its own visit
+Report = namedtuple('Report', 'id visit_id date_time scanned_by_id disease')
+REPORT_FIELDS = Report._fields
+
+
+def _key(report, disease=None):
+    return (timezone.localdate(report.date_time), report.scanned_by_id, disease or report.disease)
+
+
+def contributions(reports):
+    """(day, scanner, disease) -> [scans, progressions] for one patient's reports.
+
+    Every report counts as a scan.  Progression is measured visit to visit on
+    the worst stage, so the two eyes of one visit are never compared with
+    each other; it is counted once, on the report that set the visit's stage.
+    """
+    visits = {}
+    for report in sorted(reports, key=lambda r: (r.date_time, r.id)):
+        visits.setdefault(report.visit_id or ('report', report.id), []).append(report)
+    totals = defaultdict(lambda: [0, 0])
+    previous = None
+    for visit in visits.values():
+        for report in visit:
+            totals[_key(report)][0] += 1
+        stage = worst_stage([report.disease for report in visit])
+        if is_progression(previous, stage):
+            worst = next(report for report in visit if report.disease == stage)
+            totals[_key(worst)][1] += 1
+        previous = stage
+    return totals
+
+
+def _bump(key, scans, progressions):
+    """Add to the rollup row ``key``; decrements never create a row or go below zero."""
+    if not scans and not progressions:
+        return
+    day, scanner_id, disease = key
+    key = {'day': day, 'scanner_id': scanner_id, 'disease': disease}
+    update = {}
+    for column, n in (('scans', scans), ('progressions', progressions)):
+        if n:
+            update[column] = F(column) + n if n > 0 else Greatest(F(column) + n, 0)
+    with transaction.atomic():
+        if scans < 0:
+            DailyRollup.objects.filter(**key).update(**update)
+            # Match rebuild(), which has no rows for days without scans
+            DailyRollup.objects.filter(**key, scans=0).delete()
+            return
+        if DailyRollup.objects.filter(**key).update(**update) or not scans:
+            return
+        # First scan of the day for this key; get_or_create retries the get
+        # if a concurrent request creates the row first
+        row, _ = DailyRollup.objects.get_or_create(**key)
+        DailyRollup.objects.filter(pk=row.pk).update(**update)
+
+
+def _apply(report, sign):
+    """Apply the difference ``report`` makes to its patient's rollups.
+
+    Adding or removing one eye can change its visit's stage and so the
+    progression of the next visit too, hence the whole patient is compared
+    with and without it.
+    """
+    others = [Report(*row) for row in EyeReport.objects.filter(patient_id=report.patient_id)
+              .exclude(id=report.id).values_list(*REPORT_FIELDS)]
+    without = contributions(others)
+    with_report = contributions(others + [Report(*(getattr(report, f) for f in REPORT_FIELDS))])
+    for key in set(without) | set(with_report):
+        scans, progressions = (a - b for a, b in zip(with_report[key], without[key]))
+        _bump(key, sign * scans, sign * progressions)
+
+
+@receiver(post_save, sender=EyeReport)
+def report_created(sender, instance, created, **kwargs):
+    if created:
+        _apply(instance, 1)
+
+
+@receiver(post_delete, sender=EyeReport)
+def report_deleted(sender, instance, **kwargs):
+    _apply(instance, -1)
+
+
+def rebuild(report_model=EyeReport, rollup_model=DailyRollup):
+    """Recompute every rollup row in one ordered pass over EyeReport, a patient at a time.
+
+    The models can be swapped for historical ones, so migrations can backfill.
+    """
+    totals = defaultdict(lambda: [0, 0])
+    reports = (report_model.objects.order_by('patient_id', 'date_time', 'id')
+               .values_list('patient_id', *REPORT_FIELDS))
+
+    def add(patient_reports):
+        for key, (scans, progressions) in contributions(patient_reports).items():
+            totals[key][0] += scans
+            totals[key][1] += progressions
+
+    current, patient_reports = None, []
+    for patient_id, *fields in reports.iterator(chunk_size=5000):
+        if patient_id != current:
+            add(patient_reports)
+            current, patient_reports = patient_id, []
+        patient_reports.append(Report(*fields))
+    add(patient_reports)
+
+    rows = [rollup_model(day=day, scanner_id=scanner_id, disease=disease, scans=scans, progressions=progressions)
+            for (day, scanner_id, disease), (scans, progressions) in totals.items()]
+    with transaction.atomic():
+        rollup_model.objects.all().delete()
+        rollup_model.objects.bulk_create(rows, batch_size=1000)
+    return len(rows)
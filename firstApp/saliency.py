@@ -0,0 +1,181 @@
+"""
+Grad-CAM overlays showing where the classifier looked.
+
+Overlays are never computed on the scan path.  The first time a doctor asks
+for one (``report_saliency``) it is queued on a small background pool; once
+built it is stored through the report's storage as
+``saliency/<image sha1>_<model version>.jpg``, so re-uploads of the same
+image share one overlay and a new model invalidates the old ones.  Hashing
+the image is part of the background job too; requests only look up names
+the job has already resolved.
+
+VISIONCARE_SALIENCY_PRECOMPUTE=1 also queues overlays for high-stage results
+as soon as they are scanned.
+"""
+import hashlib
+import io
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+import numpy as np
+from django.core.files.base import ContentFile
+from PIL import Image
+
+from .inference import BACKEND, get_model, model_version
+
+OVERLAY_DIR = 'saliency'
+OVERLAY_SIZE = 512
+OVERLAY_QUALITY = 75
+OVERLAY_ALPHA = 0.5
+INPUT_SIZE = 224
+
+PRECOMPUTE = os.environ.get('VISIONCARE_SALIENCY_PRECOMPUTE', '0') == '1'
+HIGH_STAGES = {"ROP Stage 3", "ROP Stage 4", "ROP Stage 5", "Plus Disease"}
+
+READY = 'ready'
+PENDING = 'pending'
+ERROR = 'error'
+
+_executor = ThreadPoolExecutor(max_workers=int(os.environ.get('VISIONCARE_SALIENCY_WORKERS', 1)),
+                               thread_name_prefix='saliency')
+_pending = set()
+_failed = {}
+_overlays = {}  # image name -> stored overlay name, once built
+_lock = threading.Lock()
+
+logger = logging.getLogger(__name__)
+
+
+# ---------------- Heatmaps ----------------
+@lru_cache(maxsize=1)
+def _grad_model(model):
+    import tensorflow as tf
+
+    # Last layer with a spatial output: the top of the EfficientNet backbone
+    conv = next(layer for layer in reversed(model.layers) if len(layer.output.shape) == 4)
+    return tf.keras.Model(model.inputs, [conv.output, model.output])
+
+
+def _grad_cam(model, batch):
+    import tensorflow as tf
+
+    with tf.GradientTape() as tape:
+        conv_out, predictions = _grad_model(model)(batch)
+        top = predictions[:, int(tf.argmax(predictions[0]))]
+    grads = tape.gradient(top, conv_out)
+    weights = tf.reduce_mean(grads, axis=(1, 2))
+    cam = tf.nn.relu(tf.reduce_sum(conv_out * weights[:, None, None, :], axis=-1))
+    return cam[0].numpy()
+
+
+def _contrast_map(batch):
+    # StubModel has no gradients; local green-channel contrast (vessels,
+    # ridges) stands in so the rest of the pipeline can be exercised.
+    gy, gx = np.gradient(batch[0, ..., 1])
+    grad = Image.fromarray(np.hypot(gx, gy).astype(np.float32))
+    return np.asarray(grad.resize((14, 14), Image.BILINEAR))
+
+
+def heatmap(image):
+    """Saliency in [0, 1] for the image file, at the backbone's resolution."""
+    img = Image.open(image).convert('RGB').resize((INPUT_SIZE, INPUT_SIZE))
+    batch = np.asarray(img, dtype=np.float64)[None]
+    cam = _contrast_map(batch) if BACKEND == 'stub' else _grad_cam(get_model(), batch)
+    cam = cam - cam.min()
+    return cam / cam.max() if cam.max() > 0 else cam
+
+
+def _colormap(cam):
+    # Jet-style blue -> green -> red
+    x = cam[..., None] * 4
+    rgb = np.clip(1.5 - np.abs(x - np.array([3.0, 2.0, 1.0])), 0, 1)
+    return rgb * 255
+
+
+def render_overlay(image, cam):
+    """JPEG bytes of ``image`` with ``cam`` blended over it."""
+    base = Image.open(image)
+    base.draft('RGB', (OVERLAY_SIZE, OVERLAY_SIZE))
+    base = base.convert('RGB')
+    base.thumbnail((OVERLAY_SIZE, OVERLAY_SIZE), Image.LANCZOS)
+
+    cam_img = Image.fromarray((cam * 255).astype(np.uint8)).resize(base.size, Image.BICUBIC)
+    cam = np.asarray(cam_img, dtype=np.float32) / 255.0
+    alpha = OVERLAY_ALPHA * cam[..., None]
+    blended = np.asarray(base, dtype=np.float32) * (1 - alpha) + _colormap(cam) * alpha
+
+    buf = io.BytesIO()
+    Image.fromarray(blended.astype(np.uint8)).save(buf, format='JPEG', quality=OVERLAY_QUALITY, optimize=True)
+    return buf.getvalue()
+
+
+# ---------------- Cache ----------------
+@lru_cache(maxsize=4096)
+def _image_digest(storage, name):
+    digest = hashlib.sha1()
+    with storage.open(name, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def overlay_name(storage, name):
+    return f"{OVERLAY_DIR}/{_image_digest(storage, name)}_{model_version()}.jpg"
+
+
+def _build(storage, name):
+    try:
+        target = overlay_name(storage, name)
+        if not storage.exists(target):
+            with storage.open(name, 'rb') as f:
+                cam = heatmap(f)
+                f.seek(0)
+                data = render_overlay(f, cam)
+            target = storage.save(target, ContentFile(data))
+        with _lock:
+            _overlays[name] = target
+    except Exception as e:
+        logger.exception("Error computing saliency overlay for %s", name)
+        with _lock:
+            _failed[name] = str(e)
+    finally:
+        with _lock:
+            _pending.discard(name)
+
+
+def _schedule(storage, name):
+    with _lock:
+        if name in _pending:
+            return
+        _pending.add(name)
+    _executor.submit(_build, storage, name)
+
+
+def overlay_status(field_file):
+    """(status, url or error message) for the overlay of ``field_file``.
+
+    Queues the overlay when this process has not resolved it yet (the job
+    finds an overlay another process already stored); a failed build is
+    reported once and retried on the next request.
+    """
+    storage, name = field_file.storage, field_file.name
+    with _lock:
+        if name in _failed:
+            return ERROR, _failed.pop(name)
+        target = _overlays.get(name)
+    if target and storage.exists(target):
+        return READY, storage.url(target)
+    _schedule(storage, name)
+    return PENDING, None
+
+
+def precompute(reports):
+    """Queue overlays for the high-stage ``reports`` when precomputation is on."""
+    if not PRECOMPUTE:
+        return
+    for report in reports:
+        if report.disease in HIGH_STAGES and report.report_image:
+            _schedule(report.report_image.storage, report.report_image.name)
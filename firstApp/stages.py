@@ -0,0 +1,12 @@
+"""
+Disease stages shared by the views and the rollups.  Kept free of Django
+imports so anything can use it without pulling in the views.
+"""
+
+# Least to most severe, used for the visit-level summary
+SEVERITY = ["Normal", "Unknown", "ROP Stage 1", "ROP Stage 2", "ROP Stage 3",
+            "Plus Disease", "ROP Stage 4", "ROP Stage 5"]
+
+
+def worst_stage(diseases):
+    return max(diseases, key=lambda d: SEVERITY.index(d) if d in SEVERITY else 1)
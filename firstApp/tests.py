@@ -1,3 +1,1097 @@
-from django.test import TestCase
+"""
+Tests for firstApp.
 
-# Create your tests here.
+Most classes exercise one feature end to end through the test client: scans
+and visits, storage backends, chunked uploads, scanner sync, rollups, the
+live dashboard, saliency overlays, PDF reports and the exports.  Media is
+written to a temporary MEDIA_ROOT (MediaMixin) and inference is stubbed.
+
+QueryBudgetTests checks query-count and template-time budgets for every URL
+in firstApp/urls.py.  The database is seeded at increasing sizes and each URL
+is requested at every size; the views that write also get a valid POST/PUT
+(WRITE_BUDGETS).  A view passes when its query count never exceeds its budget
+and does not grow with the data (no N+1), and its templates render within
+TEMPLATE_BUDGET_MS.  Afterwards the slowest distinct queries are printed with
+their EXPLAIN plans; on SQLite a full scan of a large table fails the run.
+
+    python manage.py test firstApp
+"""
+import csv
+import hashlib
+import io
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+import zipfile
+from contextlib import contextmanager
+from datetime import timedelta
+from unittest import mock
+
+import numpy as np
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.template.backends.django import Template
+from django.test import AsyncClient, Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, reverse
+from django.utils import timezone
+from PIL import Image
+
+from . import dataset, rollups, saliency, triage, uploads, urls
+from .assets import CompressedManifestStaticFilesStorage, pick_variant
+from .inference import StubModel
+from .models import ChunkedUpload, DailyRollup, DashboardEvent, EyeReport, SyncedScan, UserProfile, Visit
+from .objectstore import LocalObjectStorage
+from .outbox import Outbox, SyncClient, pull, push
+from .packstore import PackedFileSystemStorage
+from .preprocess import preprocess_image
+from .reports import IMAGE_PIXELS, render_report_pdf, render_visit_pdf
+
+SIZES = (5, 25, 100)
+REPORTS_PER_PATIENT = 3
+TEMPLATE_BUDGET_MS = float(os.environ.get('VISIONCARE_TEMPLATE_BUDGET_MS', 500))
+EXPLAIN_TOP = 8
+# Tables that grow with usage; a plain SCAN of one of these is an index regression
+LARGE_TABLES = ('firstApp_eyereport', 'firstApp_visit', 'firstApp_dailyrollup', 'firstApp_dashboardevent')
+
+# url name -> (session role, url kwargs, query budget).  The budget counts the
+# session lookup and, for 'patient', the auth user lookup.
+BUDGETS = {
+    'index': (None, {}, 0),
+    'eye': (None, {}, 0),
+    'login': (None, {}, 0),
+    'signup': (None, {}, 0),
+    'scanner_dashboard': ('scanner', {}, 3),
+    'scan_patient': ('scanner', {'user_id': 'patient'}, 3),
+    'upload_start': ('scanner', {'user_id': 'patient'}, 1),
+    'upload_finish': ('scanner', {'user_id': 'patient'}, 1),
+    'upload_status': ('scanner', {'upload_id': 'upload'}, 3),
+    'upload_chunk': ('scanner', {'upload_id': 'upload', 'offset': 0}, 1),
+    'sync_scans': ('scanner', {}, 1),
+    'sync_changes': ('scanner', {}, 3),
+    'patient_dashboard': ('patient', {}, 4),
+    'admin_dashboard': (None, {}, 0),
+    'doctor_dashboard': ('doctor', {}, 3),
+    # The test client is WSGI, so this measures the 204 that stops EventSource
+    'dashboard_events': ('doctor', {}, 1),
+    'patient_detail': ('doctor', {'user_id': 'patient'}, 3),
+    'mark_scan_done': ('doctor', {'user_id': 'patient'}, 1),
+    'report_saliency': ('doctor', {'report_id': 'report'}, 2),
+    'export_reports': ('doctor', {}, 2),
+    'analytics_trends': ('doctor', {'metric': 'stages'}, 2),
+    'archived_media': (None, {'path': 'missing.jpg'}, 0),
+    'static_asset': (None, {'path': 'firstApp/css/patient.css'}, 0),
+}
+
+# The flows that write, measured with a valid request: url name -> (method,
+# session role, url kwargs, query budget).  Bodies come from
+# QueryBudgetTests.payload(); the GET budgets above cover their 405s.
+WRITE_BUDGETS = {
+    'scan_patient': ('post', 'scanner', {'user_id': 'patient'}, 20),
+    'upload_start': ('post', 'scanner', {'user_id': 'patient'}, 4),
+    'upload_chunk': ('put', 'scanner', {'upload_id': 'upload', 'offset': 0}, 3),
+    'upload_finish': ('post', 'scanner', {'user_id': 'patient'}, 21),
+    'sync_scans': ('post', 'scanner', {}, 21),
+}
+
+# Not measured, with the reason
+EXCLUDED = {}
+
+
+@contextmanager
+def timed_templates(durations):
+    """Append the render time (ms) of every Django template to ``durations``."""
+    render = Template.render
+
+    def timed(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return render(self, *args, **kwargs)
+        finally:
+            durations.append((time.perf_counter() - start) * 1000)
+
+    with mock.patch.object(Template, 'render', timed):
+        yield
+
+
+def explain(sql):
+    prefix = 'EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite' else 'EXPLAIN '
+    with connection.cursor() as cursor:
+        cursor.execute(prefix + sql)
+        rows = cursor.fetchall()
+    # SQLite rows are (id, parent, notused, detail)
+    return [row[-1] if connection.vendor == 'sqlite' else ' '.join(map(str, row)) for row in rows]
+
+
+def is_dml(sql):
+    # Savepoint statements are captured too, but have no plan
+    return sql.lstrip().split(None, 1)[0].upper() in ('SELECT', 'INSERT', 'UPDATE', 'DELETE')
+
+
+def full_scans(plan):
+    return [line for line in plan
+            if any(re.match(rf'SCAN {table}\b(?! USING)', line) for table in LARGE_TABLES)]
+
+
+def time_query(sql, repeat=5):
+    with connection.cursor() as cursor:
+        start = time.perf_counter()
+        for _ in range(repeat):
+            cursor.execute(sql)
+            cursor.fetchall()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def print_explain_report(queries):
+    """Print the EXPLAIN plan of the slowest of ``queries`` ({sql: view})."""
+    timed = []
+    for sql, name in queries.items():
+        # Timing runs the statement again, so only reads
+        if not sql.lstrip().upper().startswith('SELECT'):
+            continue
+        try:
+            timed.append((time_query(sql), name, sql))
+        except Exception as e:
+            print(f"Could not time query for {name}: {e}")
+    timed.sort(reverse=True)
+
+    print(f"\n---------------- Slowest {min(EXPLAIN_TOP, len(timed))} queries ----------------")
+    for ms, name, sql in timed[:EXPLAIN_TOP]:
+        print(f"\n[{name}] {ms:.2f} ms\n  {sql}")
+        try:
+            for line in explain(sql):
+                print(f"    {line}")
+        except Exception as e:
+            print(f"    (no plan: {e})")
+
+
+def log_in(client, role, user=None):
+    """Give ``client`` the session a login as ``role`` (and ``user``) leaves behind."""
+    if user is not None:
+        client.force_login(user)
+    if role:
+        session = client.session
+        session['role'] = role
+        session.save()
+    return client
+
+
+class MediaMixin:
+    @classmethod
+    def setUpClass(cls):
+        cls.media_root = tempfile.mkdtemp(prefix='visioncare-test-')
+        # No collectstatic in tests, so no manifest to look hashed names up in
+        cls.media_override = override_settings(MEDIA_ROOT=cls.media_root, STORAGES={
+            **settings.STORAGES,
+            'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+        })
+        cls.media_override.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.media_override.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+
+
+class QueryBudgetTests(MediaMixin, TestCase):
+    def setUp(self):
+        os.makedirs(os.path.join(self.media_root, 'eye_images'), exist_ok=True)
+        Image.new('RGB', (64, 64), 'red').save(os.path.join(self.media_root, 'eye_images', 'seed.jpg'))
+        self.scanner = self.make_user('scanner0', 'scanner')
+        self.patients = []
+        with open(os.path.join(settings.BASE_DIR, 'media', '4624_right.jpg'), 'rb') as f:
+            self.sample = f.read()
+        # Overlays are queued on a thread pool; keep that out of the measurement
+        for patcher in (mock.patch('firstApp.views.overlay_status', return_value=('pending', None)),
+                        mock.patch('firstApp.views.get_model', return_value=StubModel())):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def make_user(self, username, role):
+        user = User.objects.create_user(username, f'{username}@example.com', 'x')
+        UserProfile.objects.create(user=user, role=role, age=1, gender='F', blood_group='O+',
+                                   contact_number='0', address='Ward 1')
+        return user
+
+    def seed(self, patients):
+        """Grow the database to ``patients`` patients with a few visits each."""
+        for i in range(len(self.patients), patients):
+            patient = self.make_user(f'patient{i}', 'patient')
+            self.patients.append(patient)
+            visit = Visit.objects.create(patient=patient, scanned_by=self.scanner, worst_stage='ROP Stage 1')
+            # Leave the last patient unscanned so both dashboard branches render
+            if i == patients - 1:
+                continue
+            EyeReport.objects.bulk_create([
+                EyeReport(patient=patient, disease=('Normal', 'ROP Stage 1', 'ROP Stage 2')[n % 3],
+                          solution='Follow up.', report_image='eye_images/seed.jpg',
+                          scanned_by=self.scanner, visit=visit, eye='left')
+                for n in range(REPORTS_PER_PATIENT)
+            ])
+        rollups.rebuild()
+
+    def client_for(self, role):
+        user = {'patient': self.patients[0], 'scanner': self.scanner}.get(role)
+        return log_in(Client(), role, user)
+
+    def url_for(self, name, kwargs):
+        resolved = {}
+        for key, value in kwargs.items():
+            if value == 'patient':
+                value = self.patients[0].id
+            elif value == 'report':
+                value = EyeReport.objects.filter(patient=self.patients[0]).values_list('id', flat=True).first()
+            elif value == 'upload':
+                upload = ChunkedUpload.objects.create(patient=self.patients[0], scanned_by=self.scanner,
+                                                      filename='eye.jpg', size=10, chunk_size=4)
+                uploads.start(upload)
+                value = upload.id
+            resolved[key] = value
+        return reverse(name, kwargs=resolved)
+
+    def payload(self, name):
+        """Keyword arguments for a valid write request to ``name``."""
+        image = SimpleUploadedFile('eye.jpg', self.sample, 'image/jpeg')
+        if name == 'scan_patient':
+            return {'data': {'eye_image': image}}
+        if name == 'upload_start':
+            return {'data': {'filename': 'eye.jpg', 'size': len(self.sample)}, 'content_type': 'application/json'}
+        if name == 'upload_chunk':
+            # The url's upload is 10 bytes in chunks of 4
+            return {'data': b'abcd', 'content_type': 'application/octet-stream',
+                    'HTTP_X_CHUNK_SHA256': hashlib.sha256(b'abcd').hexdigest()}
+        if name == 'upload_finish':
+            upload = ChunkedUpload.objects.create(patient=self.patients[0], scanned_by=self.scanner,
+                                                  filename='eye.jpg', size=len(self.sample), chunk_size=len(self.sample))
+            uploads.start(upload)
+            uploads.write_chunk(upload, 0, self.sample, hashlib.sha256(self.sample).hexdigest())
+            return {'data': {'uploads': [str(upload.id)]}, 'content_type': 'application/json'}
+        if name == 'sync_scans':
+            manifest = {'scans': [{'key': uuid.uuid4().hex, 'patient': self.patients[0].id,
+                                   'images': [{'file': 'image-0', 'eye': 'left'}]}]}
+            return {'data': {'manifest': json.dumps(manifest), 'image-0': image}}
+        raise KeyError(name)
+
+    def measure(self, name, write=False):
+        if write:
+            method, role, kwargs, budget = WRITE_BUDGETS[name]
+        else:
+            method, (role, kwargs, budget) = 'get', BUDGETS[name]
+        client = self.client_for(role)
+        url = self.url_for(name, kwargs)
+        if write:
+            # The first scan of a day also creates its rollup row (4 more
+            # queries); budget the steady state
+            getattr(client, method)(self.url_for(name, kwargs), **self.payload(name))
+        request = self.payload(name) if write else {}
+        durations = []
+        with CaptureQueriesContext(connection) as ctx, timed_templates(durations):
+            response = getattr(client, method)(url, **request)
+            # Streaming responses do their work while being consumed
+            if response.streaming:
+                b''.join(response.streaming_content)
+        self.assertLess(response.status_code, 400 if write else 500, f"{name} failed: {url}")
+        return len(ctx), sum(durations), [q['sql'] for q in ctx.captured_queries]
+
+    def measurements(self):
+        """(label, url name, write) for every budgeted request."""
+        return ([(name, name, False) for name in BUDGETS]
+                + [(f"{WRITE_BUDGETS[name][0].upper()} {name}", name, True) for name in WRITE_BUDGETS])
+
+    def test_every_url_has_a_budget(self):
+        names = {p.name for p in urls.urlpatterns if isinstance(p, URLPattern) and p.name}
+        missing = names - set(BUDGETS) - set(EXCLUDED)
+        self.assertFalse(missing, f"Add a query budget for: {', '.join(sorted(missing))}")
+
+    def test_query_budgets(self):
+        counts = {}
+        seen = {}
+        for size in SIZES:
+            self.seed(size)
+            for label, name, write in self.measurements():
+                with self.subTest(view=label, patients=size):
+                    count, render_ms, queries = self.measure(name, write)
+                    budget = (WRITE_BUDGETS[name] if write else BUDGETS[name])[-1]
+                    self.assertLessEqual(count, budget,
+                                         f"{label} ran {count} queries (budget {budget}):\n" + "\n".join(queries))
+                    self.assertLessEqual(render_ms, TEMPLATE_BUDGET_MS,
+                                         f"{label} templates took {render_ms:.0f} ms")
+                    counts.setdefault(label, []).append(count)
+                    seen.update((sql, label) for sql in queries)
+
+        for name, per_size in counts.items():
+            with self.subTest(view=name):
+                self.assertEqual(len(set(per_size)), 1,
+                                 f"{name} query count grows with data: {dict(zip(SIZES, per_size))}")
+        print_explain_report(seen)
+
+    def test_no_full_scans_of_large_tables(self):
+        self.seed(SIZES[0])
+        if connection.vendor != 'sqlite':
+            self.skipTest("plan check is written against SQLite's EXPLAIN QUERY PLAN")
+        for label, name, write in self.measurements():
+            for sql in filter(is_dml, self.measure(name, write)[2]):
+                with self.subTest(view=label, sql=sql[:80]):
+                    self.assertFalse(full_scans(explain(sql)), f"{label}: full table scan in\n{sql}")
+
+
+class ObjectStorageTests(MediaMixin, TestCase):
+    """The object-store media backend, over the local stand-in client."""
+
+    def setUp(self):
+        root = tempfile.mkdtemp(dir=self.media_root)
+        self.bucket = os.path.join(root, 'bucket')
+        self.cache_dir = os.path.join(root, 'cache')
+        self.storage = LocalObjectStorage(location=self.bucket, base_url='/media/', cache_dir=self.cache_dir)
+
+    def test_round_trip(self):
+        name = self.storage.save('eye_images/a b.jpg', ContentFile(b'fundus', name='a b.jpg'))
+        self.assertTrue(self.storage.exists(name))
+        self.assertEqual(self.storage.size(name), 6)
+        self.assertRegex(name, r'^eye_images/a b_[0-9a-f]{12}\.jpg$')
+        self.assertEqual(self.storage.url(name), '/media/' + name.replace(' ', '%20'))
+        self.assertEqual(self.storage.listdir('eye_images'), ([], [name.split('/')[1]]))
+        with self.storage.open(name) as f:
+            self.assertEqual(f.read(), b'fundus')
+
+        # Every save gets a fresh name without asking the bucket first, so
+        # nodes saving the same upload name at once cannot overwrite each other
+        with mock.patch.object(self.storage, 'exists') as exists:
+            again = self.storage.save('eye_images/a b.jpg', ContentFile(b'other'))
+        self.assertNotEqual(again, name)
+        exists.assert_not_called()
+        self.assertLessEqual(len(self.storage.get_available_name('eye_images/' + 'x' * 200 + '.jpg', 100)), 100)
+
+        self.storage.delete(name)
+        self.assertFalse(self.storage.exists(name))
+        self.assertFalse(os.path.exists(self.storage.cache.path(name)))
+
+    def test_reads_are_served_from_cache(self):
+        name = self.storage.save('eye_images/hot.jpg', ContentFile(b'x' * 100))
+        self.storage.cache.discard(name)
+        with mock.patch.object(self.storage.client, 'get', wraps=self.storage.client.get) as get:
+            for _ in range(3):
+                with self.storage.open(name) as f:
+                    self.assertEqual(len(f.read()), 100)
+        self.assertEqual(get.call_count, 1)
+
+    def test_cache_evicts_least_recently_used(self):
+        self.storage.cache.max_bytes = 250
+        names = [self.storage.save(f'eye_images/{i}.jpg', ContentFile(b'x' * 100)) for i in range(3)]
+        self.storage.cache.evict()
+        cached = [os.path.exists(self.storage.cache.path(name)) for name in names]
+        self.assertEqual(cached, [False, True, True])
+        # Evicted objects are fetched again from the bucket
+        with self.storage.open(names[0]) as f:
+            self.assertEqual(f.read(), b'x' * 100)
+
+    def test_scan_stores_image_and_pdf_through_storage(self):
+        patient = User.objects.create_user('patient0', 'p@example.com', 'x')
+        UserProfile.objects.create(user=patient, role='patient', age=1)
+        scanner = User.objects.create_user('scanner0', 's@example.com', 'x')
+        client = log_in(Client(), 'scanner', scanner)
+
+        sample = os.path.join(settings.BASE_DIR, 'media', '4624_right.jpg')
+        # Swapped in directly: override_settings(STORAGES=...) drops the
+        # default alias' OPTIONS on Django 5.0
+        with mock.patch.object(default_storage, '_wrapped', self.storage), \
+                mock.patch('firstApp.views.get_model', return_value=StubModel()), \
+                open(sample, 'rb') as f:
+            response = client.post(reverse('scan_patient', args=[patient.id]), {'eye_image': f})
+            self.assertEqual(response.status_code, 302)
+            report = EyeReport.objects.get(patient=patient)
+            self.assertTrue(self.storage.exists(report.report_image.name))
+            self.assertTrue(self.storage.exists(report.pdf_report.name))
+
+        self.assertTrue(os.path.exists(os.path.join(self.bucket, report.report_image.name)))
+        self.assertTrue(os.path.exists(os.path.join(self.bucket, report.pdf_report.name)))
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, 'eye_reports')))
+
+
+class TestClientHTTP:
+    """Just enough of requests.Session for SyncClient, over the Django test client."""
+
+    class Response:
+        def __init__(self, response):
+            self.response = response
+            self.status_code = response.status_code
+
+        def raise_for_status(self):
+            assert self.response.status_code < 400, self.response.content
+
+        def json(self):
+            return self.response.json()
+
+    def __init__(self, client):
+        self.client = client
+        self.cookies = {}
+
+    def post(self, url, data, files, headers, timeout):
+        fields = dict(data)
+        for field, (name, content, content_type) in files:
+            fields[field] = SimpleUploadedFile(name, content, content_type)
+        return self.Response(self.client.post(url, fields))
+
+    def get(self, url, params, timeout):
+        return self.Response(self.client.get(url, params))
+
+
+class ChunkedUploadTests(MediaMixin, TestCase):
+    def setUp(self):
+        self.patient = User.objects.create_user('patient0', 'p@example.com', 'x')
+        UserProfile.objects.create(user=self.patient, role='patient', age=1)
+        self.scanner = User.objects.create_user('scanner0', 's@example.com', 'x')
+        log_in(self.client, 'scanner', self.scanner)
+        with open(os.path.join(settings.BASE_DIR, 'media', '4624_right.jpg'), 'rb') as f:
+            self.data = f.read()
+
+        patcher = mock.patch('firstApp.views.get_model', return_value=StubModel())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def new_upload(self, data=None, chunk_size=4096, scanner=None):
+        upload = ChunkedUpload.objects.create(patient=self.patient, scanned_by=scanner or self.scanner,
+                                              filename='eye.jpg', size=len(data or self.data), chunk_size=chunk_size)
+        uploads.start(upload)
+        return upload
+
+    def put(self, upload, offset, data=None):
+        data = data if data is not None else (self.data[offset:offset + upload.chunk_size])
+        return self.client.put(reverse('upload_chunk', args=[upload.id, offset]), data,
+                               content_type='application/octet-stream',
+                               HTTP_X_CHUNK_SHA256=hashlib.sha256(data).hexdigest())
+
+    def finish(self, *ids):
+        return self.client.post(reverse('upload_finish', args=[self.patient.id]),
+                                json.dumps({'uploads': [str(i) for i in ids]}), content_type='application/json')
+
+    def test_chunks_are_checked(self):
+        upload = self.new_upload()
+        chunk = self.data[:4096]
+        with self.assertRaisesMessage(uploads.UploadError, 'Checksum mismatch'):
+            uploads.write_chunk(upload, 0, chunk, hashlib.sha256(b'other').hexdigest())
+        for offset in (1, 4096 * 10 ** 6, -4096):
+            with self.assertRaises(uploads.UploadError):
+                uploads.write_chunk(upload, offset, chunk, hashlib.sha256(chunk).hexdigest())
+        with self.assertRaisesMessage(uploads.UploadError, 'must be 4096 bytes'):
+            uploads.write_chunk(upload, 0, chunk[:10], hashlib.sha256(chunk[:10]).hexdigest())
+        self.assertEqual(uploads.missing_offsets(upload)[0], 0)
+
+    def test_out_of_order_chunks_and_resume(self):
+        upload = self.new_upload()
+        offsets = list(range(0, len(self.data), 4096))
+        # Send every other chunk, last first, then pick up what status reports missing
+        for offset in reversed(offsets[::2]):
+            self.assertEqual(self.put(upload, offset).status_code, 200)
+        status = self.client.get(reverse('upload_status', args=[upload.id])).json()
+        self.assertEqual(status['missing'], offsets[1::2])
+        self.assertEqual(self.finish(upload.id).status_code, 409)
+        for offset in status['missing']:
+            self.put(upload, offset)
+        with open(uploads.data_path(upload), 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+
+        response = self.finish(upload.id)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(EyeReport.objects.get(visit=response.json()['visit']).patient, self.patient)
+        self.assertFalse(ChunkedUpload.objects.filter(id=upload.id).exists())
+        self.assertFalse(os.path.exists(uploads.data_path(upload)))
+
+    def test_finish_keeps_upload_after_server_error(self):
+        upload = self.new_upload(chunk_size=len(self.data))
+        self.put(upload, 0)
+        with mock.patch('firstApp.views.record_scan', side_effect=RuntimeError("database is locked")):
+            with self.assertRaises(RuntimeError):
+                self.finish(upload.id)
+        self.assertTrue(ChunkedUpload.objects.filter(id=upload.id).exists())
+        self.assertEqual(self.finish(upload.id).status_code, 200)
+
+    def test_rejected_upload_is_discarded(self):
+        blank = io.BytesIO()
+        Image.new('RGB', (64, 64), 'white').save(blank, 'JPEG')
+        upload = self.new_upload(blank.getvalue(), chunk_size=len(blank.getvalue()))
+        self.put(upload, 0, blank.getvalue())
+        self.assertEqual(self.finish(upload.id).status_code, 400)
+        self.assertFalse(ChunkedUpload.objects.filter(id=upload.id).exists())
+
+    def test_another_scanners_upload_cannot_be_finished(self):
+        other = User.objects.create_user('scanner1', 't@example.com', 'x')
+        upload = self.new_upload(chunk_size=len(self.data), scanner=other)
+        uploads.write_chunk(upload, 0, self.data, hashlib.sha256(self.data).hexdigest())
+        self.assertEqual(self.finish(upload.id).status_code, 404)
+        self.assertTrue(ChunkedUpload.objects.filter(id=upload.id).exists())
+
+    def test_chunk_size_fits_a_request_body(self):
+        with mock.patch.dict(os.environ, {'VISIONCARE_UPLOAD_CHUNK_SIZE': str(64 * 1024 * 1024)}):
+            self.assertEqual(uploads._chunk_size(), settings.DATA_UPLOAD_MAX_MEMORY_SIZE)
+
+
+class ScannerSyncTests(MediaMixin, TestCase):
+    def setUp(self):
+        self.patient = User.objects.create_user('patient0', 'p@example.com', 'x')
+        UserProfile.objects.create(user=self.patient, role='patient', age=1)
+        scanner = User.objects.create_user('scanner0', 's@example.com', 'x')
+        log_in(self.client, 'scanner', scanner)
+
+        self.sync = SyncClient('', 'scanner0', 'x')
+        self.sync.http = TestClientHTTP(self.client)
+        self.outbox = Outbox(os.path.join(tempfile.mkdtemp(dir=self.media_root), 'outbox.sqlite3'))
+        self.addCleanup(self.outbox.close)
+        self.sample = os.path.join(settings.BASE_DIR, 'media', '4624_right.jpg')
+
+        patcher = mock.patch('firstApp.views.get_model', return_value=StubModel())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_push_is_idempotent(self):
+        first = self.outbox.queue(self.patient.id, [('left', self.sample), ('right', self.sample)])
+        second = self.outbox.queue(self.patient.id, [('', self.sample)])
+        unknown = self.outbox.queue(999999, [('', self.sample)])
+
+        results = push(self.outbox, self.sync)
+        self.assertEqual([r['status'] for r in results], ['created', 'created', 'rejected'])
+        self.assertEqual(len(results[0]['reports']), 2)
+        self.assertEqual(self.outbox.counts(), {'sent': 2, 'rejected': 1})
+        self.assertEqual(Visit.objects.filter(patient=self.patient).count(), 2)
+
+        # The response was lost: the station sends the same scans again
+        batch = [{'key': key, 'patient': self.patient.id, 'images': [
+            {'filename': 'a.jpg', 'eye': '', 'data': open(self.sample, 'rb').read()}]} for key in (first, second)]
+        self.assertEqual([r['status'] for r in self.sync.push(batch)], ['duplicate', 'duplicate'])
+        self.assertEqual(Visit.objects.filter(patient=self.patient).count(), 2)
+        self.assertEqual(SyncedScan.objects.count(), 2)
+        self.assertFalse(SyncedScan.objects.filter(key=unknown).exists())
+
+    def test_visit_is_dated_when_captured(self):
+        key = self.outbox.queue(self.patient.id, [('', self.sample)])
+        captured = timezone.now() - timedelta(days=2)
+        self.outbox.db.execute("UPDATE scans SET captured_at = ?", (captured.isoformat(),))
+        push(self.outbox, self.sync)
+        visit = SyncedScan.objects.get(key=key).visit
+        self.assertEqual(visit.date_time, captured)
+        self.assertEqual(list(visit.reports.values_list('date_time', flat=True)), [captured])
+
+        batch = [{'key': 'bad-date', 'patient': self.patient.id, 'captured_at': 'last tuesday', 'images': [
+            {'filename': 'a.jpg', 'eye': '', 'data': open(self.sample, 'rb').read()}]}]
+        self.assertEqual(self.sync.push(batch)[0]['status'], 'rejected')
+
+    def test_batches_respect_limits(self):
+        for _ in range(5):
+            self.outbox.queue(self.patient.id, [('left', self.sample), ('right', self.sample)])
+        self.assertEqual([len(b) for b in self.outbox.batches(max_scans=2)], [2, 2, 1])
+        self.assertEqual([len(b) for b in self.outbox.batches(max_files=5)], [2, 2, 1])
+        self.assertEqual([len(b) for b in self.outbox.batches(max_bytes=1)], [1, 1, 1, 1, 1])
+
+    def test_oversized_batch_is_split(self):
+        for _ in range(5):
+            self.outbox.queue(self.patient.id, [('', self.sample)])
+        with mock.patch('firstApp.views.MAX_SYNC_SCANS', 2):
+            results = push(self.outbox, self.sync)
+        self.assertEqual([r['status'] for r in results], ['created'] * 5)
+        self.assertEqual(self.outbox.counts(), {'sent': 5})
+
+    def test_failed_scan_leaves_no_files(self):
+        key = self.outbox.queue(self.patient.id, [('left', self.sample), ('right', self.sample)])
+        with mock.patch('firstApp.views.generate_visit_pdf', side_effect=RuntimeError("disk full at /srv/media")):
+            [result] = push(self.outbox, self.sync)
+        self.assertEqual(result['status'], 'error')
+        self.assertNotIn('/srv/media', result['errors'][0])
+        self.assertFalse(EyeReport.objects.exists())
+        self.assertEqual(os.listdir(os.path.join(self.media_root, 'eye_images')), [])
+        self.assertEqual(self.outbox.counts(), {'queued': 1})
+        self.assertEqual(push(self.outbox, self.sync)[0]['key'], key)
+
+    def test_pull_follows_cursor(self):
+        with mock.patch('firstApp.views.SYNC_PAGE', 1):
+            self.assertEqual(pull(self.outbox, self.sync), (1, 0))
+            self.outbox.queue(self.patient.id, [('left', self.sample), ('right', self.sample)])
+            push(self.outbox, self.sync)
+            self.assertEqual(pull(self.outbox, self.sync), (0, 2))
+            self.assertEqual(pull(self.outbox, self.sync), (0, 0))
+        rows = self.outbox.db.execute("SELECT eye, disease FROM results ORDER BY id").fetchall()
+        self.assertEqual([row['eye'] for row in rows], ['left', 'right'])
+        self.assertTrue(self.outbox.patient_exists(self.patient.id))
+
+
+class AssetBuildTests(TestCase):
+    def test_only_missing_references_are_tolerated(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root, ignore_errors=True)
+        storage = CompressedManifestStaticFilesStorage(location=root)
+        self.assertEqual(storage.hashed_name('img/missing.png'), 'img/missing.png')
+
+        storage.save('app.css', ContentFile(b'body {}'))
+        with mock.patch.object(ManifestStaticFilesStorage, 'hashed_name', side_effect=ValueError("bad")):
+            with self.assertRaises(ValueError):
+                storage.hashed_name('app.css')
+
+    def test_variant_follows_accept_encoding_q_values(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root, ignore_errors=True)
+        path = os.path.join(root, 'app.css')
+        for suffix in ('', '.br', '.gz'):
+            open(path + suffix, 'wb').close()
+        for header, encoding in (('gzip, deflate, br', 'br'), ('br;q=0, gzip', 'gzip'), ('BR;Q=0.5, gzip;q=0.8', 'gzip'),
+                                 ('br;q=0, gzip;q=0', None), ('*', 'br'), ('*;q=0', None), ('', None)):
+            self.assertEqual(pick_variant(path, header)[1], encoding, header)
+
+
+class TriageSplitTests(TestCase):
+    def test_held_out_patients_never_reach_training(self):
+        for i in range(triage.HOLDOUT_EVERY * 2):
+            patient = User.objects.create_user(f'patient{i}', f'p{i}@example.com', 'x')
+            EyeReport.objects.create(patient=patient, disease='Normal', solution='-')
+        held_out = set(triage.split(EyeReport.objects.all(), held_out=True).values_list('patient_id', flat=True))
+        training = set(triage.split(EyeReport.objects.all(), held_out=False).values_list('patient_id', flat=True))
+        self.assertEqual(len(held_out), 2)
+        self.assertFalse(held_out & training)
+        self.assertEqual(len(held_out | training), triage.HOLDOUT_EVERY * 2)
+
+
+class RollupTests(TestCase):
+    def setUp(self):
+        self.patient = User.objects.create_user('patient0', 'p@example.com', 'x')
+        self.start = timezone.now() - timedelta(days=3)
+
+    def report(self, disease, days):
+        return EyeReport.objects.create(patient=self.patient, disease=disease, solution='-',
+                                        date_time=self.start + timedelta(days=days))
+
+    def snapshot(self):
+        return sorted(DailyRollup.objects.values_list('day', 'scanner_id', 'disease', 'scans', 'progressions'))
+
+    def assert_matches_rebuild(self):
+        incremental = self.snapshot()
+        rollups.rebuild()
+        self.assertEqual(incremental, self.snapshot())
+
+    def test_deleting_a_report_with_no_rollup_row(self):
+        report = self.report('Normal', 0)
+        DailyRollup.objects.all().delete()  # as if created before the rollup table
+        report.delete()
+        self.assertFalse(DailyRollup.objects.exists())
+
+    def test_deleting_updates_the_next_progression(self):
+        self.report('Normal', 0)
+        middle = self.report('ROP Stage 1', 1)
+        self.report('ROP Stage 2', 2)
+        rollups.rebuild()
+        middle.delete()
+        self.assert_matches_rebuild()
+
+    def visit(self, diseases, days):
+        date_time = self.start + timedelta(days=days)
+        visit = Visit.objects.create(patient=self.patient, worst_stage='-', date_time=date_time)
+        return [EyeReport.objects.create(patient=self.patient, visit=visit, disease=d, solution='-',
+                                         date_time=date_time) for d in diseases]
+
+    def progressions(self):
+        return sum(DailyRollup.objects.values_list('progressions', flat=True))
+
+    def test_eyes_of_one_visit_are_not_compared(self):
+        self.visit(['Normal', 'ROP Stage 1'], 0)
+        self.assertEqual(self.progressions(), 0)
+        self.assert_matches_rebuild()
+
+    def test_progression_uses_the_worst_stage_of_the_previous_visit(self):
+        self.visit(['Normal', 'ROP Stage 1'], 0)
+        self.visit(['ROP Stage 1', 'Normal'], 1)  # no change on the worst eye
+        self.assertEqual(self.progressions(), 0)
+        left, right = self.visit(['ROP Stage 2', 'Normal'], 2)
+        self.assertEqual(DailyRollup.objects.get(disease='ROP Stage 2').progressions, 1)
+        self.assert_matches_rebuild()
+        # Without its worse eye the last visit is Normal: no progression left
+        left.delete()
+        self.assertEqual(self.progressions(), 0)
+        self.assert_matches_rebuild()
+
+    def test_one_unassigned_row_per_day_and_disease(self):
+        day = timezone.localdate()
+        DailyRollup.objects.create(day=day, scanner=None, disease='Normal')
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            DailyRollup.objects.create(day=day, scanner=None, disease='Normal')
+
+    def test_bad_scanner_is_rejected(self):
+        log_in(self.client, 'doctor')
+        url = reverse('analytics_trends', args=['scans'])
+        self.assertEqual(self.client.get(url, {'scanner': 'abc'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'start': '2024-13-45'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'start': 'yesterday'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'start': '2024-01-01'}).status_code, 200)
+
+
+class VisitTests(MediaMixin, TestCase):
+    """Several images per submission, stored as one visit."""
+
+    def setUp(self):
+        self.scanner = User.objects.create_user('scanner0', 's@example.com', 'x')
+        self.patient = User.objects.create_user('patient0', 'p@example.com', 'x')
+        UserProfile.objects.create(user=self.patient, role='patient', age=1)
+        log_in(self.client, 'scanner', self.scanner)
+        self.sample = os.path.join(settings.BASE_DIR, 'media', '4624_right.jpg')
+
+    def scan(self, patient, diseases):
+        with open(self.sample, 'rb') as left, open(self.sample, 'rb') as right, \
+                mock.patch('firstApp.views.classify_uploads',
+                           return_value=(diseases, ['full'] * len(diseases), [None] * len(diseases))):
+            return self.client.post(reverse('scan_patient', args=[patient.id]),
+                                    {'left_images': [left], 'right_images': [right]})
+
+    def test_dashboards_show_the_worst_stage_of_the_visit(self):
+        self.assertEqual(self.scan(self.patient, ['ROP Stage 3', 'Normal']).status_code, 302)
+        visit = Visit.objects.get()
+        self.assertEqual(visit.worst_stage, 'ROP Stage 3')
+        reports = EyeReport.objects.filter(visit=visit)
+        self.assertEqual(sorted(reports.values_list('eye', flat=True)), ['left', 'right'])
+        self.assertEqual({r.pdf_report.name for r in reports}, {visit.pdf_report.name})
+
+        response = self.client.get(reverse('scanner_dashboard'))
+        self.assertContains(response, 'ROP Stage 3')
+        self.assertNotContains(response, '>Normal<')
+
+        log_in(self.client, 'doctor')
+        response = self.client.get(reverse('doctor_dashboard'))
+        self.assertEqual(json.loads(response.context['chart_labels']), ['ROP Stage 3'])
+        created = DashboardEvent.objects.filter(kind='report_created').order_by('id')
+        self.assertEqual([e.payload['chart'] for e in created], [{'ROP Stage 3': 1}, {}])
+
+    def test_several_images_per_eye(self):
+        with open(self.sample, 'rb') as left1, open(self.sample, 'rb') as left2, \
+                open(self.sample, 'rb') as right, \
+                mock.patch('firstApp.views.classify_uploads',
+                           return_value=(['Normal', 'ROP Stage 2', 'ROP Stage 1'], ['full'] * 3, [None] * 3)):
+            response = self.client.post(reverse('scan_patient', args=[self.patient.id]),
+                                        {'left_images': [left1, left2], 'right_images': [right]})
+        self.assertEqual(response.status_code, 302)
+        visit = Visit.objects.get()
+        self.assertEqual(visit.worst_stage, 'ROP Stage 2')
+        reports = EyeReport.objects.filter(visit=visit).order_by('id')
+        self.assertEqual([(r.eye, r.disease) for r in reports],
+                         [('left', 'Normal'), ('left', 'ROP Stage 2'), ('right', 'ROP Stage 1')])
+        self.assertEqual(len({r.report_image.name for r in reports}), 3)
+        self.assertEqual({r.pdf_report.name for r in reports}, {visit.pdf_report.name})
+        with default_storage.open(visit.pdf_report.name, 'rb') as f:
+            self.assertTrue(f.read().startswith(b'%PDF'))
+
+    def test_deleting_the_worst_image_updates_the_visit(self):
+        self.scan(self.patient, ['ROP Stage 3', 'Normal'])
+        log_in(self.client, 'doctor')
+        worst = EyeReport.objects.get(disease='ROP Stage 3')
+        self.client.post(reverse('doctor_dashboard'), {'delete_report': worst.id})
+        self.assertEqual(Visit.objects.get().worst_stage, 'Normal')
+        deleted = DashboardEvent.objects.get(kind='report_deleted').payload
+        self.assertEqual(deleted['chart'], {'ROP Stage 3': -1, 'Normal': 1})
+
+    def test_failed_scan_leaves_no_partial_visit(self):
+        no_profile = User.objects.create_user('patient1', 'q@example.com', 'x')
+        images = os.path.join(self.media_root, 'eye_images')
+        os.makedirs(images, exist_ok=True)
+        before = set(os.listdir(images))
+        with self.assertRaises(UserProfile.DoesNotExist):
+            self.scan(no_profile, ['Normal', 'Normal'])
+        self.assertFalse(Visit.objects.exists())
+        self.assertFalse(EyeReport.objects.exists())
+        self.assertEqual(set(os.listdir(images)), before)
+
+
+class DuplicateFlagTests(MediaMixin, TestCase):
+    def setUp(self):
+        scanner = User.objects.create_user('scanner0', 's@example.com', 'x')
+        log_in(self.client, 'scanner', scanner)
+        self.sample = os.path.join(settings.BASE_DIR, 'media', '4624_right.jpg')
+        patcher = mock.patch('firstApp.views.get_model', return_value=StubModel())
+        self.model = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def scan(self, patient):
+        with open(self.sample, 'rb') as f:
+            self.client.post(reverse('scan_patient', args=[patient.id]), {'eye_image': f})
+        return EyeReport.objects.filter(patient=patient).latest('id')
+
+    def make_patient(self, username):
+        patient = User.objects.create_user(username, f'{username}@example.com', 'x')
+        UserProfile.objects.create(user=patient, role='patient', age=1)
+        return patient
+
+    def test_same_patient_reupload_reuses_the_result(self):
+        first, second = self.make_patient('patient0'), self.make_patient('patient1')
+        original = self.scan(first)
+        other = self.scan(second)
+        self.assertIsNone(other.duplicate_of)
+        self.assertEqual(other.inference_route, triage.ROUTE_FULL)
+
+        again = self.scan(first)
+        self.assertEqual(again.duplicate_of, original)
+        self.assertEqual(again.inference_route, triage.ROUTE_DUPLICATE)
+        self.assertEqual(again.disease, original.disease)
+        # Only the two first uploads went through the model
+        self.assertEqual(self.model.call_count, 2)
+
+
+class LiveDashboardTests(MediaMixin, TestCase):
+    def setUp(self):
+        self.scanner = User.objects.create_user('scanner0', 's@example.com', 'x')
+        UserProfile.objects.create(user=self.scanner, role='scanner')
+        self.patient = User.objects.create_user('patient0', 'p@example.com', 'x')
+
+    def as_doctor(self, client):
+        return log_in(client, 'doctor', self.scanner)
+
+    def counts(self, kind):
+        return DashboardEvent.objects.filter(kind=kind).latest('id').payload['counts']
+
+    def test_events_carry_count_deltas(self):
+        UserProfile.objects.create(user=self.patient, role='patient')
+        self.assertEqual(self.counts('patient_added'), {'total_patients': 1, 'patients_remaining': 1})
+        first = EyeReport.objects.create(patient=self.patient, disease='Normal', solution='-')
+        self.assertEqual(self.counts('report_created'), {'scans_completed': 1, 'patients_remaining': -1})
+        second = EyeReport.objects.create(patient=self.patient, disease='Normal', solution='-')
+        self.assertEqual(self.counts('report_created'), {})
+        second.delete()
+        self.assertEqual(self.counts('report_deleted'), {})
+        first.delete()
+        self.assertEqual(self.counts('report_deleted'), {'scans_completed': -1, 'patients_remaining': 1})
+
+    def test_live_updates_only_under_asgi(self):
+        client = self.as_doctor(Client())
+        self.assertNotContains(client.get(reverse('doctor_dashboard')), 'live-dashboard.js')
+        self.assertEqual(client.get(reverse('dashboard_events')).status_code, 204)
+
+        client = self.as_doctor(AsyncClient())
+        response = async_to_sync(client.get)(reverse('doctor_dashboard'))
+        self.assertContains(response, 'live-dashboard.js')
+        self.assertContains(response, 'data-events-url=')
+
+
+class SaliencyTests(MediaMixin, TestCase):
+    def setUp(self):
+        self.patient = User.objects.create_user('patient0', 'p@example.com', 'x')
+        log_in(self.client, 'doctor')
+        with open(os.path.join(settings.BASE_DIR, 'media', '4624_right.jpg'), 'rb') as f:
+            self.image = f.read()
+        for patcher in (mock.patch.object(saliency, 'BACKEND', 'stub'),
+                        mock.patch.object(saliency, 'model_version', return_value='v1'),
+                        mock.patch.dict(saliency._overlays, clear=True)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def report(self):
+        report = EyeReport.objects.create(patient=self.patient, disease='ROP Stage 3', solution='-')
+        report.report_image.save('eye.jpg', ContentFile(self.image))
+        return report
+
+    def poll(self, report):
+        return self.client.get(reverse('report_saliency', args=[report.id]))
+
+    def finish_jobs(self):
+        # One saliency worker: this runs after every job queued before it
+        saliency._executor.submit(lambda: None).result()
+
+    def test_overlay_is_pending_then_ready(self):
+        report = self.report()
+        with mock.patch.object(saliency, '_image_digest', wraps=saliency._image_digest) as digest:
+            self.assertEqual(self.poll(report).status_code, 202)
+            digest.assert_not_called()  # hashed by the job, not the request
+        self.finish_jobs()
+        response = self.poll(report)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['status'], 'ready')
+
+    def test_overlay_is_keyed_by_image_content_and_model(self):
+        first, second = self.report(), self.report()
+        self.assertNotEqual(first.report_image.name, second.report_image.name)
+        sha1 = hashlib.sha1(self.image).hexdigest()
+        self.assertEqual(saliency.overlay_name(first.report_image.storage, first.report_image.name),
+                         f'saliency/{sha1}_v1.jpg')
+
+        for report in (first, second):
+            self.poll(report)
+            self.finish_jobs()
+        urls = {self.poll(report).json()['url'] for report in (first, second)}
+        self.assertEqual(len(urls), 1)  # same bytes, one overlay
+        with mock.patch.object(saliency, 'model_version', return_value='v2'):
+            self.assertEqual(saliency.overlay_name(first.report_image.storage, first.report_image.name),
+                             f'saliency/{sha1}_v2.jpg')
+
+
+class ArchivedMediaTests(MediaMixin, TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user('patient0', 'p@example.com', 'x')
+        self.other = User.objects.create_user('patient1', 'q@example.com', 'x')
+        os.makedirs(os.path.join(self.media_root, 'eye_images'), exist_ok=True)
+        Image.new('RGB', (8, 8)).save(os.path.join(self.media_root, 'eye_images', 'a.jpg'))
+        EyeReport.objects.create(patient=self.owner, disease='Normal', solution='-', report_image='eye_images/a.jpg')
+        self.url = reverse('archived_media', args=['eye_images/a.jpg'])
+
+    def get_as(self, role, user=None):
+        return log_in(Client(), role, user).get(self.url).status_code
+
+    def test_access(self):
+        self.assertEqual(self.get_as(None), 403)
+        self.assertEqual(self.get_as('patient', self.other), 403)
+        self.assertEqual(self.get_as('patient', self.owner), 200)
+        self.assertEqual(self.get_as('doctor'), 200)
+
+    def test_archive_and_read_back(self):
+        name = 'eye_images/a.jpg'
+        with open(os.path.join(self.media_root, name), 'rb') as f:
+            original = f.read()
+        storage = PackedFileSystemStorage(location=self.media_root, base_url='/media/')
+        with mock.patch.object(default_storage, '_wrapped', storage):
+            call_command('archive_media', days=0, stdout=io.StringIO())
+            self.assertFalse(storage.is_loose(name))
+            with storage.open(name) as f:
+                self.assertEqual(f.read(), original)
+            self.assertEqual(storage.size(name), len(original))
+            self.assertEqual(storage.url(name), self.url)
+            self.assertEqual(self.get_as('doctor'), 200)
+
+            storage.delete(name)
+            self.assertFalse(storage.exists(name))
+            self.assertEqual(self.get_as('doctor'), 404)
+
+
+class ReportExportTests(MediaMixin, TestCase):
+    def setUp(self):
+        log_in(self.client, 'doctor')
+
+    def test_bad_parameters_are_rejected(self):
+        for query in ({'patient': 'abc'}, {'start': '2024-13-45'}, {'start': 'last-week'}, {'end': 'now'}):
+            self.assertEqual(self.client.get(reverse('export_reports'), query).status_code, 400)
+
+    def test_visit_pdf_is_stored_once(self):
+        patient = User.objects.create_user('patient0', 'p@example.com', 'x')
+        os.makedirs(os.path.join(self.media_root, 'eye_reports'), exist_ok=True)
+        with open(os.path.join(self.media_root, 'eye_reports', 'visit.pdf'), 'wb') as f:
+            f.write(b'%PDF-1.4')
+        visit = Visit.objects.create(patient=patient, pdf_report='eye_reports/visit.pdf')
+        for eye in ('left', 'right'):
+            EyeReport.objects.create(patient=patient, disease='Normal', solution='-', visit=visit, eye=eye,
+                                     pdf_report='eye_reports/visit.pdf')
+
+        response = self.client.get(reverse('export_reports'), {'patient': patient.id})
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(len([name for name in archive.namelist() if name.endswith('.pdf')]), 1)
+        manifest = list(csv.DictReader(io.StringIO(archive.read('manifest.csv').decode())))
+        self.assertEqual(len(manifest), 2)
+        self.assertEqual(len({row['pdf_path'] for row in manifest}), 1)
+
+
+class ReportPdfTests(MediaMixin, TestCase):
+    def setUp(self):
+        self.patient = User.objects.create_user('patient0', 'p@example.com', 'x')
+        self.profile = UserProfile.objects.create(user=self.patient, role='patient', age=1)
+        with open(os.path.join(settings.BASE_DIR, 'media', '4624_right.jpg'), 'rb') as f:
+            image = default_storage.save('eye_images/sample.jpg', ContentFile(f.read()))
+        self.visit = Visit.objects.create(patient=self.patient, worst_stage='ROP Stage 1')
+        self.reports = [EyeReport.objects.create(patient=self.patient, disease='ROP Stage 1', solution='-',
+                                                 visit=self.visit, eye='left', report_image=image)
+                        for _ in range(5)]
+
+    def test_report(self):
+        target = io.BytesIO()
+        render_report_pdf(self.reports[0], self.profile, target)
+        pdf = target.getvalue()
+        self.assertTrue(pdf.startswith(b'%PDF'))
+        self.assertIn(b'/Subtype /Image', pdf)
+
+    def test_visit_chrome_is_drawn_once_and_images_are_downsampled(self):
+        target = io.BytesIO()
+        render_visit_pdf(self.visit, self.reports, self.profile, 'Follow up.', target)
+        pdf = target.getvalue()
+        self.assertGreater(len(re.findall(rb'/Type /Page\b(?!s)', pdf)), 1)
+        self.assertEqual(pdf.count(b'/Subtype /Form'), 1)
+        sizes = [int(n) for n in re.findall(rb'/(?:Width|Height) (\d+)', pdf)]
+        self.assertTrue(sizes)
+        self.assertLessEqual(max(sizes), IMAGE_PIXELS)
+
+    def test_missing_image_is_skipped(self):
+        self.reports[1].report_image.name = 'eye_images/missing.jpg'
+        with self.assertLogs('firstApp.reports', 'WARNING'):
+            target = io.BytesIO()
+            render_visit_pdf(self.visit, self.reports, self.profile, '-', target)
+        pdf = target.getvalue()
+        self.assertTrue(pdf.startswith(b'%PDF'))
+
+
+class DatasetExportTests(MediaMixin, TestCase):
+    def setUp(self):
+        self.patient = User.objects.create_user('patient0', 'p@example.com', 'x')
+        self.output = os.path.join(tempfile.mkdtemp(dir=self.media_root), 'dataset')
+        os.makedirs(os.path.join(self.media_root, 'eye_images'), exist_ok=True)
+        self.colours = iter(range(1, 255, 7))
+
+    def add_reports(self, n, disease='ROP Stage 1', route='full', image=None):
+        reports = []
+        for _ in range(n):
+            name = image or f'eye_images/{next(self.colours)}.png'
+            if image is None:
+                Image.new('RGB', (300, 200), (next(self.colours), 40, 20)).save(os.path.join(self.media_root, name))
+            reports.append(EyeReport.objects.create(patient=self.patient, disease=disease, solution='-',
+                                                    report_image=name, inference_route=route, eye='left'))
+        return reports
+
+    def export(self):
+        call_command('export_dataset', output=self.output, shard_size=3, workers=2, stdout=io.StringIO())
+        return dataset.load(self.output)
+
+    def test_export_and_append(self):
+        first = self.add_reports(4)
+        self.add_reports(1, route='triage')
+        self.add_reports(1, disease='Unknown')
+        images, index = self.export()
+        self.assertEqual([len(shard) for shard in images], [3, 1])
+        self.assertEqual([int(row['report_id']) for row in index], [r.id for r in first])
+        self.assertEqual(images[0].dtype, np.uint8)
+        with first[1].report_image.open('rb') as f:
+            np.testing.assert_array_equal(images[0][1], preprocess_image(f))
+
+        # Appends fill the last shard; identical bytes are not exported twice
+        later = self.add_reports(3) + self.add_reports(1, image=first[0].report_image.name)
+        images, index = self.export()
+        self.assertEqual([len(shard) for shard in images], [3, 3, 1])
+        self.assertEqual([int(row['report_id']) for row in index][4:], [r.id for r in later[:3]])
+        self.assertEqual(len({row['sha256'] for row in index}), 7)
+        with open(os.path.join(self.output, dataset.MANIFEST_NAME)) as f:
+            manifest = json.load(f)
+        self.assertEqual((manifest['images'], manifest['shards'], manifest['last_report_id']), (7, 3, later[-1].id))
+
+    def test_failed_reports_are_retried(self):
+        missing = self.add_reports(1, image='eye_images/missing.png')[0]
+        self.add_reports(1)
+        self.assertEqual(len(self.export()[1]), 1)
+        with open(os.path.join(self.output, dataset.MANIFEST_NAME)) as f:
+            self.assertEqual(json.load(f)['failed_report_ids'], [missing.id])
+
+        # The cursor moved past it, but the next export picks it up again
+        Image.new('RGB', (300, 200), (1, 2, 3)).save(os.path.join(self.media_root, missing.report_image.name))
+        images, index = self.export()
+        self.assertEqual(sorted(int(row['report_id']) for row in index)[0], missing.id)
+        with open(os.path.join(self.output, dataset.MANIFEST_NAME)) as f:
+            self.assertEqual(json.load(f)['failed_report_ids'], [])
+
+    def test_workers_do_not_load_django(self):
+        code = "import sys, firstApp.dataset; sys.exit('django' in sys.modules)"
+        self.assertEqual(subprocess.run([sys.executable, '-c', code], cwd=settings.BASE_DIR).returncode, 0)
+
+    def test_interrupted_index_line_is_dropped(self):
+        self.add_reports(2)
+        self.export()
+        with open(os.path.join(self.output, dataset.INDEX_NAME), 'a') as f:
+            f.write('0,2,99')
+        self.assertEqual(len(dataset.read_index(self.output)), 2)
@@ -0,0 +1,125 @@
+"""
+Lightweight triage model for the two-tier inference cascade.
+
+A handful of cheap colour, contrast and edge statistics are computed from a
+64x64 thumbnail and scored with a logistic regression that predicts "not
+Normal".  Images whose score is below VISIONCARE_TRIAGE_THRESHOLD are reported
+as Normal straight away; everything else is escalated to the full
+EfficientNetB0.  The weights are trained from the full model's stored
+results with ``manage.py train_triage`` and saved as JSON.
+
+The cascade is off unless VISIONCARE_CASCADE=1 and the weights file exists.
+Every HOLDOUT_EVERY-th patient is kept out of training, so ``manage.py
+evaluate_cascade`` scores the model on patients it has never seen.
+"""
+import json
+import os
+import threading
+
+import numpy as np
+from django.db.models import F
+from PIL import Image
+
+MODEL_PATH = os.environ.get('VISIONCARE_TRIAGE_MODEL', 'triage_model.json')
+THRESHOLD = float(os.environ.get('VISIONCARE_TRIAGE_THRESHOLD', 0.2))
+THUMB_SIZE = 64
+HOLDOUT_EVERY = 5
+
+ROUTE_FULL = 'full'
+ROUTE_TRIAGE = 'triage'
+ROUTE_DUPLICATE = 'duplicate'  # reused the result of the patient's near-duplicate image
+
+_model = None
+_lock = threading.Lock()
+
+
+def split(reports, held_out):
+    """The held-out (evaluation) or training part of an EyeReport queryset, split by patient."""
+    reports = reports.alias(fold=F('patient_id') % HOLDOUT_EVERY)
+    return reports.filter(fold=0) if held_out else reports.exclude(fold=0)
+
+
+def features(image):
+    """Feature vector for a path or file object (rewound afterwards)."""
+    img = Image.open(image)
+    img.draft('RGB', (THUMB_SIZE * 2, THUMB_SIZE * 2))
+    img = img.convert('RGB').resize((THUMB_SIZE, THUMB_SIZE), Image.BILINEAR)
+    if hasattr(image, 'seek'):
+        image.seek(0)
+
+    rgb = np.asarray(img, dtype=np.float32) / 255.0
+    r, g, b = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+    gray = rgb.mean(axis=2)
+    field = gray > 0.05  # ignore the black border around the fundus
+
+    gy, gx = np.gradient(g)
+    grad = np.hypot(gx, gy)[field] if field.any() else np.zeros(1)
+    green = g[field] if field.any() else g.ravel()
+    hist, _ = np.histogram(green, bins=8, range=(0.0, 1.0))
+
+    return np.concatenate([
+        [r.mean(), g.mean(), b.mean(), r.std(), g.std(), b.std()],
+        [g.mean() / (r.mean() + 1e-5), b.mean() / (r.mean() + 1e-5)],
+        [field.mean(), grad.mean(), grad.std(), (grad > 0.08).mean()],
+        hist / max(hist.sum(), 1),
+    ]).astype(np.float64)
+
+
+class TriageModel:
+    def __init__(self, mean, std, weights, bias):
+        self.mean = np.asarray(mean)
+        self.std = np.asarray(std)
+        self.weights = np.asarray(weights)
+        self.bias = float(bias)
+
+    def score(self, feature_rows):
+        """Probability that each image is abnormal."""
+        x = (np.atleast_2d(feature_rows) - self.mean) / self.std
+        return 1.0 / (1.0 + np.exp(-(x @ self.weights + self.bias)))
+
+    @classmethod
+    def fit(cls, x, y, epochs=2000, lr=0.1, l2=1e-3):
+        """Logistic regression by batch gradient descent (class-balanced)."""
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        mean, std = x.mean(axis=0), x.std(axis=0) + 1e-6
+        xs = (x - mean) / std
+        pos = max(y.mean(), 1e-6)
+        sample_weight = np.where(y > 0, 0.5 / pos, 0.5 / max(1 - pos, 1e-6))
+        w = np.zeros(x.shape[1])
+        b = 0.0
+        for _ in range(epochs):
+            p = 1.0 / (1.0 + np.exp(-(xs @ w + b)))
+            err = (p - y) * sample_weight
+            w -= lr * (xs.T @ err / len(y) + l2 * w)
+            b -= lr * err.mean()
+        return cls(mean, std, w, b)
+
+    def save(self, path=MODEL_PATH):
+        with open(path, 'w') as f:
+            json.dump({'mean': self.mean.tolist(), 'std': self.std.tolist(),
+                       'weights': self.weights.tolist(), 'bias': self.bias}, f)
+
+    @classmethod
+    def load(cls, path=MODEL_PATH):
+        with open(path) as f:
+            return cls(**json.load(f))
+
+
+def cascade_enabled():
+    return os.environ.get('VISIONCARE_CASCADE', '0') == '1' and os.path.exists(MODEL_PATH)
+
+
+def get_triage_model():
+    global _model
+    if _model is None:
+        with _lock:
+            if _model is None:
+                _model = TriageModel.load()
+    return _model
+
+
+def triage(images, threshold=THRESHOLD):
+    """Score ``images``; returns (scores, escalate flags)."""
+    scores = get_triage_model().score([features(image) for image in images])
+    return scores, scores >= threshold
@@ -0,0 +1,144 @@
+"""
+Resumable chunked uploads.
+
+A client registers an upload (file name, size, eye) and gets back an id and
+the chunk size.  The file is preallocated under upload_dir() and every chunk
+is PUT to its byte offset with an ``X-Chunk-SHA256`` header; the digest is
+checked and the bytes are written in place with os.pwrite, so chunks may
+arrive in any order and in parallel and the file is never concatenated or
+re-read.  A map file holding one byte per chunk records which chunks are on
+disk, and the upload's status lists the offsets still missing, so an
+interrupted client resumes where it stopped.
+
+When every chunk is in, the file is handed to the normal scan flow as an
+UploadedFile with a temporary_file_path(), which FileSystemStorage moves
+into place instead of copying.
+"""
+import hashlib
+import mimetypes
+import os
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+
+MAX_UPLOAD_SIZE = int(os.environ.get('VISIONCARE_MAX_UPLOAD_SIZE', 50 * 1024 * 1024))
+ALLOWED_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.jfif')
+
+
+def _chunk_size():
+    size = int(os.environ.get('VISIONCARE_UPLOAD_CHUNK_SIZE', 1024 * 1024))
+    # Each chunk is one request body, and Django refuses bodies larger than
+    # DATA_UPLOAD_MAX_MEMORY_SIZE with RequestDataTooBig
+    limit = settings.DATA_UPLOAD_MAX_MEMORY_SIZE
+    return max(1, min(size, limit) if limit else size)
+
+
+CHUNK_SIZE = _chunk_size()
+
+
+class UploadError(ValueError):
+    pass
+
+
+def upload_dir():
+    # Same filesystem as MEDIA_ROOT, so the final move into storage is a rename
+    return os.environ.get('VISIONCARE_UPLOAD_DIR') or os.path.join(settings.MEDIA_ROOT, 'uploads', 'partial')
+
+
+def data_path(upload):
+    return os.path.join(upload_dir(), f"{upload.id}.part")
+
+
+def map_path(upload):
+    return os.path.join(upload_dir(), f"{upload.id}.map")
+
+
+def chunk_count(upload):
+    return -(-upload.size // upload.chunk_size)
+
+
+def check_new(filename, size):
+    if not filename.lower().endswith(ALLOWED_EXTENSIONS):
+        raise UploadError(f"Unsupported file type: {filename}")
+    if not 0 < size <= MAX_UPLOAD_SIZE:
+        raise UploadError(f"Size must be between 1 byte and {MAX_UPLOAD_SIZE} bytes.")
+
+
+def start(upload):
+    """Preallocate the data and chunk-map files for a new ``upload``."""
+    os.makedirs(upload_dir(), exist_ok=True)
+    with open(data_path(upload), 'wb') as f:
+        f.truncate(upload.size)
+    with open(map_path(upload), 'wb') as f:
+        f.write(bytes(chunk_count(upload)))
+
+
+def write_chunk(upload, offset, data, digest):
+    """Check and store one chunk; writing the same chunk twice is harmless."""
+    if offset % upload.chunk_size or not 0 <= offset < upload.size:
+        raise UploadError(f"Offset must be a multiple of {upload.chunk_size} below {upload.size}.")
+    expected = min(upload.chunk_size, upload.size - offset)
+    if len(data) != expected:
+        raise UploadError(f"Chunk at {offset} must be {expected} bytes, got {len(data)}.")
+    if hashlib.sha256(data).hexdigest() != (digest or '').strip().lower():
+        raise UploadError(f"Checksum mismatch for chunk at {offset}.")
+
+    # Data first, then the map byte, so a chunk is only marked once it is on disk
+    fd = os.open(data_path(upload), os.O_WRONLY)
+    try:
+        os.pwrite(fd, data, offset)
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    fd = os.open(map_path(upload), os.O_WRONLY)
+    try:
+        os.pwrite(fd, b'\x01', offset // upload.chunk_size)
+    finally:
+        os.close(fd)
+
+
+def missing_offsets(upload):
+    with open(map_path(upload), 'rb') as f:
+        received = f.read()
+    return [i * upload.chunk_size for i, done in enumerate(received) if not done]
+
+
+def status(upload):
+    missing = missing_offsets(upload)
+    return {
+        'id': str(upload.id),
+        'filename': upload.filename,
+        'size': upload.size,
+        'chunk_size': upload.chunk_size,
+        # Bytes received without a gap, for clients that upload sequentially
+        'offset': missing[0] if missing else upload.size,
+        'missing': missing,
+        'complete': not missing,
+    }
+
+
+class AssembledUpload(UploadedFile):
+    """A finished upload, readable in place and moved (not copied) on save."""
+
+    def __init__(self, upload):
+        content_type = mimetypes.guess_type(upload.filename)[0] or 'application/octet-stream'
+        super().__init__(open(data_path(upload), 'rb'), upload.filename, content_type, upload.size)
+        self.path = data_path(upload)
+
+    def temporary_file_path(self):
+        return self.path
+
+
+def open_completed(upload):
+    if missing_offsets(upload):
+        raise UploadError(f"{upload.filename} is not complete.")
+    return AssembledUpload(upload)
+
+
+def discard(upload):
+    for path in (data_path(upload), map_path(upload)):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+    upload.delete()
@@ -14,17 +14,33 @@ urlpatterns = [
     # Scanner URLs
     path('scanner/', views.scanner_dashboard, name='scanner_dashboard'),
     path('scan_patient/<int:user_id>/', views.scan_patient, name='scan_patient'),
+    path('scan_patient/<int:user_id>/uploads/', views.upload_start, name='upload_start'),
+    path('scan_patient/<int:user_id>/uploads/finish/', views.upload_finish, name='upload_finish'),
+    path('uploads/<uuid:upload_id>/', views.upload_status, name='upload_status'),
+    path('uploads/<uuid:upload_id>/<int:offset>/', views.upload_chunk, name='upload_chunk'),
+    path('sync/scans/', views.sync_scans, name='sync_scans'),
+    path('sync/changes/', views.sync_changes, name='sync_changes'),
 
     # Dashboard pages
     path('patient_dashboard/', views.patient_dashboard, name='patient_dashboard'),
     path('admin-dashboard/', views.admin_dashboard, name='admin_dashboard'),
     path('doctor-dashboard/', views.doctor_dashboard, name='doctor_dashboard'),
+    path('dashboard/events/', views.dashboard_events, name='dashboard_events'),
     
 
     # Doctor patient detail and scan actions
     path('doctor/patient/<int:user_id>/', views.patient_detail, name='patient_detail'),
     path('doctor/scan_done/<int:user_id>/', views.mark_scan_done, name='mark_scan_done'),
-] + static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
+    path('doctor/report/<int:report_id>/saliency/', views.report_saliency, name='report_saliency'),
+    path('doctor/export/', views.export_reports, name='export_reports'),
+    path('doctor/analytics/<str:metric>/', views.analytics_trends, name='analytics_trends'),
+
+    # Media moved into pack files by archive_media
+    path('archive/<path:path>', views.archived_media, name='archived_media'),
+
+    # Fingerprinted, pre-compressed static assets (see assets.py)
+    path(settings.STATIC_URL.strip('/') + '/<path:path>', views.serve_asset, name='static_asset'),
+]
 
 if settings.DEBUG:
     urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
@@ -1,73 +1,98 @@
 from django.shortcuts import render, redirect, get_object_or_404
-# import keras
-import tensorflow as tf 
-from PIL import Image
+from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse, FileResponse, Http404, HttpResponseBadRequest, HttpResponseForbidden, JsonResponse
+from django.contrib.staticfiles.views import serve as serve_from_finders
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils import timezone
+from django.urls import reverse
+from asgiref.sync import sync_to_async
 import numpy as np
+import io
 import os
-from django.core.files.storage import FileSystemStorage
+from django.core.files.storage import default_storage
 from django.contrib import messages
 from django.contrib.auth.models import User
 from datetime import datetime
-from reportlab.lib.pagesizes import A4
-from reportlab.pdfgen import canvas
-from django.core.files import File
+from django.core.files.base import ContentFile
 from django.contrib.auth import authenticate, login as auth_login
-from reportlab.lib import colors
-from reportlab.platypus import Image as RLImage
-from django.db.models import Count
-from reportlab.lib.utils import simpleSplit
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Sum, F, OuterRef, Q, Subquery
+from django.db.models.functions import TruncWeek, TruncMonth
 import json
 
 # Import the validator from utils.py
 from .utils import is_valid_fundus
-from .models import UserProfile, EyeReport, Scanner
-
-# Load model
-media = 'media'
+from .reports import render_report_pdf, render_visit_pdf
+from .export import iter_reports_zip, export_queryset
 # Ensure this model is trained on ROP classes!
-model = tf.keras.models.load_model('EfficientNetB0_model.h5') 
+from .inference import get_model
+from .phash import dhash, find_duplicates
+from .triage import cascade_enabled, triage, ROUTE_DUPLICATE, ROUTE_FULL, ROUTE_TRIAGE
+from .events import current_event_id, event_stream, live_updates
+from . import uploads as chunked
+from .saliency import overlay_status, precompute as precompute_saliency, READY, ERROR
+from .preprocess import CLASSES, preprocess_image
+from .stages import worst_stage
+from .assets import collected_path, pick_variant, asset_headers
+from .models import UserProfile, EyeReport, Scanner, DailyRollup, Visit, ChunkedUpload, SyncedScan
 
 # ---------------- PREDICTION LOGIC ----------------
+MAX_VISIT_IMAGES = 12
+
+def predict_batch(images):
+    """Classify preprocessed images in a single forward pass."""
+    if not images:
+        return []
+    predictions = get_model().predict(np.stack(images))
+
+    diseases = []
+    for row in predictions:
+        predicted_class = int(np.argmax(row))
+        # Optional: Print confidence for debugging in terminal
+        confidence = np.max(row) * 100
+        print(f"Model Prediction Index: {predicted_class} | Confidence: {confidence:.2f}%")
+
+        # Return the class based strictly on the model's output index
+        if 0 <= predicted_class < len(CLASSES):
+            diseases.append(CLASSES[predicted_class])
+        else:
+            diseases.append("Unknown")
+    return diseases
+
 def makepredictions(path):
-    # 1. Open and Process the Image
-    img = Image.open(path)
-    img_d = img.resize((224, 224))
-    
-    # Handle PNGs or Grayscale images
-    if len(np.array(img_d).shape) < 3:
-        rgb_img = Image.new("RGB", img_d.size)
-        rgb_img.paste(img_d)
-    else:
-        rgb_img = img_d
-        
-    rgb_img = np.array(rgb_img, dtype=np.float64)
-    rgb_img = rgb_img.reshape(1, 224, 224, 3)
-    
-    # 2. Get Prediction from Model
-    predictions = model.predict(rgb_img)
-    predicted_class = int(np.argmax(predictions))
-    
-    # Optional: Print confidence for debugging in terminal
-    confidence = np.max(predictions) * 100
-    print(f"Model Prediction Index: {predicted_class} | Confidence: {confidence:.2f}%")
-
-    # 3. Map Index to ROP Stage
-    # IMPORTANT: This list must match the EXACT order your model was trained on.
-    classes = [
-        "Normal",       # Index 0
-        "ROP Stage 1",  # Index 1
-        "ROP Stage 2",  # Index 2
-        "ROP Stage 3",  # Index 3
-        "ROP Stage 4",  # Index 4
-        "ROP Stage 5",  # Index 5
-        "Plus Disease"  # Index 6 (if applicable)
-    ]
-    
-    # Return the class based strictly on the model's output index
-    if 0 <= predicted_class < len(classes):
-        return classes[predicted_class]
-    else:
-        return "Unknown"
+    return predict_batch([preprocess_image(path)])[0]
+
+def classify_uploads(files, duplicates=None):
+    """Diseases, inference routes and triage scores for a submission.
+
+    Re-uploads of one of the patient's earlier images (``duplicates``, from
+    find_duplicates) reuse that report's result without running a model.
+    With the cascade enabled the triage model answers confident "Normal"
+    images itself and only the rest go through the full model, in one batch.
+    """
+    diseases = [None] * len(files)
+    routes = [ROUTE_FULL] * len(files)
+    scores = [None] * len(files)
+
+    pending = []
+    for i, duplicate in enumerate(duplicates or [None] * len(files)):
+        if duplicate is not None:
+            diseases[i] = duplicate.disease
+            routes[i] = ROUTE_DUPLICATE
+        else:
+            pending.append(i)
+    if pending and cascade_enabled():
+        triage_scores, escalate = triage([files[i] for i in pending])
+        for i, score, escalated in zip(pending, triage_scores, escalate):
+            scores[i] = float(score)
+            if not escalated:
+                diseases[i] = "Normal"
+                routes[i] = ROUTE_TRIAGE
+        pending = [i for i, escalated in zip(pending, escalate) if escalated]
+
+    for i, disease in zip(pending, predict_batch([preprocess_image(files[i]) for i in pending])):
+        diseases[i] = disease
+    return diseases, routes, scores
 
 def get_solution_for_disease(disease):
     disease_solutions = {
@@ -91,112 +116,25 @@ def get_solution_for_disease(disease):
 
 
 # ---------------- PDF Report Generator ----------------
+# PDFs are rendered in memory and saved through the media storage, so they
+# land wherever the images do (local disk or the shared object store).
 def generate_pdf_report(report):
+    """Returns (file name, ContentFile) for ``report``'s PDF."""
     profile = UserProfile.objects.get(user=report.patient)
-    file_name = f"eye_reports/{report.patient.username}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
-    file_path = os.path.join(media, file_name)
-
-    c = canvas.Canvas(file_path, pagesize=A4)
-    width, height = A4
-    margin = 50
-
-    # ----------------- Border -----------------
-    c.setStrokeColor(colors.HexColor("#024b30"))
-    c.setLineWidth(3)
-    c.rect(margin/2, margin/2, width - margin, height - margin, stroke=1, fill=0)
-
-    # ----------------- Header -----------------
-    c.setFillColor(colors.HexColor("#024b30"))
-    c.rect(0, height - 80, width, 80, fill=1)
-    c.setFillColor(colors.white)
-    c.setFont("Times-Bold", 26)
-    c.drawCentredString(width/2, height - 50, "Vision Care Clinic")
-
-    # ----------------- Patient Info Table -----------------
-    y = height - 120
-    c.setFillColor(colors.black)
-    c.setFont("Times-Bold", 16)
-    c.drawString(margin, y, "Patient Information:")
-    y -= 5
-
-    patient_data = [
-        ("Name", report.patient.username),
-        ("Email", report.patient.email),
-        ("Age", getattr(profile, "age", "N/A")),
-        ("Contact", getattr(profile, "contact_number", "N/A")),
-        ("Address", getattr(profile, "address", "N/A")),
-        ("Blood Group", getattr(profile, "blood_group", "N/A")),
-        ("Gender", getattr(profile, "gender", "N/A")),
-    ]
-    if getattr(profile, "other_info", None):
-        patient_data.append(("Other Info", profile.other_info))
-
-    c.setFont("Times-Roman", 14)
-    y -= 20
-    row_height = 20
-    for label, value in patient_data:
-        c.drawString(margin + 10, y, f"{label}: {value}")
-        y -= row_height
-
-    # ----------------- Disease Info Table -----------------
-    y -= 10
-    c.setFillColor(colors.HexColor("#024b30"))
-    c.setFont("Times-Bold", 16)
-    c.drawString(margin, y, "Diagnosis & Recommendations:")
-    y -= 20
-
-    disease_data = [
-        ("Disease Detected", report.disease),
-        ("Solution & Care", report.solution),
-    ]
-
-    c.setFillColor(colors.black)
-    c.setFont("Times-Roman", 14)
-    for label, value in disease_data:
-        c.drawString(margin + 10, y, f"{label}:")
-        y -= 18
-        # Wrap text for long solution
-        if label == "Solution & Care":
-            wrapped_lines = simpleSplit(value, "Times-Roman", 13, width - 2*margin - 20)
-            for line in wrapped_lines:
-                if y < margin + 50:
-                    c.showPage()
-                    y = height - margin
-                c.drawString(margin + 20, y, line)
-                y -= 18
-        else:
-            c.drawString(margin + 20, y, value)
-            y -= 20
+    file_name = f"{report.patient.username}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
+    buf = io.BytesIO()
+    render_report_pdf(report, profile, buf)
+    return file_name, ContentFile(buf.getvalue())
 
-    # ----------------- Eye Image -----------------
-    if report.report_image:
-        try:
-            img_path = os.path.join(media, report.report_image.name)
-            img = RLImage(img_path)
-            img_width = 200
-            img_height = 200
-            img.drawHeight = img_height
-            img.drawWidth = img_width
-            img.wrapOn(c, width, height)
-            # Place image below disease info
-            if y - img_height < margin + 50:
-                c.showPage()
-                y = height - margin - img_height
-            img.drawOn(c, width - margin - img_width, y - img_height + 20)
-            y -= img_height + 20
-        except Exception as e:
-            print("Error adding image to PDF:", e)
+def generate_visit_pdf(visit, reports):
+    if len(reports) == 1:
+        return generate_pdf_report(reports[0])
 
-    # ----------------- Footer -----------------
-    c.setFillColor(colors.HexColor("#024b30"))
-    c.rect(0, 0, width, 50, fill=1)
-    c.setFillColor(colors.white)
-    c.setFont("Times-Italic", 12)
-    c.drawCentredString(width/2, 20, "Thank you for choosing Vision Care Clinic")
-
-    c.showPage()
-    c.save()
-    return file_name
+    profile = UserProfile.objects.get(user=visit.patient)
+    file_name = f"{visit.patient.username}_visit{visit.id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
+    buf = io.BytesIO()
+    render_visit_pdf(visit, reports, profile, get_solution_for_disease(visit.worst_stage), buf)
+    return file_name, ContentFile(buf.getvalue())
 
 # ------------------- Existing views -------------------
 def index(request):
@@ -214,12 +152,12 @@ def eye(request):
             return render(request, 'eye.html')
         # --- VALIDATION END ---
 
-        fss = FileSystemStorage()
-        file = fss.save(upload.name, upload)
-        file_url = fss.url(file)
+        file = default_storage.save(upload.name, upload)
+        file_url = default_storage.url(file)
         
-        # Run prediction on the saved file
-        disease = makepredictions(os.path.join(media, file))
+        # Run prediction on the uploaded file
+        upload.seek(0)
+        disease = makepredictions(upload)
         solution = get_solution_for_disease(disease)
         
         if request.user.is_authenticated:
@@ -232,19 +170,28 @@ def eye(request):
 
 
 # ------------------- Scanner Dashboard -------------------
+def patients_with_latest_report():
+    """Patient profiles with ``latest_report`` (and its visit) attached, in two queries."""
+    latest = EyeReport.objects.filter(patient=OuterRef('user')).order_by('-date_time').values('id')[:1]
+    patients = list(UserProfile.objects.filter(role='patient').select_related('user')
+                    .annotate(latest_report_id=Subquery(latest)))
+    reports = EyeReport.objects.select_related('visit').in_bulk(
+        [p.latest_report_id for p in patients if p.latest_report_id])
+    for profile in patients:
+        profile.latest_report = reports.get(profile.latest_report_id)
+    return patients
+
 def scanner_dashboard(request):
     if 'role' not in request.session or request.session['role'] != 'scanner':
         messages.error(request, "Access denied!")
         return redirect('login')
 
-    patients = UserProfile.objects.filter(role='patient')
-    for profile in patients:
-        profile.latest_report = EyeReport.objects.filter(patient=profile.user).order_by('-date_time').first()
+    patients = patients_with_latest_report()
 
     patient_reports = [{'userprofile': p, 'report': p.latest_report} for p in patients]
 
     # Stats
-    total_patients = patients.count()
+    total_patients = len(patients)
     scans_completed = sum(1 for p in patients if p.latest_report)
     patients_remaining = total_patients - scans_completed
 
@@ -252,12 +199,125 @@ def scanner_dashboard(request):
         'patient_reports': patient_reports,
         'total_patients': total_patients,
         'scans_completed': scans_completed,
-        'patients_remaining': patients_remaining
+        'patients_remaining': patients_remaining,
+        'live_updates': live_updates(request),
     }
+    if context['live_updates']:
+        context['last_event_id'] = current_event_id()
 
     return render(request, 'scanner_dashboard.html', context)
 
 
+def classify_scan(patient_user, uploads):
+    """Validate and classify one visit from [(eye, file), ...]; writes nothing.
+
+    Returns (classified, errors), ``classified`` being what store_scan needs.
+    """
+    # --- VALIDATION START ---
+    errors = []
+    if len(uploads) > MAX_VISIT_IMAGES:
+        errors.append(f"At most {MAX_VISIT_IMAGES} images can be submitted per visit.")
+    for eye, uploaded_file in uploads:
+        is_valid, error_msg = is_valid_fundus(uploaded_file)
+        if not is_valid:
+            errors.append(f"{uploaded_file.name}: {error_msg}" if len(uploads) > 1 else error_msg)
+    if errors:
+        return [], errors
+    # --- VALIDATION END ---
+
+    # --- NEAR-DUPLICATE CHECK ---
+    hashes = [dhash(uploaded_file) for eye, uploaded_file in uploads]
+    duplicates = find_duplicates(patient_user, hashes)
+
+    # --- TRIAGE + ONE FORWARD PASS FOR THE REST ---
+    diseases, routes, scores = classify_uploads([f for eye, f in uploads], duplicates)
+    return list(zip(hashes, duplicates, diseases, routes, scores)), []
+
+
+def store_scan(request, patient_user, scanner, uploads, classified, captured_at=None):
+    """Store the visit, reports and PDF of a classified scan; returns the reports.
+
+    Call inside transaction.atomic().  The first statement is a write, so
+    SQLite takes the write lock up front: a transaction that reads first
+    fails with "database is locked" rather than waiting when it then writes
+    while another request is writing.
+    """
+    diseases = [disease for image_phash, duplicate, disease, route, score in classified]
+    captured_at = captured_at or timezone.now()
+    visit = Visit.objects.create(patient=patient_user, scanned_by=scanner, worst_stage=worst_stage(diseases),
+                                 date_time=captured_at)
+
+    reports = []
+    try:
+        for (eye, uploaded_file), (image_phash, duplicate, disease, route, score) in zip(uploads, classified):
+            report = EyeReport.objects.create(
+                patient=patient_user,
+                disease=disease,
+                solution=get_solution_for_disease(disease),
+                report_image=uploaded_file,
+                image_phash=image_phash,
+                duplicate_of=duplicate,
+                scanned_by=scanner,
+                visit=visit,
+                date_time=captured_at,
+                eye=eye,
+                inference_route=route,
+                triage_score=score
+            )
+            reports.append(report)
+
+            if duplicate:
+                messages.warning(
+                    request,
+                    f"⚠️ {uploaded_file.name} looks like a re-upload of report #{duplicate.id} "
+                    f"from {duplicate.date_time:%d %b %Y}; its result ({disease}) was reused. Both are kept and linked."
+                )
+
+        # Generate one PDF for the whole visit
+        visit.pdf_report.save(*generate_visit_pdf(visit, reports), save=True)
+        EyeReport.objects.filter(visit=visit).update(pdf_report=visit.pdf_report.name)
+    except Exception:
+        delete_scan_files(reports, visit)
+        raise
+    # The caller's transaction may still roll back (sync_scans)
+    transaction.on_commit(lambda: precompute_saliency(reports))
+
+    if len(reports) == 1:
+        messages.success(request, f"Scan completed for {patient_user.username}. Disease: {visit.worst_stage}")
+    else:
+        messages.success(request, f"Scan completed for {patient_user.username}. "
+                                  f"{len(reports)} images, worst stage: {visit.worst_stage}")
+    return reports
+
+
+def record_scan(request, patient_user, uploads, captured_at=None):
+    """Validate, classify and store one visit from [(eye, file), ...].
+
+    ``captured_at`` dates the visit and its reports (default: now).
+    Returns (reports, errors); nothing is saved when there are errors.  The
+    models run before the transaction opens, so no lock is held meanwhile.
+    """
+    classified, errors = classify_scan(patient_user, uploads)
+    if errors:
+        return [], errors
+    scanner = request.user if request.user.is_authenticated else None
+    # A storage or PDF failure must not leave a visit pointing at deleted files
+    with transaction.atomic():
+        return store_scan(request, patient_user, scanner, uploads, classified, captured_at), []
+
+
+def delete_scan_files(reports, visit=None):
+    """Remove the stored images and PDF of a scan whose rows are being rolled back."""
+    visit = visit or (reports[0].visit if reports else None)
+    files = [r.report_image for r in reports] + ([visit.pdf_report] if visit else [])
+    for field_file in files:
+        if field_file:
+            try:
+                field_file.storage.delete(field_file.name)
+            except Exception as e:
+                print("Could not remove", field_file.name, e)
+
+
 def scan_patient(request, user_id):
     if 'role' not in request.session or request.session['role'] != 'scanner':
         messages.error(request, "Access denied!")
@@ -268,48 +328,291 @@ def scan_patient(request, user_id):
     
     existing_report = EyeReport.objects.filter(patient=patient_user).order_by('-date_time').first()
 
-    if request.method == "POST" and 'eye_image' in request.FILES:
-        uploaded_file = request.FILES['eye_image']
+    # One submission may carry several images per eye; 'eye_image' is the
+    # original single-image field.
+    uploads = [(eye, f) for eye, field in (('left', 'left_images'), ('right', 'right_images'), ('', 'eye_image'))
+               for f in request.FILES.getlist(field)]
 
-        # --- VALIDATION START ---
-        is_valid, error_msg = is_valid_fundus(uploaded_file)
-        if not is_valid:
-            messages.warning(request, f"⚠️ {error_msg}")
+    if request.method == "POST" and uploads:
+        reports, errors = record_scan(request, patient_user, uploads)
+        if errors:
+            for error_msg in errors:
+                messages.warning(request, f"⚠️ {error_msg}")
             # Return immediately to the form with the warning
             return render(request, 'scan_patient.html', {
                 'patient': patient_user,
                 'existing_report': existing_report
             })
-        # --- VALIDATION END ---
-
-        fs = FileSystemStorage()
-        filename = fs.save(uploaded_file.name, uploaded_file)
-        file_path = fs.path(filename)
-
-        disease = makepredictions(file_path)
-        solution = get_solution_for_disease(disease)
-        
-        report = EyeReport.objects.create(
-            patient=patient_user,
-            disease=disease,
-            solution=solution,
-            report_image=uploaded_file
-        )
-        
-        # Generate PDF report
-        pdf_path = generate_pdf_report(report)
-        with open(os.path.join(media, pdf_path), 'rb') as f:
-            django_file = File(f)
-            report.pdf_report.save(os.path.basename(pdf_path), django_file, save=True)
-
-        messages.success(request, f"Scan completed for {patient_user.username}. Disease: {disease}")
         return redirect('scanner_dashboard')
 
+    if request.method == "POST":
+        messages.warning(request, "⚠️ Select at least one eye image.")
+
     return render(request, 'scan_patient.html', {
         'patient': patient_user,
         'existing_report': existing_report
     })
 
+# ------------------- Chunked Uploads -------------------
+# Resumable uploads for slow links (see uploads.py).  All four endpoints
+# speak JSON and are used by static/firstApp/js/chunked-upload.js.
+def _own_upload(request, upload_id):
+    upload = get_object_or_404(ChunkedUpload, id=upload_id)
+    if upload.scanned_by_id and upload.scanned_by_id != request.user.id:
+        raise Http404("Upload not found")
+    return upload
+
+
+def upload_start(request, user_id):
+    if request.session.get('role') != 'scanner':
+        return JsonResponse({'error': 'Access denied!'}, status=403)
+    if request.method != 'POST':
+        return JsonResponse({'error': 'POST required'}, status=405)
+    patient_user = get_object_or_404(User, id=user_id)
+
+    try:
+        body = json.loads(request.body)
+        filename = os.path.basename(str(body['filename']))
+        size = int(body['size'])
+        eye = body.get('eye', '')
+        if eye not in ('', 'left', 'right'):
+            raise chunked.UploadError("eye must be 'left', 'right' or empty")
+        chunked.check_new(filename, size)
+    except (ValueError, KeyError, TypeError) as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    upload = ChunkedUpload.objects.create(
+        patient=patient_user,
+        scanned_by=request.user if request.user.is_authenticated else None,
+        filename=filename,
+        eye=eye,
+        size=size,
+        chunk_size=chunked.CHUNK_SIZE,
+    )
+    chunked.start(upload)
+    return JsonResponse(chunked.status(upload), status=201)
+
+
+def upload_status(request, upload_id):
+    if request.session.get('role') != 'scanner':
+        return JsonResponse({'error': 'Access denied!'}, status=403)
+    return JsonResponse(chunked.status(_own_upload(request, upload_id)))
+
+
+def upload_chunk(request, upload_id, offset):
+    if request.session.get('role') != 'scanner':
+        return JsonResponse({'error': 'Access denied!'}, status=403)
+    if request.method != 'PUT':
+        return JsonResponse({'error': 'PUT required'}, status=405)
+    upload = _own_upload(request, upload_id)
+    try:
+        chunked.write_chunk(upload, offset, request.body, request.headers.get('X-Chunk-SHA256'))
+    except chunked.UploadError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse({'offset': offset, 'stored': True})
+
+
+def upload_finish(request, user_id):
+    """Run the scan flow over finished uploads, as one visit."""
+    if request.session.get('role') != 'scanner':
+        return JsonResponse({'error': 'Access denied!'}, status=403)
+    if request.method != 'POST':
+        return JsonResponse({'error': 'POST required'}, status=405)
+    patient_user = get_object_or_404(User, id=user_id)
+
+    try:
+        ids = [str(upload_id) for upload_id in json.loads(request.body)['uploads']]
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'error': 'Expected {"uploads": [ids]}'}, status=400)
+    # Same ownership rule as _own_upload: another scanner's uploads are not found
+    by_id = {str(u.id): u for u in ChunkedUpload.objects.filter(id__in=ids, patient=patient_user)
+             if not u.scanned_by_id or u.scanned_by_id == request.user.id}
+    if not ids or len(by_id) != len(set(ids)):
+        return JsonResponse({'error': 'Unknown upload id'}, status=404)
+
+    pending = [chunked.status(u) for u in by_id.values() if chunked.missing_offsets(u)]
+    if pending:
+        return JsonResponse({'error': 'Uploads incomplete', 'uploads': pending}, status=409)
+
+    files = [(by_id[i].eye, chunked.open_completed(by_id[i])) for i in ids]
+    try:
+        reports, errors = record_scan(request, patient_user, files)
+    except Exception:
+        # A server error must not cost the client a finished upload: keep
+        # every upload whose file is still here so finishing can be retried
+        for upload in by_id.values():
+            if not os.path.exists(chunked.data_path(upload)):
+                chunked.discard(upload)
+        raise
+    finally:
+        for eye, f in files:
+            f.close()
+    # Stored, or rejected by validation (which a retry would not change)
+    for upload in by_id.values():
+        chunked.discard(upload)
+
+    if errors:
+        return JsonResponse({'errors': errors}, status=400)
+    return JsonResponse({
+        'visit': reports[0].visit_id,
+        'worst_stage': reports[0].visit.worst_stage,
+        'reports': [{'id': r.id, 'disease': r.disease} for r in reports],
+        'redirect': reverse('scanner_dashboard'),
+    })
+
+
+# ------------------- Scanner Sync -------------------
+# Batched push and delta pull for scanner stations that work offline (see
+# outbox.py and ``manage.py scanner_sync``).
+MAX_SYNC_SCANS = 25
+SYNC_PAGE = 500
+
+def _synced(scan, status):
+    return {'key': scan.key, 'status': status, 'visit': scan.visit_id, 'worst_stage': scan.visit.worst_stage}
+
+
+def _captured_at(value):
+    """Aware datetime from a manifest's captured_at, None when absent, False when invalid."""
+    if not value:
+        return None
+    try:
+        captured_at = parse_datetime(str(value))
+    except ValueError:
+        return False
+    if captured_at is None:
+        return False
+    if timezone.is_naive(captured_at):
+        captured_at = timezone.make_aware(captured_at)
+    # A station clock running ahead must not date scans in the future
+    return min(captured_at, timezone.now())
+
+
+def sync_scans(request):
+    """Record a batch of queued scans, each at most once per idempotency key.
+
+    multipart POST: ``manifest`` is {"scans": [{"key", "patient", "captured_at",
+    "images": [{"file", "eye"}]}]} and every image is a file field named by
+    "file".  captured_at (ISO 8601, optional) dates the visit; times ahead of
+    the server's clock are taken as now.
+    """
+    if request.session.get('role') != 'scanner':
+        return JsonResponse({'error': 'Access denied!'}, status=403)
+    if request.method != 'POST':
+        return JsonResponse({'error': 'POST required'}, status=405)
+
+    try:
+        scans = json.loads(request.POST['manifest'])['scans']
+        keys = [str(scan['key']) for scan in scans]
+        patient_ids = [int(scan['patient']) for scan in scans]
+        if any(not 0 < len(key) <= 64 for key in keys):
+            raise ValueError("Keys must be 1-64 characters.")
+    except (ValueError, KeyError, TypeError) as e:
+        return JsonResponse({'error': f'Bad manifest: {e}'}, status=400)
+    if len(scans) > MAX_SYNC_SCANS:
+        # max_scans lets the client split the batch and send it again
+        return JsonResponse({'error': f'At most {MAX_SYNC_SCANS} scans per batch.', 'max_scans': MAX_SYNC_SCANS},
+                            status=400)
+
+    done = {s.key: s for s in SyncedScan.objects.filter(key__in=keys).select_related('visit')}
+    patients = User.objects.in_bulk(patient_ids)
+    scanner = request.user if request.user.is_authenticated else None
+
+    # record_scan reports through the messages framework; hand the notes
+    # back per scan instead of leaving them for the next page view
+    notes = messages.get_messages(request)
+    seen = len(list(notes))
+
+    results = []
+    for scan, key, patient_id in zip(scans, keys, patient_ids):
+        if key in done:
+            results.append(_synced(done[key], 'duplicate'))
+            continue
+
+        files = [(image.get('eye', ''), request.FILES.get(image.get('file', ''))) for image in scan.get('images', [])]
+        if patient_id not in patients:
+            errors = [f"Unknown patient {patient_id}."]
+        elif not files or not all(f for eye, f in files):
+            errors = ["Missing image files."]
+        elif any(eye not in ('', 'left', 'right') for eye, f in files):
+            errors = ["eye must be 'left', 'right' or empty."]
+        else:
+            errors = []
+            captured_at = _captured_at(scan.get('captured_at'))
+            if captured_at is False:
+                errors = ["captured_at must be an ISO 8601 date and time."]
+        if errors:
+            results.append({'key': key, 'status': 'rejected', 'errors': errors})
+            continue
+
+        status = 'created'
+        reports = []
+        try:
+            classified, errors = classify_scan(patients[patient_id], files)
+            if not errors:
+                # One transaction per scan instead of one per row and signal write
+                with transaction.atomic():
+                    reports = store_scan(request, patients[patient_id], scanner, files, classified, captured_at)
+                    done[key] = SyncedScan.objects.create(key=key, visit=reports[0].visit, scanned_by=scanner)
+        except IntegrityError:
+            # The same scan was recorded by a concurrent request
+            delete_scan_files(reports)
+            status = 'duplicate'
+            done[key] = SyncedScan.objects.select_related('visit').get(key=key)
+        except Exception as e:
+            print("Error recording synced scan:", e)
+            delete_scan_files(reports)
+            status, errors = 'error', ["Server error; the scan stays queued and will be sent again."]
+
+        new_notes = [str(m) for m in notes][seen:]
+        seen += len(new_notes)
+        if errors:
+            results.append({'key': key, 'status': 'rejected' if status == 'created' else status, 'errors': errors})
+        elif status == 'duplicate':
+            results.append(_synced(done[key], status))
+        else:
+            result = _synced(done[key], status)
+            result['reports'] = [{'id': r.id, 'eye': r.eye, 'disease': r.disease} for r in reports]
+            result['messages'] = new_notes
+            results.append(result)
+
+    return JsonResponse({'results': results})
+
+
+def sync_changes(request):
+    """Patients and results added since ``since`` (the previous ``cursor``)."""
+    if request.session.get('role') != 'scanner':
+        return JsonResponse({'error': 'Access denied!'}, status=403)
+    try:
+        since = request.GET.get('since') or '0.0'
+        patient_cursor, report_cursor = (int(part) for part in since.split('.'))
+        limit = max(1, min(int(request.GET.get('limit', SYNC_PAGE)), SYNC_PAGE))
+    except ValueError:
+        return JsonResponse({'error': 'since must be a cursor from an earlier response'}, status=400)
+
+    # Both feeds are append-only, so the last id seen of each is the cursor
+    patients = list(UserProfile.objects.filter(role='patient', id__gt=patient_cursor)
+                    .select_related('user').order_by('id')[:limit])
+    reports = list(EyeReport.objects.filter(id__gt=report_cursor).select_related('visit').order_by('id')[:limit])
+    if patients:
+        patient_cursor = patients[-1].id
+    if reports:
+        report_cursor = reports[-1].id
+
+    return JsonResponse({
+        'patients': [
+            {'id': p.user_id, 'username': p.user.username, 'email': p.user.email, 'age': p.age, 'gender': p.gender}
+            for p in patients
+        ],
+        'results': [
+            {'id': r.id, 'patient': r.patient_id, 'visit': r.visit_id, 'eye': r.eye, 'disease': r.disease,
+             'worst_stage': r.visit.worst_stage if r.visit else r.disease, 'date_time': r.date_time.isoformat()}
+            for r in reports
+        ],
+        'cursor': f"{patient_cursor}.{report_cursor}",
+        'more': len(patients) == limit or len(reports) == limit,
+    })
+
+
 # ------------------- Login / Signup / Dashboards -------------------
 DOCTOR_CREDENTIALS = {"username": "dradmin", "password": "doctor123"}
 
@@ -322,6 +625,7 @@ def login(request):
         # Doctor login (fixed credentials)
         if role == 'doctor':
             if username == "dradmin" and password == "doctor123":
+                request.session['role'] = 'doctor'
                 return redirect('doctor_dashboard')
             else:
                 messages.error(request, "Invalid doctor credentials!")
@@ -409,28 +713,31 @@ def admin_dashboard(request):
 def doctor_dashboard(request):
     if request.method == "POST":
         if 'delete_report' in request.POST:
-            report_id = request.POST.get('delete_report')
-            EyeReport.objects.filter(id=report_id).delete()
+            report = EyeReport.objects.select_related('visit').filter(id=request.POST.get('delete_report')).first()
+            if report:
+                remaining = EyeReport.objects.filter(visit_id=report.visit_id).exclude(id=report.id)
+                diseases = list(remaining.values_list('disease', flat=True)) if report.visit_id else []
+                if diseases:
+                    # Before the delete, so its dashboard event already sees the new worst stage
+                    Visit.objects.filter(id=report.visit_id).update(worst_stage=worst_stage(diseases))
+                report.delete()
         elif 'delete_scanner' in request.POST:
             scanner_id = request.POST.get('delete_scanner')
             UserProfile.objects.filter(id=scanner_id, role='scanner').delete()
         return redirect('doctor_dashboard')
 
-    patients = UserProfile.objects.filter(role='patient')
-    for profile in patients:
-        latest_report = EyeReport.objects.filter(patient=profile.user).order_by('-date_time').first()
-        profile.latest_report = latest_report
-
-    scanners = UserProfile.objects.filter(role='scanner')
+    patients = patients_with_latest_report()
+    scanners = UserProfile.objects.filter(role='scanner').select_related('user')
 
-    total_patients = patients.count()
+    total_patients = len(patients)
     scans_completed = sum(1 for p in patients if p.latest_report)
     patients_remaining = total_patients - scans_completed
 
     disease_counts = {}
     for profile in patients:
         if profile.latest_report:
-            disease = profile.latest_report.disease
+            # A visit counts once, at its worst stage
+            disease = profile.latest_report.visit_stage
             disease_counts[disease] = disease_counts.get(disease, 0) + 1
 
     chart_labels = json.dumps(list(disease_counts.keys()))
@@ -444,7 +751,10 @@ def doctor_dashboard(request):
         'total_patients': total_patients,
         'chart_labels': chart_labels,
         'chart_data': chart_data,
+        'live_updates': live_updates(request),
     }
+    if context['live_updates']:
+        context['last_event_id'] = current_event_id()
 
     return render(request, 'doctor_dashboard.html', context)
 
@@ -476,4 +786,167 @@ def patient_dashboard(request):
 
 def mark_scan_done(request, user_id):
     patient_user = get_object_or_404(User, id=user_id)
-    return redirect('scan_patient', user_id=patient_user.id)
\ No newline at end of file
+    return redirect('scan_patient', user_id=patient_user.id)
+
+# ------------------- Report Export -------------------
+def export_reports(request):
+    if request.session.get('role') != 'doctor':
+        messages.error(request, "Access denied!")
+        return redirect('login')
+
+    try:
+        patient_id = int(request.GET['patient']) if request.GET.get('patient') else None
+        start = parse_date(request.GET.get('start', '') or '')
+        end = parse_date(request.GET.get('end', '') or '')
+        # parse_date returns None for input that is not a date at all
+        if (request.GET.get('start') and not start) or (request.GET.get('end') and not end):
+            raise ValueError
+    except ValueError:
+        return HttpResponseBadRequest("patient must be a user id and start/end dates YYYY-MM-DD.")
+
+    if patient_id:
+        patient_user = get_object_or_404(User, id=patient_id)
+        archive_name = f"{patient_user.username}_reports.zip"
+    else:
+        archive_name = f"reports_{start or 'all'}_{end or 'now'}.zip"
+
+    response = StreamingHttpResponse(
+        iter_reports_zip(export_queryset(patient_id, start, end)),
+        content_type='application/zip',
+    )
+    response['Content-Disposition'] = f'attachment; filename="{archive_name}"'
+    return response
+
+
+# ------------------- Saliency Overlays -------------------
+def report_saliency(request, report_id):
+    if request.session.get('role') != 'doctor':
+        return JsonResponse({'error': 'Access denied!'}, status=403)
+    report = get_object_or_404(EyeReport, id=report_id)
+    if not report.report_image:
+        raise Http404("Report has no image")
+
+    status, detail = overlay_status(report.report_image)
+    if status == READY:
+        return JsonResponse({'status': status, 'url': detail})
+    if status == ERROR:
+        return JsonResponse({'status': status, 'error': detail}, status=500)
+    # Still being computed in the background; poll again
+    return JsonResponse({'status': status}, status=202)
+
+
+# ------------------- Live Dashboard Events (SSE) -------------------
+async def dashboard_events(request):
+    # Long-lived stream: serve through the ASGI app (demo/asgi.py)
+    # Session.aget() only arrived in Django 5.1
+    if await sync_to_async(request.session.get)('role') not in ('doctor', 'scanner'):
+        return HttpResponseForbidden("Access denied!")
+    if not live_updates(request):
+        # Under WSGI the stream would hold a worker for good; 204 tells
+        # EventSource not to reconnect
+        return HttpResponse(status=204)
+
+    last_id = request.headers.get('Last-Event-ID') or request.GET.get('last')
+    last_id = int(last_id) if last_id and last_id.isdigit() else None
+
+    response = StreamingHttpResponse(event_stream(last_id), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+# ------------------- Trend Analytics -------------------
+TREND_INTERVALS = {'day': None, 'week': TruncWeek, 'month': TruncMonth}
+TREND_METRICS = {
+    # metric -> (grouping field, aggregated column)
+    'scans': ('scanner__username', 'scans'),
+    'stages': ('disease', 'scans'),
+    'progression': ('disease', 'progressions'),
+}
+
+def analytics_trends(request, metric):
+    if request.session.get('role') != 'doctor':
+        return JsonResponse({'error': 'Access denied!'}, status=403)
+    if metric not in TREND_METRICS:
+        raise Http404("Unknown metric")
+
+    interval = request.GET.get('interval', 'day')
+    if interval not in TREND_INTERVALS:
+        return JsonResponse({'error': f"interval must be one of {', '.join(TREND_INTERVALS)}"}, status=400)
+    try:
+        start = parse_date(request.GET.get('start', '') or '')
+        end = parse_date(request.GET.get('end', '') or '')
+    except ValueError:
+        start = end = None
+    # parse_date returns None for input that is not a date at all
+    if (request.GET.get('start') and not start) or (request.GET.get('end') and not end):
+        return JsonResponse({'error': "start and end must be valid YYYY-MM-DD dates"}, status=400)
+
+    rows = DailyRollup.objects.all()
+    if start:
+        rows = rows.filter(day__gte=start)
+    if end:
+        rows = rows.filter(day__lte=end)
+    scanner = request.GET.get('scanner', '')
+    if scanner:
+        if not scanner.isdigit():
+            return JsonResponse({'error': "scanner must be a user id"}, status=400)
+        rows = rows.filter(scanner_id=int(scanner))
+
+    group_field, column = TREND_METRICS[metric]
+    trunc = TREND_INTERVALS[interval]
+    period = trunc('day') if trunc else F('day')
+    series = (rows.annotate(period=period)
+              .values('period', group_field)
+              .annotate(value=Sum(column))
+              .filter(value__gt=0)
+              .order_by('period', group_field))
+
+    return JsonResponse({
+        'metric': metric,
+        'interval': interval,
+        'series': [
+            {'period': row['period'].isoformat(), 'group': row[group_field] or 'Unassigned', 'value': row['value']}
+            for row in series
+        ],
+    })
+
+
+# ------------------- Archived Media -------------------
+def _may_view_media(request, path):
+    role = request.session.get('role')
+    if role in ('doctor', 'scanner'):
+        return True
+    # Patients only see their own images and PDFs
+    return role == 'patient' and request.user.is_authenticated and (
+        EyeReport.objects.filter(patient=request.user).filter(Q(report_image=path) | Q(pdf_report=path)).exists()
+        or Visit.objects.filter(patient=request.user, pdf_report=path).exists()
+    )
+
+
+def archived_media(request, path):
+    if not _may_view_media(request, path):
+        return HttpResponseForbidden("Access denied!")
+    if not default_storage.exists(path):
+        raise Http404("File not found")
+    return FileResponse(default_storage.open(path, 'rb'), filename=os.path.basename(path))
+
+
+# ------------------- Static Assets -------------------
+def serve_asset(request, path):
+    file_path = collected_path(path)
+    if file_path is None:
+        if settings.DEBUG:
+            # Not collected yet: fall back to the app/project static dirs
+            return serve_from_finders(request, path, insecure=True)
+        raise Http404("Asset not found")
+
+    content_type, cache_control = asset_headers(path)
+    variant, encoding = pick_variant(file_path, request.headers.get('Accept-Encoding', ''))
+
+    response = FileResponse(open(variant, 'rb'), content_type=content_type, filename=os.path.basename(path))
+    if encoding:
+        response['Content-Encoding'] = encoding
+    response['Vary'] = 'Accept-Encoding'
+    response['Cache-Control'] = cache_control
+    return response
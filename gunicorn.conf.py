@@ -0,0 +1,39 @@
+"""
+Gunicorn settings for VisionCare.
+
+Gunicorn picks this file up automatically from the working directory.  Set
+VISIONCARE_PRELOAD_MODEL=1 to load the Django app once in the master before
+forking, together with the classifier when its backend is fork-safe, so the
+model is shared copy-on-write by all workers instead of being loaded again
+in each of them.
+
+The TensorFlow (keras) backend is not fork-safe once a model is loaded (see
+firstApp/inference.py), so with it the master skips the model and every
+worker loads its own; VISIONCARE_EAGER_MODEL=1 does that at boot rather
+than on the first request.  scripts/measure_worker_memory.py compares both
+modes.
+"""
+import os
+
+from firstApp.inference import BACKEND, fork_safe, preload_enabled
+
+workers = int(os.environ.get('GUNICORN_WORKERS', os.environ.get('WEB_CONCURRENCY', 1)))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 600))
+preload_app = preload_enabled()
+preload_model_in_master = preload_app and fork_safe()
+
+
+def when_ready(server):
+    if preload_model_in_master:
+        from firstApp.inference import preload_model
+        preload_model()
+        server.log.info("Classifier loaded in master (pid %s) before fork", os.getpid())
+    elif preload_app:
+        server.log.warning("Not loading the %s classifier before fork: it is not fork-safe, "
+                           "each worker loads its own copy", BACKEND)
+
+
+def post_worker_init(worker):
+    if not preload_model_in_master and os.environ.get('VISIONCARE_EAGER_MODEL', '0') == '1':
+        from firstApp.inference import get_model
+        get_model()
@@ -0,0 +1,310 @@
+"""
+Load test simulating a screening day.
+
+Starts the app on a throw-away SQLite database and media directory with the
+stub inference backend, signs up patients and scanners through ``signup``,
+logs scanners and the doctor in through ``login``, then drives a mix of scan
+uploads, dashboard views and PDF downloads at fixed arrival rates (open loop,
+so a slow server shows up as latency instead of a lower offered load).
+
+    python scripts/loadtest.py --duration 60 --scan-rate 2 --dashboard-rate 5 --pdf-rate 2
+
+Each upload is a re-encoded copy of a sample image with a few pixels changed.
+media/ only holds a couple of dozen samples, and repeated bytes would measure
+duplicate handling instead of inference.  The triage cascade is switched off,
+so every scan pays ``--inference-ms``.
+
+At the end it prints throughput, latency percentiles and error rate for each
+endpoint.  Requires ``requests``; uses gunicorn when installed, otherwise
+``manage.py runserver``.
+"""
+import argparse
+import importlib.util
+import io
+import os
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from PIL import Image
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+from firstApp.utils import is_valid_fundus  # noqa: E402
+SAMPLE_DIR = os.path.join(BASE_DIR, 'media')
+PASSWORD = 'Load-test-123'
+
+
+# ---------------- Server ----------------
+def start_server(args, workdir):
+    env = dict(os.environ)
+    env.update({
+        'VISIONCARE_INFERENCE_BACKEND': 'stub',
+        'VISIONCARE_STUB_DELAY_MS': str(args.inference_ms),
+        'VISIONCARE_CASCADE': '0',
+        'VISIONCARE_DB_PATH': os.path.join(workdir, 'db.sqlite3'),
+        'VISIONCARE_MEDIA_ROOT': os.path.join(workdir, 'media'),
+        'DJANGO_SETTINGS_MODULE': 'demo.settings',
+    })
+    os.makedirs(os.path.join(workdir, 'media'))
+    subprocess.run([sys.executable, 'manage.py', 'migrate', '--noinput', '-v', '0'],
+                   cwd=BASE_DIR, env=env, check=True)
+
+    bind = f'127.0.0.1:{args.port}'
+    if importlib.util.find_spec('gunicorn'):
+        cmd = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--bind', bind,
+               '--workers', str(args.workers), '--threads', str(args.threads), 'demo.wsgi']
+    else:
+        cmd = [sys.executable, 'manage.py', 'runserver', '--noreload', bind]
+    server = subprocess.Popen(cmd, cwd=BASE_DIR, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    url = f'http://{bind}'
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            requests.get(url + '/login/', timeout=1)
+            return server, url
+        except requests.ConnectionError:
+            if server.poll() is not None:
+                break
+            time.sleep(0.3)
+    server.terminate()
+    raise RuntimeError("server did not start")
+
+
+# ---------------- Clients ----------------
+class Stats:
+    def __init__(self):
+        self.samples = defaultdict(list)   # endpoint -> [(latency, ok)]
+        self.lock = threading.Lock()
+
+    def record(self, endpoint, latency, ok):
+        with self.lock:
+            self.samples[endpoint].append((latency, ok))
+
+
+class Actor:
+    """A logged-in browser session, used from many driver threads at once.
+
+    requests.Session is not thread-safe, so every thread gets its own,
+    starting from the cookies (login session, CSRF token) the actor has
+    received so far.
+    """
+
+    def __init__(self, base, stats):
+        self.base = base
+        self.stats = stats
+        self.cookies = requests.cookies.RequestsCookieJar()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+            with self._lock:
+                session.cookies.update(self.cookies)
+        return session
+
+    def _csrf(self, path):
+        self.session.get(self.base + path)
+        return self.session.cookies.get('csrftoken', '')
+
+    def request(self, endpoint, method, path, ok_status=(200,), **kwargs):
+        start = time.perf_counter()
+        try:
+            resp = self.session.request(method, self.base + path, timeout=60, **kwargs)
+            ok = resp.status_code in ok_status
+            if resp.cookies:
+                with self._lock:
+                    self.cookies.update(resp.cookies)
+        except requests.RequestException:
+            resp, ok = None, False
+        self.stats.record(endpoint, time.perf_counter() - start, ok)
+        return resp
+
+    def post_form(self, endpoint, path, data, files=None, ok_status=(200, 302)):
+        data = dict(data, csrfmiddlewaretoken=self._csrf(path))
+        return self.request(endpoint, 'POST', path, data=data, files=files,
+                            headers={'Referer': self.base + path}, allow_redirects=False,
+                            ok_status=ok_status)
+
+    def signup(self, username, role):
+        return self.post_form('signup', '/signup/', {
+            'username': username, 'email': f'{username}@load.test', 'password': PASSWORD,
+            'role': role, 'age': 1, 'gender': 'F', 'blood_group': 'O+',
+            'contact_number': '0000000000', 'address': 'Ward 1', 'other_info': '',
+        })
+
+    def login(self, username, role):
+        return self.post_form('login', '/login/', {'username': username, 'password': PASSWORD, 'role': role})
+
+
+def unique_image(sample):
+    """JPEG bytes of ``sample`` with a few random pixels changed, so no two uploads are alike."""
+    with Image.open(sample) as image:
+        image = image.convert('RGB')
+    pixels = image.load()
+    for _ in range(16):
+        pixels[random.randrange(image.width), random.randrange(image.height)] = (
+            random.randrange(256), random.randrange(256), random.randrange(256))
+    out = io.BytesIO()
+    image.save(out, 'JPEG', quality=95)
+    return out.getvalue()
+
+
+def scan(actor, patient_ids, samples):
+    patient_id = random.choice(patient_ids)
+    sample = random.choice(samples)
+    name = os.path.splitext(os.path.basename(sample))[0] + '.jpg'
+    # A stored scan redirects to the dashboard; a 200 is the form again with errors
+    actor.post_form('scan_patient', f'/scan_patient/{patient_id}/', {},
+                    files={'eye_image': (name, unique_image(sample), 'image/jpeg')}, ok_status=(302,))
+
+
+def scanner_dashboard(actor, _patient_ids, _samples):
+    actor.request('scanner_dashboard', 'GET', '/scanner/')
+
+
+def doctor_dashboard(actor, _patient_ids, _samples):
+    actor.request('doctor_dashboard', 'GET', '/doctor-dashboard/')
+
+
+def download_pdf(actor, patient_ids, _samples):
+    resp = actor.request('patient_detail', 'GET', f'/doctor/patient/{random.choice(patient_ids)}/')
+    if resp is None:
+        return
+    pdfs = re.findall(r'href="([^"]+\.pdf)"', resp.text)
+    if pdfs:
+        actor.request('pdf_download', 'GET', random.choice(pdfs))
+
+
+# ---------------- Driver ----------------
+def arrivals(rate, duration, action, actors, pool, patient_ids, samples, stop):
+    """Submit ``action`` as a Poisson process at ``rate`` per second."""
+    if rate <= 0:
+        return
+    end = time.time() + duration
+    next_at = time.time()
+    while not stop.is_set() and next_at < end:
+        delay = next_at - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        pool.submit(action, random.choice(actors), patient_ids, samples)
+        next_at += random.expovariate(rate)
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    k = min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[k]
+
+
+def report(stats, elapsed):
+    print(f"\n{'endpoint':<18} {'reqs':>6} {'req/s':>7} {'p50 ms':>8} {'p90 ms':>8} "
+          f"{'p99 ms':>8} {'max ms':>8} {'errors':>7}")
+    for endpoint in sorted(stats.samples):
+        samples = stats.samples[endpoint]
+        latencies = sorted(s[0] * 1000 for s in samples)
+        errors = sum(1 for s in samples if not s[1])
+        print(f"{endpoint:<18} {len(samples):>6} {len(samples) / elapsed:>7.2f} "
+              f"{percentile(latencies, 50):>8.1f} {percentile(latencies, 90):>8.1f} "
+              f"{percentile(latencies, 99):>8.1f} {latencies[-1]:>8.1f} "
+              f"{100.0 * errors / len(samples):>6.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--duration', type=float, default=60, help="Seconds of load after setup.")
+    parser.add_argument('--patients', type=int, default=50)
+    parser.add_argument('--scanners', type=int, default=4)
+    parser.add_argument('--doctors', type=int, default=2, help="Concurrent doctor sessions.")
+    parser.add_argument('--scan-rate', type=float, default=1.0, help="Scan uploads per second.")
+    parser.add_argument('--dashboard-rate', type=float, default=3.0, help="Dashboard views per second (split scanner/doctor).")
+    parser.add_argument('--pdf-rate', type=float, default=1.0, help="Patient detail + PDF downloads per second.")
+    parser.add_argument('--inference-ms', type=float, default=150, help="Simulated inference time per scan.")
+    parser.add_argument('--concurrency', type=int, default=32, help="Max in-flight requests.")
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--port', type=int, default=8766)
+    parser.add_argument('--keep', action='store_true', help="Keep the temporary database and media.")
+    args = parser.parse_args()
+
+    # media/ also holds photos the fundus validator rejects; uploading those
+    # would count as failed scans
+    samples = [os.path.join(SAMPLE_DIR, f) for f in sorted(os.listdir(SAMPLE_DIR))
+               if f.lower().endswith(('.jpg', '.jpeg', '.png'))]
+    samples = [sample for sample in samples if is_valid_fundus(io.BytesIO(unique_image(sample)))[0]]
+    if not samples:
+        sys.exit(f"No valid sample images found in {SAMPLE_DIR}")
+
+    workdir = tempfile.mkdtemp(prefix='visioncare-load-')
+    server, base = start_server(args, workdir)
+    stats = Stats()
+    try:
+        print(f"Server at {base}, data in {workdir}")
+        setup = Actor(base, stats)
+        for i in range(args.patients):
+            setup.signup(f'patient{i}', 'patient')
+        scanners = []
+        for i in range(args.scanners):
+            setup.signup(f'scanner{i}', 'scanner')
+            actor = Actor(base, stats)
+            actor.login(f'scanner{i}', 'scanner')
+            scanners.append(actor)
+        doctors = []
+        for _ in range(args.doctors):
+            actor = Actor(base, stats)
+            actor.post_form('login', '/login/', {'username': 'dradmin', 'password': 'doctor123', 'role': 'doctor'})
+            doctors.append(actor)
+
+        listing = scanners[0].request('scanner_dashboard', 'GET', '/scanner/')
+        patient_ids = sorted(set(re.findall(r'data-patient-id="(\d+)"', listing.text)))
+        if not patient_ids:
+            raise RuntimeError("no patients visible on the scanner dashboard")
+        stats.samples.clear()
+
+        stop = threading.Event()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            drivers = [
+                (args.scan_rate, scan, scanners),
+                (args.dashboard_rate / 2, scanner_dashboard, scanners),
+                (args.dashboard_rate / 2, doctor_dashboard, doctors),
+                (args.pdf_rate, download_pdf, doctors),
+            ]
+            threads = [threading.Thread(target=arrivals, args=(rate, args.duration, action, actors, pool,
+                                                                patient_ids, samples, stop))
+                       for rate, action, actors in drivers]
+            started = time.time()
+            for t in threads:
+                t.start()
+            try:
+                for t in threads:
+                    t.join()
+            except KeyboardInterrupt:
+                stop.set()
+        report(stats, time.time() - started)
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+            server.wait()
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
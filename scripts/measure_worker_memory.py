@@ -0,0 +1,100 @@
+"""
+Measure per-worker memory with model preloading on and off.
+
+Starts gunicorn twice (VISIONCARE_PRELOAD_MODEL=0 and =1), waits for every
+worker to hold the classifier, then prints USS (memory unique to the worker)
+and PSS (proportional share of shared pages) for each worker.
+
+    python scripts/measure_worker_memory.py --workers 8
+
+Requires gunicorn and psutil (PSS is only reported on Linux).  Only a
+fork-safe backend is shared by preloading (see firstApp/inference.py); with
+the keras backend both runs load one model per worker.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+try:
+    import psutil
+except ImportError:
+    sys.exit("psutil is required: pip install psutil")
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MB = 1024 * 1024
+
+
+def wait_until_stable(workers, settle, timeout):
+    """Wait until worker RSS stops growing (model fully loaded)."""
+    deadline = time.time() + timeout
+    last = None
+    while time.time() < deadline:
+        time.sleep(settle)
+        current = [w.memory_info().rss // MB for w in workers]
+        if current == last:
+            return
+        last = current
+
+
+def measure(preload, args):
+    env = dict(os.environ)
+    env.update({
+        'VISIONCARE_PRELOAD_MODEL': '1' if preload else '0',
+        # Without preloading, make each worker load the model at boot so
+        # both runs are compared with the model resident everywhere.
+        'VISIONCARE_EAGER_MODEL': '1',
+        'GUNICORN_WORKERS': str(args.workers),
+    })
+    master = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py',
+         '--bind', f'127.0.0.1:{args.port}', 'demo.wsgi'],
+        cwd=BASE_DIR, env=env,
+    )
+    try:
+        proc = psutil.Process(master.pid)
+        deadline = time.time() + args.timeout
+        while len(proc.children()) < args.workers:
+            if time.time() > deadline or master.poll() is not None:
+                raise RuntimeError("gunicorn workers did not start")
+            time.sleep(0.5)
+        workers = proc.children()
+        wait_until_stable(workers, args.settle, args.timeout)
+
+        rows = []
+        for w in [proc] + workers:
+            info = w.memory_full_info()
+            rows.append((w.pid, 'master' if w is proc else 'worker',
+                         info.rss / MB, info.uss / MB, getattr(info, 'pss', 0) / MB))
+        return rows
+    finally:
+        master.terminate()
+        master.wait(timeout=30)
+
+
+def report(title, rows):
+    print(f"\n{title}")
+    print(f"{'pid':>8} {'role':>7} {'rss MB':>9} {'uss MB':>9} {'pss MB':>9}")
+    for pid, role, rss, uss, pss in rows:
+        print(f"{pid:>8} {role:>7} {rss:9.1f} {uss:9.1f} {pss:9.1f}")
+    workers = [r for r in rows if r[1] == 'worker']
+    print(f"{'total':>16} {sum(r[2] for r in rows):9.1f} {sum(r[3] for r in rows):9.1f} {sum(r[4] for r in rows):9.1f}")
+    print(f"{'mean/worker':>16} {'':9} {sum(r[3] for r in workers) / len(workers):9.1f} "
+          f"{sum(r[4] for r in workers) / len(workers):9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--settle', type=float, default=3.0, help="Seconds between stability checks.")
+    parser.add_argument('--timeout', type=float, default=300.0)
+    args = parser.parse_args()
+
+    report("Preload OFF (one model per worker)", measure(False, args))
+    report("Preload ON (model shared copy-on-write)", measure(True, args))
+
+
+if __name__ == '__main__':
+    main()
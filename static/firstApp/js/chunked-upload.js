@@ -0,0 +1,187 @@
+// Resumable, chunked upload for the scan form (see firstApp/uploads.py).
+//
+// Each selected image is registered with data-upload-url, sent in chunks
+// (CONCURRENCY at a time, each with its SHA-256) to data-chunk-url, and the
+// finished uploads are submitted together to data-finish-url.  Upload ids are
+// kept in localStorage, so after a dropped connection or a page reload the
+// same files resume from the chunks the server is still missing.  Browsers
+// without fetch/SubtleCrypto fall back to the plain multipart POST.
+(function () {
+
+  "use strict";
+
+  var form = document.querySelector('form[data-upload-url]');
+  if (!form || !window.fetch || !window.crypto || !window.crypto.subtle) { return; }
+
+  var CONCURRENCY = 3;
+  var MAX_ATTEMPTS = 8;
+  var PLACEHOLDER = '00000000-0000-0000-0000-000000000000';
+
+  var progress = form.querySelector('.upload-progress');
+  var statusLine = form.querySelector('.upload-status');
+  var button = form.querySelector('button[type="submit"]');
+  var csrf = form.querySelector('[name="csrfmiddlewaretoken"]').value;
+
+  function say(text) {
+    statusLine.hidden = false;
+    statusLine.textContent = text;
+  }
+
+  function sleep(ms) {
+    return new Promise(function (resolve) { setTimeout(resolve, ms); });
+  }
+
+  function hex(buffer) {
+    return Array.prototype.map.call(new Uint8Array(buffer), function (b) {
+      return ('0' + b.toString(16)).slice(-2);
+    }).join('');
+  }
+
+  function api(method, url, body, headers) {
+    headers = Object.assign({ 'X-CSRFToken': csrf }, headers || {});
+    if (body && !(body instanceof ArrayBuffer)) {
+      headers['Content-Type'] = 'application/json';
+      body = JSON.stringify(body);
+    }
+    return fetch(url, { method: method, body: body, headers: headers, credentials: 'same-origin' })
+      .then(function (resp) {
+        return resp.json().catch(function () { return {}; }).then(function (data) {
+          data.httpStatus = resp.status;
+          return data;
+        });
+      });
+  }
+
+  // Retry network errors and 5xx with backoff; chunk PUTs also retry a 400,
+  // which usually means the bytes were corrupted on the way
+  function withRetry(attempt, retryBadRequest) {
+    var tries = 0;
+    function run() {
+      return attempt().then(function (data) {
+        if (data.httpStatus >= 500 || (retryBadRequest && data.httpStatus === 400)) {
+          throw new Error(data.error || ('HTTP ' + data.httpStatus));
+        }
+        return data;
+      }).catch(function (err) {
+        tries += 1;
+        if (tries >= MAX_ATTEMPTS) { throw err; }
+        say('Connection problem, retrying (' + tries + ')...');
+        return sleep(Math.min(30000, 1000 * Math.pow(2, tries))).then(run);
+      });
+    }
+    return run();
+  }
+
+  function storageKey(item) {
+    var f = item.file;
+    return 'visioncare-upload:' + form.dataset.uploadUrl + ':' + item.eye + ':' +
+      f.name + ':' + f.size + ':' + f.lastModified;
+  }
+
+  function register(item) {
+    var saved = localStorage.getItem(storageKey(item));
+    var resumed = saved
+      ? withRetry(function () { return api('GET', form.dataset.statusUrl.replace(PLACEHOLDER, saved)); })
+      : Promise.resolve({ httpStatus: 404 });
+    return resumed.then(function (status) {
+      if (status.httpStatus === 200) { return status; }
+      return withRetry(function () {
+        return api('POST', form.dataset.uploadUrl, { filename: item.file.name, size: item.file.size, eye: item.eye });
+      }).then(function (created) {
+        if (created.httpStatus !== 201) { throw new Error(created.error || 'Upload rejected'); }
+        localStorage.setItem(storageKey(item), created.id);
+        return created;
+      });
+    });
+  }
+
+  function sendChunk(item, status, offset) {
+    var blob = item.file.slice(offset, Math.min(offset + status.chunk_size, status.size));
+    var url = form.dataset.chunkUrl.replace(PLACEHOLDER, status.id).replace(/\/0\/$/, '/' + offset + '/');
+    return blob.arrayBuffer().then(function (buffer) {
+      return crypto.subtle.digest('SHA-256', buffer).then(function (digest) {
+        return withRetry(function () {
+          return api('PUT', url, buffer, { 'Content-Type': 'application/octet-stream', 'X-Chunk-SHA256': hex(digest) });
+        }, true);
+      }).then(function (result) {
+        if (result.httpStatus !== 200) { throw new Error(result.error || 'Chunk rejected'); }
+        return buffer.byteLength;
+      });
+    });
+  }
+
+  function uploadAll(items, statuses) {
+    var queue = [];
+    var total = 0;
+    var done = 0;
+    statuses.forEach(function (status, i) {
+      total += status.size;
+      done += status.size - status.missing.reduce(function (sum, offset) {
+        return sum + Math.min(status.chunk_size, status.size - offset);
+      }, 0);
+      status.missing.forEach(function (offset) { queue.push([items[i], status, offset]); });
+    });
+
+    progress.hidden = false;
+    function update() {
+      progress.value = total ? done / total : 1;
+      say('Uploading ' + Math.round(100 * progress.value) + '%');
+    }
+    update();
+
+    function worker() {
+      var job = queue.shift();
+      if (!job) { return Promise.resolve(); }
+      return sendChunk(job[0], job[1], job[2]).then(function (bytes) {
+        done += bytes;
+        update();
+        return worker();
+      });
+    }
+    var workers = [];
+    for (var i = 0; i < CONCURRENCY; i++) { workers.push(worker()); }
+    return Promise.all(workers);
+  }
+
+  function selectedFiles() {
+    var items = [];
+    [['left', 'left_images'], ['right', 'right_images'], ['', 'eye_image']].forEach(function (pair) {
+      var input = form.querySelector('[name="' + pair[1] + '"]');
+      if (!input) { return; }
+      Array.prototype.forEach.call(input.files, function (file) { items.push({ eye: pair[0], file: file }); });
+    });
+    return items;
+  }
+
+  form.addEventListener('submit', function (event) {
+    var items = selectedFiles();
+    if (!items.length) { return; }   // let the server report the empty form
+    event.preventDefault();
+    button.disabled = true;
+
+    var statuses;
+    Promise.all(items.map(register))
+      .then(function (result) {
+        statuses = result;
+        return uploadAll(items, statuses);
+      })
+      .then(function () {
+        say('Analysing images...');
+        return api('POST', form.dataset.finishUrl, { uploads: statuses.map(function (s) { return s.id; }) });
+      })
+      .then(function (result) {
+        if (result.httpStatus === 409) { throw new Error('Upload incomplete, please submit again.'); }
+        // Finished or rejected, the server has discarded the uploads either way
+        items.forEach(function (item) { localStorage.removeItem(storageKey(item)); });
+        if (result.httpStatus === 200) {
+          window.location.href = result.redirect;
+          return;
+        }
+        throw new Error((result.errors || [result.error || 'Scan failed']).join(' '));
+      })
+      .catch(function (err) {
+        say('⚠️ ' + err.message);
+        button.disabled = false;
+      });
+  });
+})();
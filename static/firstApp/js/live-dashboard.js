@@ -0,0 +1,108 @@
+// Live dashboard updates over Server-Sent Events.
+//
+// The patient table needs data-events-url, data-detail-url and data-scan-url
+// (with 0 as the user id placeholder); each row carries data-patient-id and
+// its cells data-field="status|date|disease|action|email".  Stat counters use
+// data-count="total_patients|scans_completed|patients_remaining"; events carry
+// changes to add to them, not totals.
+(function () {
+
+  "use strict";
+
+  var table = document.querySelector('[data-events-url]');
+  if (!table || !window.EventSource) { return; }
+
+  var tbody = table.tBodies[0] || table;
+  var rowTemplate = table.querySelector('template');
+
+  function urlFor(pattern, id) {
+    return pattern.replace('/0/', '/' + id + '/');
+  }
+
+  function setCell(row, field, html) {
+    var cell = row.querySelector('[data-field="' + field + '"]');
+    if (cell) { cell.innerHTML = html; }
+  }
+
+  function escapeHtml(text) {
+    var div = document.createElement('div');
+    div.textContent = text;
+    return div.innerHTML;
+  }
+
+  function updateRow(patientId, latest) {
+    var row = tbody.querySelector('tr[data-patient-id="' + patientId + '"]');
+    if (!row) { return; }
+    if (latest) {
+      setCell(row, 'status', '<span class="status-done">Done</span>');
+      setCell(row, 'date', escapeHtml(latest.date_time));
+      setCell(row, 'disease', escapeHtml(latest.disease));
+      setCell(row, 'action', '<a class="button view" href="' + urlFor(table.dataset.detailUrl, patientId) + '">View Report</a>');
+    } else {
+      setCell(row, 'status', '<span class="status-pending">Remaining</span>');
+      setCell(row, 'date', 'N/A');
+      setCell(row, 'disease', '-');
+      setCell(row, 'action', '<a class="button scan" href="' + urlFor(table.dataset.scanUrl, patientId) + '">Scan</a>');
+    }
+  }
+
+  function addRow(data) {
+    if (!rowTemplate || tbody.querySelector('tr[data-patient-id="' + data.patient_id + '"]')) { return; }
+    var row = rowTemplate.content.firstElementChild.cloneNode(true);
+    row.dataset.patientId = data.patient_id;
+    var nameCell = row.querySelector('[data-field="name"]');
+    var link = nameCell && nameCell.querySelector('a');
+    if (link) {
+      link.href = urlFor(table.dataset.detailUrl, data.patient_id);
+      link.textContent = data.username;
+    } else if (nameCell) {
+      nameCell.textContent = data.username;
+    }
+    setCell(row, 'email', escapeHtml(data.email));
+    tbody.appendChild(row);
+    updateRow(data.patient_id, null);
+  }
+
+  function updateCounts(delta) {
+    Object.keys(delta || {}).forEach(function (key) {
+      document.querySelectorAll('[data-count="' + key + '"]').forEach(function (el) {
+        el.textContent = (parseInt(el.textContent, 10) || 0) + delta[key];
+      });
+    });
+  }
+
+  function updateChart(delta) {
+    var chart = window.diseaseChart;
+    if (!chart || !delta) { return; }
+    var labels = chart.data.labels;
+    var values = chart.data.datasets[0].data;
+    Object.keys(delta).forEach(function (disease) {
+      var i = labels.indexOf(disease);
+      if (i === -1) {
+        labels.push(disease);
+        values.push(0);
+        chart.data.datasets[0].backgroundColor.push('rgba(2, 136, 209, 0.7)');
+        i = labels.length - 1;
+      }
+      values[i] = Math.max(0, values[i] + delta[disease]);
+    });
+    chart.update();
+  }
+
+  function onReportChange(e) {
+    var data = JSON.parse(e.data);
+    updateRow(data.patient_id, data.latest);
+    updateCounts(data.counts);
+    updateChart(data.chart);
+  }
+
+  var source = new EventSource(table.dataset.eventsUrl);
+  source.addEventListener('report_created', onReportChange);
+  source.addEventListener('report_deleted', onReportChange);
+  source.addEventListener('patient_added', function (e) {
+    var data = JSON.parse(e.data);
+    addRow(data);
+    updateCounts(data.counts);
+  });
+
+})();
@@ -0,0 +1,54 @@
+// Grad-CAM overlays on the patient detail page.
+//
+// Each "Show Heatmap" button carries data-saliency-url; the overlay is built
+// in the background on first request, so the endpoint answers 202 until it
+// is ready and we poll.  The result goes into the sibling img.saliency.
+(function () {
+
+  "use strict";
+
+  var POLL_MS = 2000;
+  var MAX_POLLS = 60;
+
+  function load(button, polls) {
+    fetch(button.dataset.saliencyUrl, { credentials: 'same-origin' })
+      .then(function (resp) { return resp.json(); })
+      .then(function (data) {
+        if (data.status === 'ready') {
+          var img = button.parentNode.querySelector('img.saliency');
+          img.src = data.url;
+          img.hidden = false;
+          button.textContent = 'Hide Heatmap';
+          button.disabled = false;
+        } else if (data.status === 'pending' && polls < MAX_POLLS) {
+          setTimeout(function () { load(button, polls + 1); }, POLL_MS);
+        } else {
+          button.textContent = 'Heatmap unavailable - retry';
+          button.disabled = false;
+        }
+      })
+      .catch(function () {
+        button.textContent = 'Heatmap unavailable - retry';
+        button.disabled = false;
+      });
+  }
+
+  document.querySelectorAll('[data-saliency-url]').forEach(function (button) {
+    button.addEventListener('click', function () {
+      var img = button.parentNode.querySelector('img.saliency');
+      if (img.src && !img.hidden) {
+        img.hidden = true;
+        button.textContent = 'Show Heatmap';
+        return;
+      }
+      if (img.src) {
+        img.hidden = false;
+        button.textContent = 'Hide Heatmap';
+        return;
+      }
+      button.disabled = true;
+      button.textContent = 'Computing heatmap...';
+      load(button, 0);
+    });
+  });
+})();